@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+bench_geometry.py
+~~~~~~~~~~~~~~~~~
+Benchmark of building the geometry for a synthetic campus, intersecting and
+matching every surface against every other against doing so for each group
+of touching blocks.
+
+The campus has terraces of blocks, each with a shading block across the
+road, laid out on a grid.
+
+Usage::
+
+    python -m manager.benchmarks.bench_geometry [--blocks 100]
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import sys
+
+from geomeppy.polygons import Polygon
+from manager.benchmarks.bench_schedules import best_time
+from manager.benchmarks.bench_schedules import report
+from manager.src.geometry import bounding_box
+from manager.src.geometry import overlapping_groups
+from manager.src.geometry import parse_wkt
+from manager.src.idfsyntax import build_school
+from manager.src.idfsyntax import init_idf
+from manager.src.idfsyntax import set_construction
+
+
+MIN_SPEEDUP = 5
+BLOCKS = 100
+TERRACE = 4  # blocks in each terrace
+SPACING = 60  # metres between terraces
+
+
+def campus(n_blocks=BLOCKS, terrace=TERRACE):
+    """Blocks and shading blocks for a synthetic campus.
+
+    Returns
+    -------
+    tuple of list
+        The blocks and shading blocks, as in schools.json.
+
+    """
+    n_terraces = -(-n_blocks // terrace)
+    columns = int(n_terraces ** 0.5) or 1
+    blocks = []
+    shading_blocks = []
+    for i in range(n_blocks):
+        t, j = divmod(i, terrace)
+        x = (t % columns) * SPACING + j * 10
+        y = (t // columns) * SPACING
+        blocks.append({
+            'name': 'b%i' % i,
+            'wkt': outline(x, y, 10, 8),
+            'height': str(3.5 * (1 + i % 3)),
+            'num_storeys': str(1 + i % 3)})
+        if j == 0:
+            shading_blocks.append({
+                'name': 's%i' % t,
+                'wkt': outline(x, y + 20, 10 * terrace, 6),
+                'height': '9'})
+    return blocks, shading_blocks
+
+
+def outline(x, y, width, depth):
+    return repr([(x, y), (x + width, y), (x + width, y + depth),
+                 (x, y + depth)])
+
+
+def legacy_build_school(idf, blocks, shading_blocks):
+    """build_school as it was, evaluating the outlines and intersecting and
+    matching every surface in the site against every other.
+    """
+    for block in blocks:
+        poly = Polygon(eval(block['wkt']))
+        height = float(block['height']) or 3.25
+        idf.add_block(block['name'], poly.vertices, height,
+                      int(block['num_storeys']))
+    for block in shading_blocks:
+        poly = Polygon(eval(block['wkt']))
+        height = float(block['height'])
+        if height:
+            idf.add_shading_block(block['name'], poly.vertices, height)
+    idf.intersect()
+    idf.match()
+    idf.set_default_constructions()
+    for surface in idf.getsurfaces():
+        set_construction(surface)
+    for surface in idf.idfobjects['FENESTRATIONSURFACE:DETAILED']:
+        set_construction(surface)
+    idf.translate_to_origin()
+    return idf
+
+
+def objects(idf):
+    """The objects in an IDF as text, in a canonical order.
+    """
+    return sorted(str(obj) for key in idf.model.dtls
+                  for obj in idf.idfobjects[key.upper()])
+
+
+def bench_parse(blocks):
+    """Time evaluating the outlines against parsing them.
+    """
+    texts = [block['wkt'] for block in blocks]
+    return (best_time(lambda: [eval(text) for text in texts]),
+            best_time(lambda: [parse_wkt(text) for text in texts]))
+
+
+def bench_build(blocks, shading_blocks):
+    """Time building the campus against the legacy build, and check that the
+    two give the same objects.
+    """
+    results = {}
+
+    def legacy():
+        results['legacy'] = legacy_build_school(
+            init_idf(), blocks, shading_blocks)
+
+    def grouped():
+        results['grouped'] = build_school(
+            init_idf(), 'campus', blocks, shading_blocks)
+
+    times = (best_time(legacy, number=1, repeat=1),
+             best_time(grouped, number=1, repeat=1))
+    if objects(results['legacy']) != objects(results['grouped']):
+        raise AssertionError('Grouped build differs from the legacy build')
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark building the geometry of a synthetic campus.')
+    parser.add_argument('--blocks', type=int, default=BLOCKS,
+                        help='number of blocks (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    blocks, shading_blocks = campus(args.blocks)
+    groups = overlapping_groups([bounding_box(parse_wkt(block['wkt']))
+                                 for block in blocks + shading_blocks])
+    print("{} blocks and {} shading blocks in {} groups".format(
+        len(blocks), len(shading_blocks), len(groups)))
+    results = [
+        report("parsing {} outlines".format(len(blocks)),
+               *bench_parse(blocks), min_speedup=1),
+        report("building {} blocks".format(len(blocks)),
+               *bench_build(blocks, shading_blocks),
+               min_speedup=MIN_SPEEDUP),
+        ]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
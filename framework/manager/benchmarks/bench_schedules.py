@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+bench_schedules.py
+~~~~~~~~~~~~~~~~~~
+Benchmarks for the schedules module, run against the IMF files in
+data/schedules.
+
+Usage::
+
+    python -m manager.benchmarks.bench_schedules
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import glob
+import io
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+from manager.benchmarks import legacy
+from manager.src.schedules import SCHEDULES_DIR
+from manager.src.schedules import WEEKDAYS
+from manager.src.schedules import Schedule
+from manager.src.schedules import stretch
+from manager.src.schedules import write_schedule_csv
+
+
+MIN_SPEEDUP = 50
+MIN_CSV_SPEEDUP = 3  # writing is bounded by formatting floats as text
+
+
+def load_imf_schedules():
+    """Parse every Schedule:Year IMF file in the schedules directory.
+    
+    Returns
+    -------
+    dict
+        Parsed schedules keyed by IMF file name.
+    
+    """
+    schedules = {}
+    for path in sorted(glob.glob(os.path.join(SCHEDULES_DIR, '*.imf'))):
+        with io.open(path, encoding='utf-8') as f:
+            schedule = Schedule(f.read())
+        if schedule.years:  # rate files hold a single value
+            schedules[os.path.basename(path)] = schedule
+    return schedules
+
+
+def best_time(func, number=10, repeat=3):
+    """Best time per call in seconds over several repeats.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def bench_hourly_schedule(schedules):
+    """Time the day-by-day walk against the compiled evaluation.
+    
+    The compiled timing includes compiling the schedule, so it is the cost of
+    the first evaluation of a freshly parsed schedule.
+    
+    Returns
+    -------
+    tuple of float
+        Total seconds for the legacy and compiled evaluation of all schedules.
+    
+    """
+    def compiled(schedule):
+        schedule._compiled = None
+        return schedule.hourly_array
+
+    legacy_total = 0
+    compiled_total = 0
+    for schedule in schedules.values():
+        legacy_total += best_time(
+            lambda: legacy.hourly_schedule(schedule), number=3)
+        compiled_total += best_time(lambda: compiled(schedule), number=100)
+    return legacy_total, compiled_total
+
+
+def bench_stretch(schedules, coef=1.1):
+    """Time stretching each schedule a day at a time against the whole year.
+    
+    Returns
+    -------
+    tuple of float
+        Total seconds for the legacy and vectorised stretch of all schedules.
+    
+    """
+    legacy_total = 0
+    vectorised_total = 0
+    for schedule in schedules.values():
+        hourly = schedule.hourly_schedule
+        legacy_total += best_time(
+            lambda: legacy.stretch(hourly, coef, 12), number=1)
+        vectorised_total += best_time(lambda: stretch(hourly, coef, 12))
+    return legacy_total, vectorised_total
+
+
+def bench_write_csv(n_columns=500):
+    """Time writing a schedules CSV a row at a time against in chunks.
+    
+    Returns
+    -------
+    tuple of float
+        Seconds for the legacy and chunked writers.
+    
+    """
+    # like NCM schedules, each column has a few day profiles on a calendar
+    # of weekdays, weekends and holidays
+    rng = np.random.RandomState(0)
+    day_types = np.where(WEEKDAYS < 5, 0, 1)
+    day_types[200:250] = 2
+    columns = OrderedDict(
+        ('Col_%i' % i,
+         np.round(rng.rand(3, 24) * 100, 2)[day_types].ravel().tolist())
+        for i in range(n_columns))
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'schedules.csv')
+        legacy_time = best_time(
+            lambda: legacy.write_schedules_file(columns, path), number=1)
+        chunked_time = best_time(
+            lambda: write_schedule_csv(path, columns), number=1)
+    finally:
+        shutil.rmtree(tmp)
+    return legacy_time, chunked_time
+
+
+def report(title, legacy_total, optimised_total, min_speedup=MIN_SPEEDUP):
+    """Print a comparison and return whether it meets the target speedup.
+    """
+    speedup = legacy_total / optimised_total
+    print(title)
+    print("  legacy:    {:10.2f} ms".format(legacy_total * 1000))
+    print("  optimised: {:10.2f} ms".format(optimised_total * 1000))
+    print("  speedup:   {:10.1f}x".format(speedup))
+    if speedup < min_speedup:
+        print("  speedup is below the target of {}x".format(min_speedup))
+        return False
+    return True
+
+
+def main():
+    schedules = load_imf_schedules()
+    results = [
+        report("hourly_schedule over {} IMF schedules".format(len(schedules)),
+               *bench_hourly_schedule(schedules)),
+        report("stretch over {} IMF schedules".format(len(schedules)),
+               *bench_stretch(schedules)),
+        report("schedules CSV with 500 columns",
+               *bench_write_csv(500), min_speedup=MIN_CSV_SPEEDUP),
+        ]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
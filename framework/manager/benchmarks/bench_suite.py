@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+bench_suite.py
+~~~~~~~~~~~~~~
+Timing and peak memory of the schedules module, checked against a baseline.
+
+Each case is timed against the IMF files in data/schedules or a synthetic
+model with 50, 200 or 1000 zones. The results are compared with a JSON
+baseline, and a case which is slower or uses more memory than the baseline by
+more than the threshold is reported as a regression.
+
+Usage::
+
+    python -m manager.benchmarks.bench_suite            # compare
+    python -m manager.benchmarks.bench_suite --save     # record a baseline
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+
+import numpy as np
+
+from manager.benchmarks.bench_schedules import best_time
+from manager.benchmarks.bench_schedules import load_imf_schedules
+from manager.src.schedules import SCHEDULES_DIR
+from manager.src.schedules import Schedule
+from manager.src.schedules import activities_proportions
+from manager.src.schedules import area_weight_schedules
+from manager.src.schedules import make_schedules
+from manager.src.schedules import schedule_library
+from manager.src.schedules import set_saturday_as_workday
+from manager.src.schedules import stretch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+BASELINE = os.path.join(THIS_DIR, 'baseline.json')
+THRESHOLD = 1.5  # allowed ratio to the baseline
+ZONE_COUNTS = [50, 200, 1000]
+SCHEDULE_TYPES = ['Heat', 'Cool', 'Light', 'Equip', 'Occ']
+# ru_maxrss is in bytes on macOS and kilobytes elsewhere
+MAXRSS_BYTES = 1 if sys.platform == 'darwin' else 1024
+
+
+class Zone(object):
+    """Stand-in for an IDF zone, which only needs a name.
+    """
+
+    def __init__(self, name):
+        self.Name = name
+
+
+def peak_memory(func):
+    """Peak memory allocated while calling a function, in bytes.
+
+    tracemalloc is used where there is one. Otherwise, as on Python 2, the
+    function is called in a forked process and the growth of its peak
+    resident set size is measured.
+
+    Raises
+    ------
+    RuntimeError
+        If memory cannot be measured on this platform.
+
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    if resource is None or not hasattr(os, 'fork'):
+        raise RuntimeError('Peak memory cannot be measured on this platform')
+    return peak_rss_growth(func)
+
+
+def peak_rss_growth(func):
+    """Growth of the peak resident set size while calling a function in a
+    forked process, in bytes.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # the child only reports the growth, then exits
+        try:
+            os.close(read)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func()
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write, str(after - before).encode('ascii'))
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        output = f.read()
+    os.waitpid(pid, 0)
+    if not output:
+        raise RuntimeError('Could not measure the peak memory of {}'.format(
+            getattr(func, '__name__', func)))
+    return int(output) * MAXRSS_BYTES
+
+
+def cases():
+    """The benchmark cases.
+
+    Returns
+    -------
+    OrderedDict
+        A function to call for each case, keyed by the case name.
+
+    """
+    texts = []
+    for path in sorted(glob.glob(os.path.join(SCHEDULES_DIR, '*.imf'))):
+        with io.open(path, encoding='utf-8') as f:
+            texts.append(f.read())
+    schedules = list(load_imf_schedules().values())
+    hourly = [np.nan_to_num(schedule.hourly_array) for schedule in schedules]
+    areas = np.linspace(1, 2, len(hourly))
+    activities = activities_proportions(1000)
+    schedule_library()  # load the library outside the timings
+
+    def hourly_schedule():
+        for schedule in schedules:
+            schedule._compiled = None
+            schedule.hourly_array
+
+    found = OrderedDict([
+        ('parse_schedule', lambda: [Schedule(text) for text in texts]),
+        ('hourly_schedule', hourly_schedule),
+        ('stretch', lambda: [stretch(h, 1.1, 12) for h in hourly]),
+        ('area_weight_schedules',
+         lambda: area_weight_schedules(hourly, areas)),
+        ('set_saturday_as_workday',
+         lambda: [set_saturday_as_workday(h) for h in hourly]),
+        ])
+    for n in ZONE_COUNTS:
+        zones = [Zone('Zone%i' % i) for i in range(n)]
+        found['make_schedules_%i_zones' % n] = (
+            lambda zones=zones: make_schedules(
+                zones, SCHEDULE_TYPES, activities))
+    return found
+
+
+def run(number=5, repeat=3):
+    """Time each case and measure its peak memory.
+
+    Returns
+    -------
+    OrderedDict
+        {'seconds': float, 'peak_bytes': int} for each case.
+
+    """
+    results = OrderedDict()
+    for name, func in cases().items():
+        results[name] = {'seconds': best_time(func, number, repeat),
+                         'peak_bytes': peak_memory(func)}
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Print the results against the baseline and list any regressions.
+
+    Returns
+    -------
+    list of str
+        Names of the cases which exceed the baseline by more than the
+        threshold.
+
+    """
+    regressions = []
+    print("{:32} {:>12} {:>12} {:>10}".format(
+        'case', 'ms', 'baseline ms', 'peak kB'))
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        peak = result['peak_bytes']
+        print("{:32} {:12.3f} {:>12} {:>10}".format(
+            name, result['seconds'] * 1000,
+            '{:.3f}'.format(base['seconds'] * 1000) if base else '-',
+            peak // 1024))
+        if not base:
+            continue
+        slower = result['seconds'] > base['seconds'] * threshold
+        # baselines saved before memory was measured on Python 2 have none
+        bigger = (base.get('peak_bytes') is not None and
+                  peak > base['peak_bytes'] * threshold)
+        if slower or bigger:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the schedules module against a baseline.')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline file (default: %(default)s)')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed ratio to the baseline '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    results = run()
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Baseline saved to {}".format(args.baseline))
+        return 0
+    if not baseline:
+        print("No baseline found, run with --save to record one")
+    for name in regressions:
+        print("Regression in {}: more than {}x the baseline".format(
+            name, args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+legacy.py
+~~~~~~~~~
+Reference implementations of schedule functions which have since been
+optimised. These are kept to check that the optimised versions give the same
+results, and to measure the speedup in the benchmarks.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from dateutil.rrule import rrule, DAILY
+import numpy as np
+
+
+def hourly_schedule(schedule):
+    """Step through each Schedule:Year period one day at a time.
+    
+    Parameters
+    ----------
+    schedule : schedules.Schedule
+        A parsed schedule.
+    
+    Returns
+    -------
+    list
+        8760 hourly values, with 'n/a' for hours outside all periods.
+    
+    """
+    day_list = ['Monday','Tuesday','Wednesday','Thursday','Friday',
+                'Saturday','Sunday'
+                ]
+    year_of_hours = ['n/a'] * 8760  # initialise with a flag value of n/a
+    for y in schedule.years:
+        # for each period
+        for p in schedule.years[y].periods:
+            a = schedule.years[y].periods[p]['start']
+            b = schedule.years[y].periods[p]['end']
+            # step through the period one day at a time
+            for dt in rrule(DAILY, dtstart=a, until=b):
+                day_of_year = dt.timetuple().tm_yday
+                # look up the day type
+                days = schedule.weeks[p.split('#')[0]].days
+                d = day_list[dt.weekday()]
+                # store the value for each hour in the period
+                for i, h_val in enumerate(schedule.days[days[d]].hourly_values):
+                    hour_num = (day_of_year - 1) * 24 + i
+                    year_of_hours[hour_num] = float(h_val)
+    return year_of_hours
+
+
+def stretch(xs, coef, centre, grain=100):
+    """Stretch each day by repeating every value grain * coef times.
+    
+    The repeat count is truncated to an integer, as older versions of numpy
+    did implicitly.
+    
+    Parameters
+    ----------
+    xs : list
+        Input values, in whole days of 24 hours.
+    coef : float
+        Coefficient to scale by.
+    centre : int
+        Position in the list to use as a centre point.
+    grain : int, optional
+        Number of samples per hour (default: 100).
+    
+    Returns
+    -------
+    list
+    
+    """
+    if coef == 0:
+        return xs
+    stretched_xs = []
+    days = [xs[i:i + 24] for i in range(0, len(xs), 24)]
+    for xs in days:
+        stretched_array = np.repeat(xs, int(grain * coef))
+        
+        if coef < 1:
+            # pad start and end
+            total_pad_len = grain * len(xs) - len(stretched_array)
+            centre_pos = float(centre) / len(xs)
+            start_pad_len = centre_pos * total_pad_len
+            end_pad_len = (1 - centre_pos) * total_pad_len
+            start_pad = [stretched_array[0]] * int(start_pad_len)
+            end_pad = [stretched_array[-1]] * int(end_pad_len)
+            stretched_array = np.array(start_pad + list(stretched_array) + end_pad)
+        else:
+            pivot_point = (len(xs) - centre) * grain * coef
+            first = int(pivot_point - (len(xs) * grain) / 2)
+            last = first + len(xs) * grain
+            stretched_array = stretched_array[first:last]
+        
+        stretched_xs.extend(
+            [round(stretched_array[i:i + grain].mean(), 2)
+             for i in range(0, len(stretched_array), grain)])
+    return stretched_xs
+
+
+def write_schedules_file(columns, path):
+    """Transpose to a tuple per hour and format each value with str.
+    
+    Parameters
+    ----------
+    columns : OrderedDict
+        Hourly schedules keyed by column header.
+    path : str
+        Path to the CSV file.
+    
+    """
+    hourly_schedules = zip(*columns.values())
+    header = ','.join(columns) + '\n'
+    with open(path, 'wb') as csv:
+        csv.write(header.encode('ascii'))
+        for hour in hourly_schedules:
+            csv.write((','.join([str(h) for h in hour]) + '\n').encode('ascii'))
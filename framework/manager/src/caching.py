@@ -0,0 +1,211 @@
+"""
+caching.py
+~~~~~~~~~~
+Caches shared by the job building code.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+def file_key(path):
+    """Identify the current version of a file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+
+    Returns
+    -------
+    tuple
+        (absolute path, modification time, size in bytes).
+
+    Raises
+    ------
+    OSError
+        If the file does not exist.
+
+    """
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime, stat.st_size
+
+
+class LRUCache(object):
+    """A size-bounded mapping which evicts the least recently used item.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of items to hold (default: 128).
+
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, key):
+        value = self._items.pop(key)  # re-inserted as most recently used
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Fetch an item, counting the lookup as a hit or a miss.
+        """
+        try:
+            value = self[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def clear(self):
+        self._items.clear()
+
+
+def stable_hash(*parts):
+    """Hash values which can be serialised to JSON, the same in every process.
+
+    Parameters
+    ----------
+    parts : list
+        Values to hash. Dicts are hashed independent of their key order.
+
+    Returns
+    -------
+    str
+        A hex digest.
+
+    """
+    text = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def link_or_copy(source, destination):
+    """Hardlink a file, or copy it where hardlinks are not available.
+    """
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except (AttributeError, OSError):
+        shutil.copy(source, destination)
+
+
+class DiskCache(object):
+    """A size-bounded directory of cached files which evicts the least
+    recently used entries.
+
+    Each entry is a directory of files named by its key. Using an entry
+    updates its modification time, which orders the entries for eviction.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to hold the cache.
+    maxsize : int, optional
+        Maximum total size of the cached files in bytes (default: 512 MB).
+
+    """
+
+    def __init__(self, directory, maxsize=512 * 2 ** 20):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key, name):
+        """Path to a file in an entry.
+        """
+        return os.path.join(self.directory, key, name)
+
+    def get(self, key):
+        """Find an entry, counting the lookup as a hit or a miss.
+
+        Returns
+        -------
+        str or None
+            The entry's directory, or None if the key is not cached.
+
+        """
+        entry = os.path.join(self.directory, key)
+        if not os.path.isdir(entry):
+            self.misses += 1
+            return None
+        os.utime(entry, None)
+        self.hits += 1
+        return entry
+
+    def put(self, key, files, texts=None):
+        """Add an entry, then evict old entries to stay inside maxsize.
+
+        Parameters
+        ----------
+        key : str
+            Key for the entry, e.g. from stable_hash.
+        files : dict
+            Path of the file to store, keyed by its name in the entry.
+        texts : dict, optional
+            Text to store, keyed by its file name in the entry.
+
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        entry = os.path.join(self.directory, key)
+        # build the entry in a temporary directory so it appears complete
+        tmp = tempfile.mkdtemp(prefix='.', dir=self.directory)
+        for name, source in files.items():
+            shutil.copy(source, os.path.join(tmp, name))
+        for name, text in (texts or {}).items():
+            with open(os.path.join(tmp, name), 'wb') as f:
+                f.write(text.encode('utf-8'))
+        try:
+            os.rename(tmp, entry)
+        except OSError:  # another process added the same entry
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until inside maxsize.
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue  # not an entry, or an entry still being added
+            size = sum(os.path.getsize(os.path.join(entry, name))
+                       for name in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+        total = sum(size for _mtime, size, _entry in entries)
+        for _mtime, size, entry in sorted(entries):
+            if total <= self.maxsize:
+                break
+            logging.debug("Evicting {} from the cache".format(entry))
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
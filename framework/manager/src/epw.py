@@ -0,0 +1,180 @@
+"""
+epw.py
+~~~~~~
+Reading EnergyPlus weather files.
+
+The hourly data in an EPW file is parsed once into a NumPy record array, which
+is saved next to the EPW file as a .npy file named with a hash of the EPW's
+contents. Later reads, in this or any other process, memory-map that file
+instead of parsing the text, and columns are views onto it.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import glob
+import hashlib
+import io
+import logging
+import os
+
+import numpy as np
+
+from manager.src.caching import LRUCache
+from manager.src.caching import file_key
+
+
+HEADER_LINES = 8
+EPW_FIELDS = [
+    ('year', np.int16), ('month', np.int8), ('day', np.int8),
+    ('hour', np.int8), ('minute', np.int8), ('datasource', 'S64'),
+    ('drybulb', np.float64), ('dewpoint', np.float64),
+    ('relhum', np.float64), ('atmos_pressure', np.float64),
+    ('exthorrad', np.float64), ('extdirrad', np.float64),
+    ('horirsky', np.float64), ('glohorrad', np.float64),
+    ('dirnorrad', np.float64), ('difhorrad', np.float64),
+    ('glohorillum', np.float64), ('dirnorillum', np.float64),
+    ('difhorillum', np.float64), ('zenlum', np.float64),
+    ('winddir', np.float64), ('windspd', np.float64),
+    ('totskycvr', np.float64), ('opaqskycvr', np.float64),
+    ('visibility', np.float64), ('ceiling_hgt', np.float64),
+    ('presweathobs', np.float64), ('presweathcodes', 'S16'),
+    ('precip_wtr', np.float64), ('aerosol_opt_depth', np.float64),
+    ('snowdepth', np.float64), ('days_last_snow', np.float64),
+    ('Albedo', np.float64), ('liq_precip_depth', np.float64),
+    ('liq_precip_rate', np.float64)]
+EPW_DTYPE = np.dtype([(str(name), dtype) for name, dtype in EPW_FIELDS])
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+                 'Saturday', 'Sunday']
+
+weather_files = LRUCache(maxsize=8)
+
+
+def read_epw(path):
+    """The hourly data in a weather file, parsed at most once per machine.
+
+    Parameters
+    ----------
+    path : str
+        Path to an EPW file.
+
+    Returns
+    -------
+    np.ndarray
+        A read-only record array with a field for each of EPW_FIELDS.
+
+    """
+    key = file_key(path)
+    data = weather_files.get(key)
+    if data is None:
+        data = load_cached(path)
+        weather_files[key] = data
+    return data
+
+
+def column(path, name):
+    """A view of one column of a weather file, e.g. 'drybulb'.
+    """
+    return read_epw(path)[name]
+
+
+def cache_path(path):
+    """Path of the .npy cache for the current contents of an EPW file.
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return '{}.{}.npy'.format(path, digest[:16])
+
+
+def load_cached(path):
+    """Memory-map the cached data for a weather file, creating it if needed.
+
+    If the cache cannot be written, the parsed data is returned instead.
+
+    """
+    npy = cache_path(path)
+    if os.path.isfile(npy):
+        return np.load(npy, mmap_mode='r')
+    data = parse_epw(path)
+    for stale in glob.glob('{}.*.npy'.format(path)):
+        try:
+            os.remove(stale)  # caches of earlier versions of the file
+        except OSError:
+            pass
+    try:
+        tmp = '{}.{}.tmp'.format(npy, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, data)
+        if os.path.exists(npy):
+            os.remove(npy)
+        os.rename(tmp, npy)
+    except (IOError, OSError):
+        logging.debug("Could not cache weather file {}".format(path))
+        data.flags.writeable = False
+        return data
+    return np.load(npy, mmap_mode='r')
+
+
+def parse_epw(path):
+    """Parse the hourly data in a weather file.
+
+    Parameters
+    ----------
+    path : str
+        Path to an EPW file.
+
+    Returns
+    -------
+    np.ndarray
+        A record array with a field for each of EPW_FIELDS. Missing trailing
+        fields are NaN.
+
+    """
+    n_fields = len(EPW_FIELDS)
+    rows = []
+    with io.open(path, encoding='latin-1') as f:
+        for i, line in enumerate(f):
+            if i < HEADER_LINES or not line.strip():
+                continue
+            fields = line.rstrip('\r\n').split(',')[:n_fields]
+            fields += ['nan'] * (n_fields - len(fields))
+            rows.append(tuple(fields))
+    data = np.empty(len(rows), dtype=EPW_DTYPE)
+    for i, (name, dtype) in enumerate(EPW_FIELDS):
+        values = [row[i] for row in rows]
+        if np.dtype(dtype).kind == 'S':
+            data[name] = [value.encode('latin-1') for value in values]
+        else:
+            data[name] = np.array(values, dtype=np.float64)
+    return data
+
+
+def first_weekday(path):
+    """Read the weekday on which the data in a weather file starts.
+
+    Parameters
+    ----------
+    path : str
+        Path to an EPW file.
+
+    Returns
+    -------
+    int or None
+        Weekday, where Monday is 0, or None if it cannot be read.
+
+    """
+    if not path or not os.path.isfile(path):
+        return None
+    with io.open(path, encoding='latin-1') as f:
+        for i, line in enumerate(f):
+            if i >= HEADER_LINES:
+                break
+            fields = line.split(',')
+            if fields[0] == 'DATA PERIODS':
+                start_day = fields[4].strip().capitalize()
+                if start_day in WEEKDAY_NAMES:
+                    return WEEKDAY_NAMES.index(start_day)
+                return None
+    return None
@@ -0,0 +1,260 @@
+"""
+geometry.py
+~~~~~~~~~~~
+Block outlines and a spatial index over their bounding boxes.
+
+Outlines in schools.json are parsed without evaluating them. Surfaces of
+blocks whose outlines are apart can never intersect or match, so blocks are
+indexed by their bounding boxes on a uniform grid and split into groups of
+blocks whose boxes overlap or touch. Each group can then be intersected and
+matched on its own, which is quadratic in the size of the group rather than
+in the size of the whole site.
+
+The same index finds the shading surfaces which are too far from the
+buildings, or too low on their horizon, to be worth simulating.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import math
+import re
+
+
+TOLERANCE = 0.01  # gap in metres at which bounding boxes are taken to touch
+
+# 'POLYGON ((x y, x y, ...), (hole), ...)', of which the outer ring is used
+WKT_POLYGON = re.compile(r'\s*POLYGON\s*Z?\s*\(\s*\(([^()]*)\)',
+                         re.IGNORECASE)
+# '[(x, y), ...]' or '[Vector3D(x, y, z), ...]'
+POINT = re.compile(r'(?:Vector[23]D)?\s*[(\[]([^()\[\]]*)[)\]]')
+LITERAL = re.compile(r'^\s*[(\[]?(?:\s*(?:Vector[23]D)?\s*[(\[][-+.\deE\s,]*'
+                     r'[)\]]\s*,?)+\s*[)\]]?\s*$')
+
+
+def parse_wkt(text):
+    """Parse a block outline, without evaluating it.
+
+    Outlines may be WKT polygons, e.g. 'POLYGON ((0 0, 10 0, 10 10, 0 0))',
+    or lists of points, e.g. '[(0, 0), (10, 0), (10, 10)]' or
+    '[Vector3D(0, 0, 0), ...]'.
+
+    Parameters
+    ----------
+    text : str
+        The outline.
+
+    Returns
+    -------
+    list of tuple
+        (x, y) or (x, y, z) for each vertex. The closing vertex of a WKT
+        polygon, which repeats the first, is dropped.
+
+    Raises
+    ------
+    ValueError
+        If the text is not an outline with at least three vertices.
+
+    """
+    wkt = WKT_POLYGON.match(text)
+    if wkt:
+        points = [point.split() for point in wkt.group(1).split(',')]
+    elif LITERAL.match(text):
+        points = [point.split(',') for point in POINT.findall(text)]
+    else:
+        raise ValueError('Not a block outline: {!r}'.format(text))
+    try:
+        vertices = [tuple(float(x) for x in point) for point in points]
+    except ValueError:
+        raise ValueError('Invalid coordinates in outline: {!r}'.format(text))
+    if any(len(vertex) not in (2, 3) for vertex in vertices):
+        raise ValueError('Invalid coordinates in outline: {!r}'.format(text))
+    if wkt and len(vertices) > 1 and vertices[0] == vertices[-1]:
+        vertices.pop()
+    if len(vertices) < 3:
+        raise ValueError('Too few vertices in outline: {!r}'.format(text))
+    return vertices
+
+
+def bounding_box(vertices):
+    """The bounding box of an outline in plan.
+
+    Returns
+    -------
+    tuple
+        (xmin, ymin, xmax, ymax)
+
+    """
+    xs = [vertex[0] for vertex in vertices]
+    ys = [vertex[1] for vertex in vertices]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def boxes_overlap(box, other, tolerance=0.0):
+    """Whether two bounding boxes overlap, or are within tolerance of it.
+    """
+    return (box[0] <= other[2] + tolerance and other[0] <= box[2] + tolerance
+            and box[1] <= other[3] + tolerance and
+            other[1] <= box[3] + tolerance)
+
+
+def box_distance(box, other):
+    """Distance between two bounding boxes in plan, 0 if they overlap.
+    """
+    dx = max(other[0] - box[2], box[0] - other[2], 0)
+    dy = max(other[1] - box[3], box[1] - other[3], 0)
+    return math.hypot(dx, dy)
+
+
+class SpatialIndex(object):
+    """
+    Bounding boxes on a uniform grid, for finding boxes near each other.
+
+    Parameters
+    ----------
+    cell_size : float
+        Width of the grid cells. Boxes a little smaller than the cells give
+        the fewest comparisons.
+
+    """
+
+    def __init__(self, cell_size):
+        if cell_size <= 0:
+            raise ValueError('Cell size must be positive')
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.boxes = []
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def cells_for(self, box, tolerance=0.0):
+        """The grid cells covered by a box, grown by tolerance.
+        """
+        size = self.cell_size
+        x0 = int(math.floor((box[0] - tolerance) / size))
+        y0 = int(math.floor((box[1] - tolerance) / size))
+        x1 = int(math.floor((box[2] + tolerance) / size))
+        y1 = int(math.floor((box[3] + tolerance) / size))
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def insert(self, box):
+        """Add a box.
+
+        Returns
+        -------
+        int
+            Index of the box, in order of insertion.
+
+        """
+        i = len(self.boxes)
+        self.boxes.append(box)
+        for cell in self.cells_for(box):
+            self.cells[cell].append(i)
+        return i
+
+    def query(self, box, tolerance=0.0):
+        """Indices of the boxes within tolerance of a box, in order.
+        """
+        found = set()
+        for cell in self.cells_for(box, tolerance):
+            found.update(self.cells.get(cell, ()))
+        return sorted(i for i in found
+                      if boxes_overlap(box, self.boxes[i], tolerance))
+
+    def pairs(self, tolerance=0.0):
+        """Pairs of indices (i, j), i < j, of boxes within tolerance of each
+        other, in order.
+        """
+        found = set()
+        for i, box in enumerate(self.boxes):
+            for j in self.query(box, tolerance):
+                if i < j:
+                    found.add((i, j))
+        return sorted(found)
+
+
+def index_boxes(boxes):
+    """A SpatialIndex of boxes, with cells the size of an average box.
+    """
+    extent = sum(max(box[2] - box[0], box[3] - box[1]) for box in boxes)
+    index = SpatialIndex(max(extent / len(boxes), 1.0))
+    for box in boxes:
+        index.insert(box)
+    return index
+
+
+def overlapping_groups(boxes, tolerance=TOLERANCE):
+    """Split boxes into groups connected by overlapping or touching.
+
+    Parameters
+    ----------
+    boxes : list of tuple
+        (xmin, ymin, xmax, ymax) for each box.
+    tolerance : float, optional
+        Gap at which boxes are taken to touch (default: TOLERANCE).
+
+    Returns
+    -------
+    list of list of int
+        Indices of the boxes in each group, in order of their first box.
+
+    """
+    if not boxes:
+        return []
+    index = index_boxes(boxes)
+    parent = list(range(len(boxes)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in index.pairs(tolerance):
+        i, j = sorted((root(i), root(j)))
+        parent[j] = i
+    groups = defaultdict(list)
+    for i in range(len(boxes)):
+        groups[root(i)].append(i)
+    return [groups[i] for i in sorted(groups)]
+
+
+def cull_shading(buildings, shading, distance, horizon_angle=0.0):
+    """Find shading surfaces which are too far away to shade the buildings.
+
+    Parameters
+    ----------
+    buildings : list of tuple
+        Bounding boxes of the building surfaces.
+    shading : list of tuple
+        (bounding box, height of the top) for each shading surface.
+    distance : float
+        Distance in plan from the nearest building surface beyond which
+        shading surfaces are culled.
+    horizon_angle : float, optional
+        Angle in degrees above the horizon, seen from the ground at the
+        nearest building surface, below which the top of a shading surface
+        is culled (default: 0).
+
+    Returns
+    -------
+    list of int
+        Indices of the shading surfaces to cull.
+
+    """
+    if not buildings:
+        return list(range(len(shading)))
+    index = index_boxes(buildings)
+    culled = []
+    for i, (box, height) in enumerate(shading):
+        gaps = [box_distance(box, buildings[j])
+                for j in index.query(box, distance)]
+        gaps = [gap for gap in gaps if gap <= distance]
+        if not gaps or math.degrees(
+                math.atan2(height, min(gaps))) < horizon_angle:
+            culled.append(i)
+    return culled
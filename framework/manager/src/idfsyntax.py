@@ -4,89 +4,138 @@ idfsyntax.py
 Module to convert an idf based on the job parameters passed in. This can be
 changed to suit the job in hand.
 
+The geometry for every school can be built ahead of a campaign with::
+
+    python -m manager.src.idfsyntax [-p processes] [school ...]
+
 """
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+from functools import partial
+import argparse
+import datetime
 import json
 import logging
+import multiprocessing
 import os
 import shutil
 
 from eppy.function_helpers import getcoords
 
-from geomeppy import IDF
 from geomeppy.polygons import Polygon
-from geomeppy.vectors import Vector3D  # used inside eval
+from manager.src.caching import DiskCache
+from manager.src.caching import link_or_copy
+from manager.src.caching import stable_hash
+from manager.src.config import config
+from manager.src import epw
+from manager.src.epw import WEEKDAY_NAMES
+from manager.src.geometry import bounding_box
+from manager.src.geometry import cull_shading
+from manager.src.geometry import overlapping_groups
+from manager.src.geometry import parse_wkt
+from manager.src.models import GeometryCache
+from manager.src.models import merge
+from manager.src.models import models
+from manager.src.pipeline import Stage
+from manager.src.pipeline import StagedBuilder
+from manager.src.schedules import DEFAULT_YEAR
+from manager.src.schedules import ScheduleSet
 from manager.src.schedules import activities_proportions
 from manager.src.schedules import make_rates
 from manager.src.schedules import make_schedules
-from manager.src.schedules import stretch
+from manager.src.schedules import schedule_digest
+from manager.src.schedules import schedule_sources_digest
+from manager.src.schedules import write_schedule_csv
+from manager.src.sites import sites
 
 
 logging.basicConfig(level=logging.DEBUG)
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
-sites_file = os.path.join(THIS_DIR, os.pardir, 'data/schools.json')
 
 #logging.basicConfig(filename='../var/log/eplus.log', level=logging.DEBUG)
 
 DDY = os.path.join(
     THIS_DIR, os.pardir, 'data/weather/islington/cntr_Islington_TRY.ddy')
-IDD = os.path.join(THIS_DIR, os.pardir, 'data/idd/Energy+.idd')
+# design days to copy from the DDY, found by text in their names
+DESIGN_DAYS = ['Htg 99%', 'Clg 1%']
 GEOMETRY_CACHE = os.path.join(THIS_DIR, os.pardir, 'data/cached')
-
-
-def prepare_idf(job):
+SCHEDULE_CACHE = os.path.join(GEOMETRY_CACHE, 'schedule_csvs')
+GEOMETRY_MODELS = os.path.join(GEOMETRY_CACHE, 'geometry')
+STAGING = os.path.join(THIS_DIR, 'staging')
+STAGE_FILES = os.path.join(GEOMETRY_CACHE, 'stage_files')
+SCHEDULE_BATCH = os.path.join(GEOMETRY_CACHE, 'schedule_batch.npy')
+SHADING_REPORT = 'shading.json'  # shading surfaces culled, in the build dir
+SHADING_KEYS = ['SHADING:SITE:DETAILED', 'SHADING:BUILDING:DETAILED']
+# shading surfaces lower than this on the horizon of the nearest building
+# surface, in degrees, are culled
+SHADING_HORIZON_ANGLE = 2.0
+
+# schedules are written as Schedule:File columns of a CSV ('file'), as
+# Schedule:Year/Week/Day objects ('compact'), or as compact objects where
+# possible and Schedule:File otherwise ('auto'), as set by mode in the
+# Schedules section of the config file
+SCHEDULE_MODES = ('file', 'compact', 'auto')
+SCHEDULE_MODE = 'file'
+MAX_SCHEDULE_PERIODS = 53  # week schedules allowed in a Schedule:Year
+MAX_DAY_PROFILES = 52  # beyond this a CSV column is smaller and clearer
+OTHER_DAY_TYPES = ['Holiday', 'SummerDesignDay', 'WinterDesignDay',
+                   'CustomDay1', 'CustomDay2']
+
+# finished schedule CSVs, shared by jobs with the same floor area, zones and
+# stretch coefficient, and the same version of the schedule data
+schedule_cache = DiskCache(SCHEDULE_CACHE)
+# built geometry, shared by schools with the same blocks
+geometry_cache = GeometryCache(GEOMETRY_MODELS)
+
+
+def prepare_idf(job, batch=None, build_dir=None, next_job=None):
+    """Build the IDF for a job, with its weather and schedule files.
+    
+    All the files are written to the build directory, and the working
+    directory is never changed, so jobs can be built in parallel. The IDF is
+    built by the job_builder stages, starting from the state shared with an
+    earlier job where there is one.
+    
+    Parameters
+    ----------
+    job : dict
+        The job parameters. The unique_id and geometry are popped.
+    batch : ScheduleBatch, optional
+        Schedules computed for all the jobs in a campaign.
+    build_dir : str, optional
+        Directory for the job's files (default: STAGING/<unique_id>).
+    next_job : dict, optional
+        The job to be built next, which may start from this job's state.
+    
+    Returns
+    -------
+    str
+        Path to the build directory.
+    
+    """
     logging.debug("Editing IDF")
     for key, value in job.items():
         logging.debug("{}: {}".format(key, value))
-    build_dir = os.path.join(THIS_DIR, 'staging', job.pop('unique_id'))
+    unique_id = job.pop('unique_id')
+    if build_dir is None:
+        build_dir = os.path.join(STAGING, unique_id)
     try:
         os.mkdir(build_dir)
     except OSError:
         assert os.path.isdir(build_dir)
-    os.chdir(build_dir)
-    idf = init_idf()
-    schoolname = job.pop('geometry')
-    school = get_school(schoolname)
-    # geometry
-    idf = set_geometry(idf, job, school)  # stash the geometry file
-    # basics
-    set_required_objects(idf, schoolname)
-    # meters
-    set_outputs(idf)
-    # weather file
-    set_weather(idf, job)
-    # equipment
-    set_equipment(idf, job)
-    # occupancy
-    set_occupancy(idf, job)
-    # schedules
-    set_schedules(idf, job)
-    # lighting
-    set_lights(idf, job)
-    # HVAC
-    set_hvac(idf, job)
-    # infiltration and ventilation
-    set_infiltration(idf, job)
-    set_ventilation(idf, job)
-    # windows
-    set_windows(idf, job)
-    # convection algorithms
-    set_convection_algorithms(idf, job)
-    # timesteps
-    set_timestep(idf, job)
-    # daylighting
-    set_daylighting(idf, job)
-    # fabric U values
-    set_materials(idf, job)
-    
-    idf.saveas('./in.idf')
-    shutil.copy(idf.epw, './in.epw')
-    os.chdir(THIS_DIR)
+    schoolname = job['geometry']
+    context = {'job': job, 'batch': batch, 'build_dir': build_dir,
+               'school': get_school(schoolname), 'schoolname': schoolname}
+    idf = job_builder.build(init_idf(), context, next_job)
+    job.pop('geometry')
+    
+    idf.saveas(os.path.join(build_dir, 'in.idf'))
+    shutil.copy(idf.epw, os.path.join(build_dir, 'in.epw'))
     
     return build_dir
 
@@ -94,20 +143,13 @@ def prepare_idf(job):
 def init_idf():
     """Initialise an IDF.
     """
-    if IDF.getiddname() == None:
-        IDF.setiddname(IDD)
-    idf = IDF()
-    idf.initnew(None)
-    return idf
+    return models.new()
 
 
 def get_school(name):
-    with open(sites_file, 'r') as f:
-        schools = json.load(f)
-    school = schools.get(name)
-    school['name'] = name
-
-    return school
+    """Fetch a school, with its name, from the sites store.
+    """
+    return sites[name]
 
 
 def set_required_objects(idf, schoolname):
@@ -196,49 +238,106 @@ def annual_output_variable(idf, variable):
 def set_geometry(idf, job, school):
     """Build the geometry for the IDF, or collect it from the cache.
     """
-    name = school['name']
-    cached_idf = os.path.join(GEOMETRY_CACHE, name) + '.idf'
+    return geometry_cache.get(geometry_key(school),
+                              lambda: build_school(idf, school['name'],
+                                                   school['blocks'],
+                                                   school['shading_blocks']))
+
+
+def geometry_key(school):
+    """Hash of the block definitions which the geometry is built from.
+    """
+    return stable_hash(school['blocks'], school['shading_blocks'])
+
+
+def cache_geometry(name):
+    """Build the geometry for a school and save it to the cache.
+
+    Returns
+    -------
+    bool
+        True if the geometry was built, False if it was already cached.
+
+    """
+    school = get_school(name)
+    return geometry_cache.prebuild(
+        geometry_key(school),
+        lambda: build_school(init_idf(), name, school['blocks'],
+                             school['shading_blocks']))
+
+
+def warm_geometry_cache(names=None, processes=None):
+    """Build the geometry for schools in parallel ahead of a campaign.
+
+    Parameters
+    ----------
+    names : list of str, optional
+        Schools to build (default: every school in the sites store).
+    processes : int, optional
+        Number of worker processes (default: one per CPU).
+
+    Returns
+    -------
+    int
+        Number of geometries built. Schools with the same blocks share one.
+
+    """
+    if names is None:
+        schools = sites.items()
+    else:
+        schools = ((name, sites[name]) for name in names)
+    unique = OrderedDict()
+    for name, school in schools:
+        unique.setdefault(geometry_key(school), name)
+    pool = multiprocessing.Pool(processes)
     try:
-        idf = IDF(cached_idf)
-    except IOError:        
-        blocks = school['blocks']
-        shading_blocks = school['shading_blocks']
-        
-        idf = build_school(idf, name, blocks, shading_blocks)
-        idf.saveas(cached_idf)
-    return idf
+        built = pool.map(cache_geometry, list(unique.values()))
+    finally:
+        pool.close()
+        pool.join()
+    return sum(built)
 
 
 def build_school(idf, schoolname, blocks, shading_blocks):
     """Build a school.
-    
+
+    Surfaces of blocks apart from each other never meet, so the blocks are
+    split into groups whose outlines overlap or touch, and the surfaces are
+    intersected and matched one group at a time.
+
     Parameters
     ----------
+    idf : IDF
+        An empty IDF to build the school in.
     schoolname : str
         Name of the school.
-    blocks : 
-    """
-    for block in blocks:
-        name = block['name']
-        poly = Polygon(eval(block['wkt']))        
-        height = float(block['height'])
-        if not height:
-            height = 3.25
-        num_storeys = int(block['num_storeys'])
-        idf.add_block(name, poly.vertices, height, num_storeys)
-    for block in shading_blocks:
-        name = block['name']
-        poly = Polygon(eval(block['wkt']))        
-        height = float(block['height'])
-        if not height:
-            continue
-        num_storeys = 1
-        idf.add_shading_block(name, poly.vertices, height)
-    
-    logging.debug('intersecting')
-    idf.intersect()
-    logging.debug('matching')
-    idf.match()
+    blocks : list of dict
+        Blocks with a name, wkt outline, height and num_storeys.
+    shading_blocks : list of dict
+        Shading blocks with a name, wkt outline and height. Those with no
+        height are left out.
+
+    """
+    shading_blocks = [block for block in shading_blocks
+                      if float(block['height'])]
+    outlines = [parse_wkt(block['wkt'])
+                for block in list(blocks) + shading_blocks]
+    groups = overlapping_groups([bounding_box(outline)
+                                 for outline in outlines])
+    logging.debug('intersecting and matching {} groups of blocks'.format(
+        len(groups)))
+    for group in groups:
+        part = idf if len(groups) == 1 else init_idf()
+        for i in group:
+            if i < len(blocks):
+                add_block(part, blocks[i], outlines[i])
+            else:
+                add_shading_block(part, shading_blocks[i - len(blocks)],
+                                  outlines[i])
+        part.intersect()
+        part.match()
+        if part is not idf:
+            merge(idf, part)
 #    logging.debug('setting wwr')
 #    idf.set_wwr(0.3)
     logging.debug('setting constructions')
@@ -253,6 +352,81 @@ def build_school(idf, schoolname, blocks, shading_blocks):
     return idf
 
 
+def add_block(idf, block, outline):
+    height = float(block['height'])
+    if not height:
+        height = 3.25
+    num_storeys = int(block['num_storeys'])
+    idf.add_block(block['name'], Polygon(outline).vertices, height,
+                  num_storeys)
+
+
+def add_shading_block(idf, block, outline):
+    idf.add_shading_block(block['name'], Polygon(outline).vertices,
+                          float(block['height']))
+
+
+def set_shading(idf, job, build_dir='.'):
+    """Remove shading surfaces too far away to shade the buildings.
+
+    A shading surface is kept if it is within the job's
+    shading_blocks_distance in plan of a building surface, and its top is at
+    least the horizon angle above the ground there. The numbers of shading
+    surfaces and of those removed are written to SHADING_REPORT in the build
+    directory. Jobs without a shading_blocks_distance keep every surface.
+
+    """
+    distance = job.get('shading_blocks_distance')
+    shading = [surface for key in SHADING_KEYS
+               for surface in idf.idfobjects[key]]
+    culled = []
+    if distance is not None:
+        buildings = [bounding_box(getcoords(surface)) for surface in
+                     idf.idfobjects['BUILDINGSURFACE:DETAILED']]
+        outlines = [getcoords(surface) for surface in shading]
+        culled = cull_shading(
+            buildings,
+            [(bounding_box(coords), max(v[2] for v in coords))
+             for coords in outlines],
+            float(distance), shading_horizon_angle())
+        for i in culled:
+            idf.removeidfobject(shading[i])
+    report = {'shading_surfaces': len(shading),
+              'shading_surfaces_removed': len(culled)}
+    logging.debug("Removed {} of {} shading surfaces".format(
+        len(culled), len(shading)))
+    with open(os.path.join(build_dir, SHADING_REPORT), 'wb') as f:
+        f.write(json.dumps(report).encode('utf-8'))
+
+
+def shading_horizon_angle():
+    """Read the horizon angle for culling shading from the config file.
+    """
+    if config.has_option('Geometry', 'shading_horizon_angle'):
+        return config.getfloat('Geometry', 'shading_horizon_angle')
+    return SHADING_HORIZON_ANGLE
+
+
+def shading_report(build_dir):
+    """The shading surfaces culled for a job, as written by set_shading.
+
+    The report is kept in the build directory rather than in the job spec,
+    which is stored with the job's parameters.
+
+    Returns
+    -------
+    dict
+        The numbers of shading_surfaces and shading_surfaces_removed, or an
+        empty dict if there is no report.
+
+    """
+    try:
+        with open(os.path.join(build_dir, SHADING_REPORT), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError):
+        return {}
+
+
 def set_construction(surface):
     
     if surface.Surface_Type.lower() == 'wall':
@@ -368,7 +542,7 @@ def set_equipment(idf, job):
         item.Watts_per_Zone_Floor_Area = job['equip_wpm2']
 
 
-def set_schedules(idf, job):
+def set_schedules(idf, job, batch=None, build_dir='.'):
     """Set up schedules for each zone.
     
     Required schedule types are occupancy, lighting, heating, cooling, 
@@ -380,6 +554,10 @@ def set_schedules(idf, job):
         An Eppy IDF object.
     job : dict
         Dict containing the parameters.
+    batch : ScheduleBatch, optional
+        Schedules computed for all the jobs in a campaign.
+    build_dir : str, optional
+        Directory for the schedules CSV (default: the working directory).
 
     """
     zones = idf.idfobjects['ZONE']
@@ -388,46 +566,365 @@ def set_schedules(idf, job):
     activities = activities_proportions(gifa)
 
     schedule_types = ['Heat', 'Cool', 'Light', 'Equip', 'Occ']
-    schedules = make_schedules(zones, schedule_types, activities)
     coef = 1 + float(job['schedules'])
-    for zone in schedules:
-        for st in schedules[zone]:
-            schedules[zone][st] = stretch(schedules[zone][st], coef, 12)
-
-    write_schedules(idf, schedules, 'school')
+    key = schedules_key(gifa, [zone.Name for zone in zones], coef,
+                        schedule_types)
+    mode = schedule_mode()
+    cached = mode == 'file' and load_cached_schedules(
+        idf, key, 'school', build_dir)
+    if not cached:
+        if batch is not None:
+            schedules = batch.schedules(
+                zones, schedule_types, activities, coef)
+        else:
+            schedules = make_schedules(zones, schedule_types, activities)
+            # zones share identical schedules, so only stretch each one once
+            stretched = {}
+            for zone in schedules:
+                for st in schedules[zone]:
+                    digest = schedule_digest(schedules[zone][st])
+                    if digest not in stretched:
+                        stretched[digest] = schedules[zone][st].stretch(
+                            coef, 12)
+                    schedules[zone][st] = stretched[digest]
+
+        write_schedules(idf, schedules, 'school', mode=mode,
+                        build_dir=build_dir)
+        if mode == 'file':
+            cache_schedules(idf, key, 'school', build_dir)
 
     rate_types = ['Metab']
     rates = make_rates(zones, rate_types, activities)
     write_rates(idf, rates)
 
 
-def write_schedules(idf, all_zone_schedules, record):
+def schedules_key(gifa, zone_names, coef, schedule_types):
+    """Key for a job's finished schedules in the schedule cache.
+    
+    As well as the job's inputs, the key covers the version of the schedule
+    data, so schedules cached before the data was edited are not used.
+    
+    """
+    return stable_hash(round(gifa, 6), zone_names, coef, schedule_types,
+                       schedule_sources_digest())
+
+
+def write_schedules(idf, all_zone_schedules, record, mode=None,
+                    build_dir='.'):
     """Add area weighted schedules for all activity zones to the IDF.
     
+    Schedules with identical values are written once, and the schedule
+    objects for every zone using them share the CSV column or the week and
+    day schedules.
+    
     Parameters
     ----------
     all_zone_schedules : dict
        Dictionary containing hourly schedules for each schedule type.
     record : int or str
         Name of the record.
+    mode : str, optional
+        One of SCHEDULE_MODES (default: from schedule_mode).
+    build_dir : str, optional
+        Directory for the schedules CSV (default: the working directory).
+    
+    Raises
+    ------
+    ValueError
+        In 'compact' mode, if the weekdays of the run period are not known or
+        a schedule cannot be written as compact objects. In 'auto' mode a
+        warning is logged if the weekdays are not known.
     
     """
-    col_num = 1
+    if mode is None:
+        mode = schedule_mode()
+    if mode not in SCHEDULE_MODES:
+        raise ValueError('Unknown schedule mode: {}'.format(mode))
+    columns, column_numbers = schedule_columns(all_zone_schedules)
+    headers = list(columns)
+    weeks = {}
+    first_weekday = None
+    if mode != 'file':
+        first_weekday = run_period_first_weekday(idf)
+        if first_weekday is None:
+            if mode == 'compact':
+                raise ValueError('The weekdays of the run period are not '
+                                 'known')
+            logging.warning(
+                "The weekdays of the run period are not known, so every "
+                "schedule is written to {}_schedules.csv".format(record))
+    if first_weekday is not None:
+        for header, hourly in columns.items():
+            try:
+                weeks[header] = write_compact_weeks(
+                    idf, header, hourly, first_weekday)
+            except ValueError:
+                if mode == 'compact':
+                    raise
+    file_columns = OrderedDict((header, hourly)
+                               for header, hourly in columns.items()
+                               if header not in weeks)
+    file_column_numbers = {header: i + 1
+                           for i, header in enumerate(file_columns)}
     for zone in all_zone_schedules:
 #        logging.info(zone)
         for st in all_zone_schedules[zone]:
+            header = headers[column_numbers[zone][st] - 1]
+            if header in weeks:
+                write_schedule_year(idf, '%s_%s' % (zone, st), weeks[header])
+                continue
+            add_schedule_file(idf, '%s_%s' % (zone, st), record,
+                              file_column_numbers[header],
+                              len(all_zone_schedules[zone][st]))
+    if file_columns:
+        write_schedules_file(file_columns, record, build_dir)
+
+
+def schedule_mode():
+    """Read how to write schedules from the config file.
+    
+    The mode is mode in the Schedules section of the config file, else
+    SCHEDULE_MODE, looked up when schedules are written.
+    
+    """
+    if config.has_option('Schedules', 'mode'):
+        return config.get('Schedules', 'mode').strip()
+    return SCHEDULE_MODE
+
+
+def add_schedule_file(idf, name, record, column, hours):
+    """Add a Schedule:File object which reads a column of the schedules CSV.
+    """
+    idf.newidfobject(
+        'SCHEDULE:FILE',
+        Name=name,
+        Schedule_Type_Limits_Name='Any Number',
+        File_Name='{}_schedules.csv'.format(record),
+        Column_Number=column,
+        Rows_to_Skip_at_Top=1,
+        Number_of_Hours_of_Data=hours,
+        Column_Separator='Comma'
+        )
+
+
+def cache_schedules(idf, key, record, build_dir='.'):
+    """Store the schedules CSV and its Schedule:File objects in the cache.
+    
+    Parameters
+    ----------
+    idf : IDF
+        An Eppy IDF object, after write_schedules.
+    key : str
+        Key for the schedules' inputs.
+    record : int or str
+        Name of the record.
+    build_dir : str, optional
+        Directory of the schedules CSV (default: the working directory).
+    
+    """
+    csv_filename = '{}_schedules.csv'.format(record)
+    csv_path = os.path.join(build_dir, csv_filename)
+    objects = [[s.Name, s.Column_Number, s.Number_of_Hours_of_Data]
+               for s in idf.idfobjects['SCHEDULE:FILE']
+               if s.File_Name == csv_filename]
+    schedule_cache.put(key, {'schedules.csv': csv_path},
+                       {'columns.json': json.dumps(objects)})
+
+
+def load_cached_schedules(idf, key, record, build_dir='.'):
+    """Add cached schedules to the IDF and link in the cached CSV.
+    
+    Parameters
+    ----------
+    idf : IDF
+        An Eppy IDF object.
+    key : str
+        Key for the schedules' inputs.
+    record : int or str
+        Name of the record.
+    build_dir : str, optional
+        Directory to link the CSV into (default: the working directory).
+    
+    Returns
+    -------
+    bool
+        True if the schedules were in the cache.
+    
+    """
+    entry = schedule_cache.get(key)
+    logging.debug("Schedule cache: {} hits, {} misses".format(
+        schedule_cache.hits, schedule_cache.misses))
+    if entry is None:
+        return False
+    try:
+        with open(os.path.join(entry, 'columns.json'), 'rb') as f:
+            objects = json.loads(f.read().decode('utf-8'))
+        csv_filename = '{}_schedules.csv'.format(record)
+        link_or_copy(os.path.join(entry, 'schedules.csv'),
+                     os.path.join(build_dir, csv_filename))
+    except (IOError, OSError):  # evicted by another process
+        return False
+    for name, column, hours in objects:
+        add_schedule_file(idf, name, record, column, hours)
+    return True
+
+
+def write_compact_weeks(idf, name, hourly, first_weekday):
+    """Add the Schedule:Week:Daily and Schedule:Day:Hourly objects for a
+    schedule.
+    
+    Holidays, design days and custom days use the Monday profile of each
+    week, as in the NCM schedules.
+    
+    Parameters
+    ----------
+    idf : IDF
+        An Eppy IDF object.
+    name : str
+        Prefix for the names of the new objects.
+    hourly : ScheduleSet or array-like
+        Hourly schedule values.
+    first_weekday : int or None
+        Weekday of the first day of the year in the simulation, where Monday
+        is 0.
+    
+    Returns
+    -------
+    list of tuple
+        (week schedule name, first day, last day) of each period of the year.
+    
+    Raises
+    ------
+    ValueError
+        If the weekdays are not known, or the schedule has too many different
+        days or periods.
+    
+    """
+    if first_weekday is None:
+        raise ValueError('The weekdays of the run period are not known')
+    if not isinstance(hourly, ScheduleSet):
+        hourly = ScheduleSet.from_hourly(hourly)
+    if len(hourly.profiles) > MAX_DAY_PROFILES:
+        raise ValueError('{} has {} different days, which is too irregular'
+                         .format(name, len(hourly.profiles)))
+    periods = hourly.week_periods(first_weekday)
+    if len(periods) > MAX_SCHEDULE_PERIODS:
+        raise ValueError('{} has {} periods, more than a Schedule:Year allows'
+                         .format(name, len(periods)))
+    day_names = {}
+    week_names = OrderedDict()
+    weeks = []
+    for first, last, week in periods:
+        if week not in week_names:
+            for profile in week:
+                if profile in day_names:
+                    continue
+                day_names[profile] = '%s_Day%i' % (name, len(day_names) + 1)
+                values = {'Hour_%i' % (hour + 1): value for hour, value
+                          in enumerate(hourly.profiles[profile].tolist())}
+                idf.newidfobject(
+                    'SCHEDULE:DAY:HOURLY', Name=day_names[profile],
+                    Schedule_Type_Limits_Name='Any Number', **values)
+            week_names[week] = '%s_Week%i' % (name, len(week_names) + 1)
+            fields = {'%s_ScheduleDay_Name' % day: day_names[profile]
+                      for day, profile in zip(WEEKDAY_NAMES, week)}
+            for day in OTHER_DAY_TYPES:
+                fields['%s_ScheduleDay_Name' % day] = day_names[week[0]]
             idf.newidfobject(
-                'SCHEDULE:FILE',
-                Name='%s_%s' % (zone, st),
-                Schedule_Type_Limits_Name='Any Number',
-                File_Name='{}_schedules.csv'.format(record),
-                Column_Number=col_num,
-                Rows_to_Skip_at_Top=1,
-                Number_of_Hours_of_Data=len(all_zone_schedules[zone][st]),
-                Column_Separator='Comma'
-                )
-            col_num += 1
-    write_schedules_file(all_zone_schedules, record)
+                'SCHEDULE:WEEK:DAILY', Name=week_names[week], **fields)
+        weeks.append((week_names[week], first, last))
+    return weeks
+
+
+def write_schedule_year(idf, name, weeks):
+    """Add a Schedule:Year object made from week schedules.
+    
+    Parameters
+    ----------
+    idf : IDF
+        An Eppy IDF object.
+    name : str
+        Name of the schedule.
+    weeks : list of tuple
+        (week schedule name, first day, last day) from write_compact_weeks.
+    
+    """
+    year = idf.newidfobject('SCHEDULE:YEAR', Name=name,
+                            Schedule_Type_Limits_Name='Any Number')
+    fields = []
+    new_year = datetime.date(DEFAULT_YEAR, 1, 1)
+    for week, first, last in weeks:
+        start = new_year + datetime.timedelta(days=first)
+        end = new_year + datetime.timedelta(days=last)
+        fields.extend([week, start.month, start.day, end.month, end.day])
+    # eppy does not name the repeated fields of Schedule:Year
+    year.obj[3:] = fields
+
+
+def run_period_first_weekday(idf):
+    """Find the weekday which the first day of the year has in the simulation.
+    
+    Parameters
+    ----------
+    idf : IDF
+        An Eppy IDF object, with the weather file in its epw attribute.
+    
+    Returns
+    -------
+    int or None
+        Weekday, where Monday is 0, or None if there is not exactly one run
+        period or its start day is not known.
+    
+    """
+    run_periods = idf.idfobjects['RUNPERIOD']
+    if len(run_periods) != 1:
+        return None
+    run_period = run_periods[0]
+    start_day = str(run_period.Day_of_Week_for_Start_Day).capitalize()
+    if start_day in WEEKDAY_NAMES:
+        start_weekday = WEEKDAY_NAMES.index(start_day)
+    else:
+        start_weekday = epw.first_weekday(getattr(idf, 'epw', None))
+        if start_weekday is None:
+            return None
+    start = datetime.date(DEFAULT_YEAR, int(run_period.Begin_Month or 1),
+                          int(run_period.Begin_Day_of_Month or 1))
+    return (start_weekday - (start.timetuple().tm_yday - 1)) % 7
+
+
+def schedule_columns(all_zone_schedules):
+    """Find the distinct schedules to write as columns of the CSV file.
+    
+    Parameters
+    ----------
+    all_zone_schedules : dict
+       Dictionary containing hourly schedules for each schedule type.
+    
+    Returns
+    -------
+    tuple
+        An OrderedDict of hourly schedules keyed by column header, and a dict
+        of the column number for each zone and schedule type.
+    
+    """
+    columns = OrderedDict()
+    digests = {}
+    column_numbers = {}
+    for zone in all_zone_schedules:
+        column_numbers[zone] = {}
+        for st in all_zone_schedules[zone]:
+            hourly = all_zone_schedules[zone][st]
+            digest = schedule_digest(hourly)
+            if digest not in digests:
+                header = st
+                n = 1
+                while header in columns:
+                    n += 1
+                    header = '%s_%i' % (st, n)
+                columns[header] = hourly
+                digests[digest] = len(columns)
+            column_numbers[zone][st] = digests[digest]
+    return columns, column_numbers
 
 
 def write_rates(idf, all_zone_rates):
@@ -455,36 +952,23 @@ def write_rates(idf, all_zone_rates):
                 )
         
         
-def write_schedules_file(all_zone_schedules, record):
+def write_schedules_file(columns, record, build_dir='.'):
     """
-    Write out the hourly schedules to a 'schedule.csv' file in the working
+    Write out the hourly schedules to a 'schedule.csv' file in the build
     directory.
     
     Parameters
     ----------
-    all_zone_schedules : list
-        A list of all the schedules for all the zones.
+    columns : OrderedDict
+        Hourly schedules keyed by column header.
     record : int or str
         Name of the record.
+    build_dir : str, optional
+        Directory for the CSV (default: the working directory).
 
     """
     csv_filename = '{}_schedules.csv'.format(record)
-    hourly_schedules = []
-    for zone in all_zone_schedules:
-        for st in all_zone_schedules[zone]:
-            hourly_schedules += [all_zone_schedules[zone][st]]
-    # transpose to tuples for each hour
-    hourly_schedules = zip(*hourly_schedules)
-    header = []
-    for zone in all_zone_schedules:
-        for st in all_zone_schedules[zone]:
-            header += ['%s_%s' % (zone, st)]
-    header = ','.join(header) + '\n'
-    with open(csv_filename, 'wb') as csv:
-        csv.write(header)
-        for hour in hourly_schedules:
-            # Convert from numpy datatypes
-            csv.write(','.join([str(h) for h in hour]) + '\n')
+    write_schedule_csv(os.path.join(build_dir, csv_filename), columns)
 
 
 def set_windows(idf, job):
@@ -611,20 +1095,36 @@ def set_hvac(idf, job):
             ideal_loads(idf, zone.Name, **kwargs)
         else:
             boiler_only(idf, zone.Name, **kwargs)
-    set_sizing_periods(idf, DDY)
     
 
-def set_sizing_periods(idf, DDY):
+def set_sizing_periods(idf, DDY, criteria=None):
     """Fetch SizingPeriod:DesignDay objects for the record.
-    """
-    idf2 = IDF(DDY)
     
-    design_days = idf2.idfobjects['SIZINGPERIOD:DESIGNDAY']
-    heating_ddy = [ddy for ddy in design_days if 'Htg 99%' in ddy.Name][0]
-    idf.copyidfobject(heating_ddy)
+    Parameters
+    ----------
+    idf : IDF
+        An Eppy IDF object.
+    DDY : str
+        Path to the DDY file.
+    criteria : list of str, optional
+        Text to find in the name of each design day. The default is
+        design_days in the SizingPeriods section of the config file, as a
+        comma-separated list, else DESIGN_DAYS.
+    
+    """
+    if criteria is None:
+        criteria = design_day_criteria()
+    for design_day in models.design_days(DDY, criteria):
+        idf.copyidfobject(design_day)
 
-    cooling_ddy = [ddy for ddy in design_days if 'Clg 1%' in ddy.Name][0]
-    idf.copyidfobject(cooling_ddy)
+
+def design_day_criteria():
+    """Read the design days to use from the config file.
+    """
+    if config.has_option('SizingPeriods', 'design_days'):
+        return [criterion.strip() for criterion in
+                config.get('SizingPeriods', 'design_days').split(',')]
+    return DESIGN_DAYS
 
     
 def ideal_loads(idf, zone_name, **kwargs):
@@ -770,4 +1270,73 @@ def vertices(surface):
     """Get vertices as (x,y,z) tuples.
     """
     return getcoords(surface)
-    
\ No newline at end of file
+
+
+# the stages of prepare_idf, with the job keys they read
+STAGES = [
+    Stage('geometry', set_geometry, ['geometry'], args=['job', 'school']),
+    Stage('shading', set_shading, ['shading_blocks_distance'],
+          args=['job', 'build_dir'], requires=['geometry'],
+          outputs=[SHADING_REPORT]),
+    Stage('required_objects', set_required_objects, ['geometry'],
+          args=['schoolname'], requires=['geometry']),
+    Stage('outputs', set_outputs, args=[], requires=['geometry']),
+    Stage('weather', set_weather, ['weather_file'], requires=['geometry']),
+    Stage('equipment', set_equipment, ['equip_wpm2'], requires=['geometry']),
+    Stage('occupancy', set_occupancy, ['occupancy'], requires=['geometry']),
+    # compact schedules follow the weekdays of the run period and weather file
+    Stage('schedules', set_schedules, ['schedules', 'weather_file'],
+          args=['job', 'batch', 'build_dir'],
+          requires=['geometry', 'required_objects', 'weather'],
+          outputs=['school_schedules.csv']),
+    Stage('lights', set_lights, ['light_wpm2'], requires=['geometry']),
+    Stage('hvac', set_hvac, ['boiler_efficiency', 'detailed_hvac'],
+          requires=['geometry']),
+    Stage('sizing_periods', partial(set_sizing_periods, DDY=DDY), args=[],
+          requires=['geometry']),
+    Stage('infiltration', set_infiltration, ['infiltration'],
+          requires=['geometry']),
+    Stage('ventilation', set_ventilation, ['ventilation'],
+          requires=['geometry']),
+    Stage('windows', set_windows,
+          ['window2wall', 'window_u_value', 'window_shgc'],
+          requires=['geometry']),
+    Stage('convection_algorithms', set_convection_algorithms,
+          ['exterior_surface_convection', 'interior_surface_convection'],
+          requires=['geometry']),
+    Stage('timestep', set_timestep, ['timesteps_per_hour'],
+          requires=['geometry']),
+    Stage('daylighting', set_daylighting, ['daylighting'],
+          requires=['geometry']),
+    Stage('materials', set_materials,
+          ['wall_u_value', 'floor_u_value', 'roof_u_value', 'density'],
+          requires=['geometry']),
+    ]
+# files written by stages, for jobs which start from a later snapshot
+stage_files = DiskCache(STAGE_FILES)
+job_builder = StagedBuilder(STAGES, files=stage_files)
+
+
+def plan_jobs(jobs):
+    """Order jobs so that each shares as many stages as possible with the
+    job before it.
+    """
+    return job_builder.plan(jobs)
+
+
+def main(argv=None):
+    """Build the geometry cache for schools in the sites store.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('names', nargs='*',
+                        help='schools to build (default: all)')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+    built = warm_geometry_cache(args.names or None, args.processes)
+    print('Built {} geometries in {}'.format(
+        built, os.path.abspath(GEOMETRY_MODELS)))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,32 +9,163 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import deque
 import logging
+import multiprocessing
 
 from sqlalchemy.exc import IntegrityError
 
 from framework.manager.src.db_lib import insert
 from manager.src import sensitivity
 from manager.src.config import config
+from manager.src.idfsyntax import SCHEDULE_BATCH
+from manager.src.idfsyntax import job_builder
+from manager.src.idfsyntax import plan_jobs
 from manager.src.idfsyntax import prepare_idf
+from manager.src.schedules import ScheduleBatch
 
 
 logging.basicConfig(level=logging.INFO)
 
 WHITELIST = ['sensitivity_analysis']
 
+BUILD_PROCESSES = 1  # build jobs in the client process
+BUILD_PREFETCH = 2  # chunks built ahead of dispatch for each worker process
+BUILD_CHUNK = 4  # consecutive jobs built by a worker process in one task
 
-def getjobs():
+worker_batch = None  # the ScheduleBatch in a worker process
+
+
+def getjobs(processes=None, prefetch=None, chunk=None):
+    """Build the jobs for the job type in the config file.
+    
+    Parameters
+    ----------
+    processes : int, optional
+        Number of worker processes to build jobs on. With one, jobs are built
+        in this process. The default is build_processes in the Client section
+        of the config file, else BUILD_PROCESSES.
+    prefetch : int, optional
+        Most chunks of jobs to queue or hold built ahead of the one being
+        dispatched. The default is build_prefetch in the Client section of
+        the config file, else BUILD_PREFETCH for each worker process.
+    chunk : int, optional
+        Number of consecutive jobs a worker process builds in one task. The
+        default is build_chunk in the Client section of the config file, else
+        BUILD_CHUNK.
+    
+    Yields
+    ------
+    str
+        Path to a build dir with the job. Jobs are built in the order which
+        lets each reuse the most stages from the one before.
+    
+    """
+    if processes is None:
+        processes = build_option('build_processes', BUILD_PROCESSES)
+    if prefetch is None:
+        prefetch = build_option('build_prefetch', BUILD_PREFETCH * processes)
+    if chunk is None:
+        chunk = build_option('build_chunk', BUILD_CHUNK)
     # find the type of job from the config file
     # create specifications for creating jobs as a list
-    jobs = job_specs()
-    while jobs:
-        jobspec = jobs.pop()  # get a job
-        job = prepare_idf(jobspec)  # returns path to a build dir with the job
+    # reversed, since jobs are popped from the end
+    jobs = plan_jobs(job_specs())[::-1]
+    # the schedules for every job are computed together by the first job
+    batch = ScheduleBatch([1 + float(job['schedules']) for job in jobs],
+                          path=SCHEDULE_BATCH)
+    if processes > 1:
+        built = build_parallel(jobs, batch, processes, max(prefetch, 1),
+                               max(chunk, 1))
+    else:
+        built = build_serial(jobs, batch)
+    for job, jobspec in built:
         store_params('postgis', 'sdb', 'job', jobspec)
         yield job
 
 
+def build_option(option, default):
+    """Read a job building setting from the config file.
+    """
+    if config.has_option('Client', option):
+        return config.getint('Client', option)
+    return default
+
+
+def build_serial(jobs, batch):
+    """Build jobs one after another in this process.
+    
+    Yields
+    ------
+    tuple
+        Path to the build dir, and the job spec as edited by prepare_idf.
+    
+    """
+    while jobs:
+        jobspec = jobs.pop()  # get a job
+        next_job = jobs[-1] if jobs else None
+        yield prepare_idf(jobspec, batch, next_job=next_job), jobspec
+
+
+def build_parallel(jobs, batch, processes, prefetch, chunk=BUILD_CHUNK):
+    """Build jobs on a pool of worker processes.
+    
+    The first job is built in this process so that the schedules batch is
+    computed once, before the workers start. The rest are sent to the workers
+    in chunks of consecutive jobs in the planned order, so that each worker
+    builds a run of jobs which share stages and can reuse the snapshot it
+    kept for the next job. No more than prefetch chunks are queued or waiting
+    to be dispatched, which keeps the building ahead of dispatch without
+    filling the staging directory.
+    
+    Yields
+    ------
+    tuple
+        Path to the build dir, and the job spec as edited by prepare_idf, in
+        the same order as build_serial.
+    
+    """
+    if not jobs:
+        return
+    jobspec = jobs.pop()
+    yield prepare_idf(jobspec, batch), jobspec
+    stages = [stage.name for stage in job_builder.stages]
+    pool = multiprocessing.Pool(processes, initializer=init_worker,
+                                initargs=(batch, stages))
+    pending = deque()
+    try:
+        while jobs or pending:
+            while jobs and len(pending) < prefetch:
+                jobspecs = [jobs.pop() for _i in range(min(chunk, len(jobs)))]
+                pending.append(pool.apply_async(build_chunk, (jobspecs,)))
+            for built in pending.popleft().get():
+                yield built
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def init_worker(batch, stages):
+    global worker_batch
+    worker_batch = batch
+    job_builder.reorder(stages)  # as planned in the client
+
+
+def build_chunk(jobspecs):
+    """Build consecutive jobs in a worker process.
+    
+    A snapshot is kept for the next job in the chunk only, since the job
+    after the chunk may be sent to another worker.
+    
+    """
+    built = []
+    for i, jobspec in enumerate(jobspecs):
+        next_job = jobspecs[i + 1] if i + 1 < len(jobspecs) else None
+        built.append((prepare_idf(jobspec, worker_batch, next_job=next_job),
+                      jobspec))
+    return built
+
+
 def job_specs():
     job_type = config.get('Client', 'job_type')
     options = config.items(job_type)
@@ -0,0 +1,343 @@
+"""
+models.py
+~~~~~~~~~
+Base IDF models, parsed once per process and cloned for each job.
+
+Parsing an IDF goes through eppy's IDD machinery for every object, which is
+most of the cost of preparing a job. A ModelFactory parses the IDD and each
+base model (a cached geometry, the design day file) the first time it is asked
+for, and hands out clones which copy the object lists directly.
+
+Built geometry is held in a GeometryCache, in memory and pickled to disk as
+object lists, which load much faster than IDF text.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+import logging
+import os
+import time
+
+from eppy.bunch_subclass import EpBunch
+from eppy.idf_msequence import Idf_MSequence
+from eppy.idfreader import makeabunch
+from geomeppy import IDF
+from six.moves import cPickle as pickle
+
+from manager.src.caching import LRUCache
+from manager.src.caching import file_key
+
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+IDD = os.path.join(THIS_DIR, os.pardir, 'data/idd/Energy+.idd')
+
+
+class ModelFactory(object):
+    """
+    Parse base models once and provide independent copies of them.
+
+    Parameters
+    ----------
+    idd : str, optional
+        Path to the EnergyPlus IDD (default: IDD).
+    maxsize : int, optional
+        Number of parsed models to hold (default: 32).
+
+    """
+
+    def __init__(self, idd=IDD, maxsize=32):
+        self.idd = idd
+        self.models = LRUCache(maxsize)
+        self.selections = {}
+
+    def set_idd(self):
+        """Set the IDD, which eppy parses on first use and then shares.
+        """
+        if IDF.getiddname() is None:
+            IDF.setiddname(self.idd)
+
+    def new(self):
+        """An empty IDF.
+        """
+        self.set_idd()
+        idf = IDF()
+        idf.initnew(None)
+        return idf
+
+    def base(self, path):
+        """The parsed model in a file, shared with every other caller.
+
+        The file is parsed again if it has changed since it was last read. The
+        model returned must not be edited; use `load` for a copy to edit.
+
+        Parameters
+        ----------
+        path : str
+            Path to an IDF or DDY file.
+
+        Returns
+        -------
+        IDF
+
+        Raises
+        ------
+        IOError
+            If the file does not exist.
+
+        """
+        try:
+            key = file_key(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+        idf = self.models.get(key)
+        if idf is None:
+            self.set_idd()
+            idf = IDF(path)
+            self.models[key] = idf
+        return idf
+
+    def load(self, path):
+        """A copy of the model in a file, which is safe to edit.
+        """
+        return clone(self.base(path))
+
+    def design_days(self, path, criteria):
+        """Select design days from a DDY file, once per version of the file.
+
+        Parameters
+        ----------
+        path : str
+            Path to a DDY file.
+        criteria : list of str
+            Text to find in the name of each design day, e.g. 'Htg 99%'.
+
+        Returns
+        -------
+        list of EpBunch
+            The first SizingPeriod:DesignDay matching each criterion, to be
+            added to an IDF with copyidfobject.
+
+        Raises
+        ------
+        ValueError
+            If no design day matches a criterion.
+
+        """
+        try:
+            key = (file_key(path), tuple(criteria))
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+        if key not in self.selections:
+            objects = self.base(path).idfobjects['SIZINGPERIOD:DESIGNDAY']
+            selected = []
+            for criterion in criteria:
+                matches = [obj for obj in objects if criterion in obj.Name]
+                if not matches:
+                    raise ValueError('No design day in {} matches {!r}'.format(
+                        path, criterion))
+                selected.append(matches[0])
+            self.selections[key] = selected
+        return self.selections[key]
+
+    def from_objects(self, objects):
+        """Build an IDF from object lists saved by `to_objects`.
+
+        Field names are looked up in the IDD once for each type of object,
+        rather than once for each object as when parsing.
+
+        Parameters
+        ----------
+        objects : list
+            (key, list of objects) for each type of object in the IDF.
+
+        Returns
+        -------
+        IDF
+
+        """
+        idf = self.new()
+        dtls = idf.model.dtls
+        for key, objs in objects:
+            template = makeabunch(idf.idd_info, max(objs, key=len),
+                                  dtls.index(key), block=idf.block)
+            bunches = [EpBunch(obj, template.objls, template.objidd)
+                       for obj in objs]
+            idf.model.dt[key] = objs
+            idf.idfobjects[key] = Idf_MSequence(bunches, objs, idf)
+        return idf
+
+
+class GeometryCache(object):
+    """
+    Built geometry models, held in memory and pickled to disk.
+
+    Parameters
+    ----------
+    directory : str
+        Directory for the pickled models.
+    maxsize : int, optional
+        Number of models to hold in memory (default: 16).
+
+    """
+
+    def __init__(self, directory, maxsize=16):
+        self.directory = directory
+        self.memory = LRUCache(maxsize)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.load_time = 0.0
+        self.build_time = 0.0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key, build):
+        """A copy of the model for a key, which is safe to edit.
+
+        Parameters
+        ----------
+        key : str
+            Hash of the geometry definition.
+        build : callable
+            Called with no arguments to build the model if it is not cached.
+
+        Returns
+        -------
+        IDF
+
+        """
+        idf = self.memory.get(key)
+        if idf is not None:
+            self.hits += 1
+            return clone(idf)
+        idf = self.load(key)
+        if idf is None:
+            idf = self.build(key, build)
+        else:
+            self.disk_hits += 1
+        self.memory[key] = idf
+        return clone(idf)
+
+    def prebuild(self, key, build):
+        """Build and save the model for a key unless it is already on disk.
+
+        Returns
+        -------
+        bool
+            True if the model was built.
+
+        """
+        if os.path.isfile(self.path(key)):
+            return False
+        self.build(key, build)
+        return True
+
+    def build(self, key, build):
+        self.misses += 1
+        start = time.time()
+        idf = build()
+        self.build_time += time.time() - start
+        self.save(key, idf)
+        return idf
+
+    def load(self, key):
+        """Load a pickled model, or return None if there is none to load.
+        """
+        start = time.time()
+        try:
+            with open(self.path(key), 'rb') as f:
+                objects = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except (EOFError, ValueError, pickle.UnpicklingError):
+            logging.debug("Ignoring corrupt geometry cache {}".format(key))
+            return None
+        idf = models.from_objects(objects)
+        self.load_time += time.time() - start
+        return idf
+
+    def save(self, key, idf):
+        path = self.path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmp, 'wb') as f:
+                pickle.dump(to_objects(idf), f, pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            logging.debug("Could not cache geometry {}".format(key))
+
+    def stats(self):
+        """Hit, miss and timing counters.
+        """
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'load_time': self.load_time,
+                'build_time': self.build_time}
+
+
+def clone(idf):
+    """Copy an IDF without writing it out and parsing it again.
+
+    The object lists are copied and each object is given a new EpBunch sharing
+    the field names and IDD data of the original, so edits to the copy do not
+    affect the original. Other attributes, such as the weather file in epw, are
+    carried over.
+
+    Parameters
+    ----------
+    idf : IDF
+        The IDF to copy.
+
+    Returns
+    -------
+    IDF
+
+    """
+    new = idf.__class__()
+    new.__dict__.update(idf.__dict__)
+    model = copy.copy(idf.model)
+    model.dt = {}
+    idfobjects = idf.idfobjects.__class__()
+    for key in idf.model.dtls:
+        key = key.upper()
+        objs = [list(obj) for obj in idf.model.dt[key]]
+        bunches = [EpBunch(obj, bunch.objls, bunch.objidd)
+                   for obj, bunch in zip(objs, idf.idfobjects[key])]
+        model.dt[key] = objs
+        idfobjects[key] = Idf_MSequence(bunches, objs, new)
+    new.model = model
+    new.idfobjects = idfobjects
+    return new
+
+
+def merge(idf, other):
+    """Add copies of all the objects in another IDF to an IDF.
+    """
+    for key in other.model.dtls:
+        for obj in other.idfobjects[key.upper()]:
+            idf.copyidfobject(obj)
+
+
+def to_objects(idf):
+    """The object lists of an IDF, for saving and rebuilding with
+    ModelFactory.from_objects.
+
+    Returns
+    -------
+    list
+        (key, list of objects) for each type of object in the IDF.
+
+    """
+    return [(key.upper(), idf.model.dt[key.upper()])
+            for key in idf.model.dtls if idf.model.dt[key.upper()]]
+
+
+models = ModelFactory()
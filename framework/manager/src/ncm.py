@@ -0,0 +1,251 @@
+"""
+ncm.py
+~~~~~~
+Access to the NCM schedule tables.
+
+The tables needed to build schedules are read in a single query per table and
+indexed in memory by ID and NAME, so a ScheduleBuilder can serve every lookup
+without going back to the database.
+
+The tables can also be exported to a SQLite snapshot so schedules can be built
+on machines with no database server::
+
+    python -m manager.src.ncm [path]
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import argparse
+import os
+import sqlite3
+
+import pandas as pd
+import sqlalchemy
+
+from manager.src.config import config
+
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+NCM_SNAPSHOT = os.path.join(THIS_DIR, os.pardir, 'data/cached/ncm_snapshot.sqlite')
+
+NCM_TABLES = ['annual_schedules', 'annual_weekly_schedules',
+              'weekly_schedules', 'daily_schedules', 'activity']
+INDEXED_COLUMNS = ['ID', 'NAME', 'ANNUAL_SCHEDULE']
+
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_RECYCLE = 3600  # seconds, to stay inside server-side idle timeouts
+
+engines = {}
+ncm_indexes = {}
+ncm_sources = {}  # snapshot or connection string for a ScheduleBuilder
+
+
+def get_engine(conn_string):
+    """Provide a pooled engine for a database, shared across the process.
+
+    Creating the engine does not connect to the database. Connections are
+    made on first use and returned to the pool afterwards. The pool can be
+    sized with pool_size and max_overflow in the ScheduleDB section of the
+    config file.
+
+    Parameters
+    ----------
+    conn_string : str
+        SQLAlchemy connection string.
+
+    Returns
+    -------
+    SQLAlchemy Engine object
+
+    """
+    if conn_string not in engines:
+        kwargs = {}
+        if not conn_string.startswith('sqlite'):  # sqlite does not pool
+            kwargs = {'pool_size': pool_option('pool_size', POOL_SIZE),
+                      'max_overflow': pool_option('max_overflow', MAX_OVERFLOW),
+                      'pool_recycle': POOL_RECYCLE}
+        engines[conn_string] = sqlalchemy.create_engine(
+            conn_string, echo=False, **kwargs)
+    return engines[conn_string]
+
+
+def pool_option(option, default):
+    """Read a connection pool setting from the config file.
+    """
+    if config.has_option('ScheduleDB', option):
+        return config.getint('ScheduleDB', option)
+    return default
+
+
+def id_key(value):
+    """Normalise an ID so that 12, 12.0, '12' and numpy ints match.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+class NCMIndex(object):
+    """
+    In-memory copy of the NCM schedule tables, indexed by ID and NAME.
+
+    Parameters
+    ----------
+    tables : dict
+        A pd.DataFrame for each of the NCM_TABLES.
+
+    """
+
+    def __init__(self, tables):
+        self.tables = {name: table.reset_index(drop=True)
+                       for name, table in tables.items()}
+        self.by_id = {}
+        self.by_name = {}
+        for name, table in self.tables.items():
+            if 'ID' in table:
+                self.by_id[name] = {id_key(v): i
+                                    for i, v in enumerate(table['ID'])}
+            if 'NAME' in table:
+                self.by_name[name] = {v: i
+                                      for i, v in enumerate(table['NAME'])}
+        self.annual_weeks = defaultdict(list)
+        aws = self.tables['annual_weekly_schedules']
+        for i, annual_id in enumerate(aws['ANNUAL_SCHEDULE']):
+            self.annual_weeks[id_key(annual_id)].append(i)
+
+    @classmethod
+    def from_engine(cls, engine, tablenames):
+        """Read the NCM tables from a database.
+
+        Parameters
+        ----------
+        engine : sqlalchemy.engine.Engine
+            Engine connected to the NCM database.
+        tablenames : dict
+            Fully-qualified table name for each of the NCM_TABLES.
+
+        Returns
+        -------
+        NCMIndex
+
+        """
+        tables = {}
+        with engine.connect() as con:
+            for table in NCM_TABLES:
+                sql = "SELECT * FROM {}".format(tablenames[table])
+                tables[table] = pd.read_sql(sql, con)
+        return cls(tables)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """Read the NCM tables from a snapshot written by to_snapshot.
+
+        Parameters
+        ----------
+        path : str
+            Path to the SQLite snapshot.
+
+        Returns
+        -------
+        NCMIndex
+
+        """
+        con = sqlite3.connect(path)
+        try:
+            tables = {table: pd.read_sql('SELECT * FROM "{}"'.format(table), con)
+                      for table in NCM_TABLES}
+        finally:
+            con.close()
+        return cls(tables)
+
+    def to_snapshot(self, path):
+        """Write the NCM tables to a SQLite file, indexed on ID and NAME.
+
+        Parameters
+        ----------
+        path : str
+            Path to the SQLite snapshot. Any existing file is replaced.
+
+        """
+        tmp = path + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        con = sqlite3.connect(tmp)
+        try:
+            for name, table in self.tables.items():
+                table.to_sql(name, con, index=False)
+                for column in INDEXED_COLUMNS:
+                    if column in table:
+                        con.execute('CREATE INDEX "ix_{0}_{1}" ON "{0}" ("{1}")'
+                                    .format(name, column))
+            con.commit()
+        finally:
+            con.close()
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+
+    def row(self, table, row_id=None, name=None):
+        """Fetch a single row by ID or by NAME.
+
+        Parameters
+        ----------
+        table : str
+            One of the NCM_TABLES.
+        row_id : int or str, optional
+            Value of the ID column.
+        name : str, optional
+            Value of the NAME column.
+
+        Returns
+        -------
+        pd.Series
+
+        Raises
+        ------
+        KeyError
+            If there is no matching row.
+
+        """
+        if name is not None:
+            i = self.by_name[table][name]
+        else:
+            i = self.by_id[table][id_key(row_id)]
+        return self.tables[table].iloc[i]
+
+    def annual_weekly_schedule(self, annual_id):
+        """Rows of annual_weekly_schedules which belong to an annual schedule.
+
+        Returns
+        -------
+        pd.DataFrame
+            A copy of the rows, which is safe to edit.
+
+        """
+        rows = self.annual_weeks.get(id_key(annual_id), [])
+        aws = self.tables['annual_weekly_schedules']
+        return aws.iloc[rows].reset_index(drop=True)
+
+
+def main(argv=None):
+    """Export the NCM tables from the ScheduleBuilder database to a snapshot.
+    """
+    from manager.src.schedules import ScheduleBuilder
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('path', nargs='?', default=NCM_SNAPSHOT,
+                        help='snapshot file (default: %(default)s)')
+    args = parser.parse_args(argv)
+    builder = ScheduleBuilder()
+    builder.snapshot = None  # always read from the database
+    builder.ncm.to_snapshot(args.path)
+    print('NCM snapshot written to {}'.format(os.path.abspath(args.path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""
+pipeline.py
+~~~~~~~~~~~
+Incremental building of job IDFs from stages.
+
+Each stage edits the model and declares the job keys it reads, and the stages
+it must run after. A job's state after a stage is identified by a hash of the
+inputs of that stage and every stage before it, so jobs which agree on the
+inputs of the first few stages can start from a snapshot of the model taken
+after the deepest of those stages and only run the rest.
+
+Jobs are ordered so that jobs sharing the most stage inputs are built one
+after another, and each job leaves a snapshot at the depth it shares with the
+next job.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+
+from manager.src.caching import LRUCache
+from manager.src.caching import link_or_copy
+from manager.src.caching import stable_hash
+from manager.src.models import clone
+
+
+class Stage(object):
+    """
+    A step in building a job's IDF.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    func : callable
+        Called as func(idf, *args) with the values of args from the build
+        context. It edits the IDF, or returns a new IDF to replace it.
+    keys : list of str, optional
+        Job keys which the stage reads.
+    args : list of str, optional
+        Names of the build context values to pass to func (default: the job).
+    requires : list of str, optional
+        Names of stages which must run before this one.
+    outputs : list of str, optional
+        Files which the stage writes to the build directory.
+
+    """
+
+    def __init__(self, name, func, keys=(), args=('job',), requires=(),
+                 outputs=()):
+        self.name = name
+        self.func = func
+        self.keys = list(keys)
+        self.args = list(args)
+        self.requires = list(requires)
+        self.outputs = list(outputs)
+
+    def __repr__(self):
+        return 'Stage({!r})'.format(self.name)
+
+    def inputs(self, job):
+        return [job.get(key) for key in self.keys]
+
+    def run(self, idf, context):
+        result = self.func(idf, *[context[arg] for arg in self.args])
+        return idf if result is None else result
+
+
+class StagedBuilder(object):
+    """
+    Build IDFs from stages, reusing the model state shared with earlier jobs.
+
+    Parameters
+    ----------
+    stages : list of Stage
+        The stages, in an order which puts each stage after those it requires.
+    files : DiskCache, optional
+        Cache for the files written by stages, which are linked into the
+        build directory of a job resuming from a later snapshot. Without it,
+        no snapshot is taken after a stage which writes files.
+    maxsize : int, optional
+        Number of snapshots to hold (default: 8).
+
+    """
+
+    def __init__(self, stages, files=None, maxsize=8):
+        self.stages = order_stages(stages)
+        self.files = files
+        self.snapshots = LRUCache(maxsize)
+        self.runs = 0
+        self.reused = 0
+
+    def plan(self, jobs):
+        """Order the stages and the jobs to share as many stages as possible.
+
+        Stages whose inputs take fewer distinct values across the jobs are
+        run first, subject to their requirements, and the jobs are sorted by
+        their keys, so that jobs which share the state after a stage are
+        built one after another.
+
+        Parameters
+        ----------
+        jobs : list of dict
+            Job parameters.
+
+        Returns
+        -------
+        list of dict
+            The jobs, in the order to build them.
+
+        """
+        variety = {stage.name: len(set(json.dumps(stage.inputs(job))
+                                       for job in jobs))
+                   for stage in self.stages}
+        self.stages = order_stages(self.stages, variety.get)
+        return sorted(jobs, key=self.keys)
+
+    def reorder(self, names):
+        """Put the stages in the order planned in another process.
+        """
+        stages = {stage.name: stage for stage in self.stages}
+        self.stages = [stages[name] for name in names]
+
+    def keys(self, job):
+        """Hash of the model state after each stage for a job.
+        """
+        keys = []
+        key = None
+        for stage in self.stages:
+            key = stable_hash(key, stage.name, stage.inputs(job))
+            keys.append(key)
+        return keys
+
+    def build(self, idf, context, next_job=None):
+        """Build the IDF for a job.
+
+        Parameters
+        ----------
+        idf : IDF
+            An empty IDF, used if no snapshot can be reused.
+        context : dict
+            Values to pass to the stages, including the job and the build_dir.
+        next_job : dict, optional
+            The job to be built next, for which a snapshot is kept.
+
+        Returns
+        -------
+        IDF
+
+        """
+        build_dir = context['build_dir']
+        keys = self.keys(context['job'])
+        depth, snapshot = self.resume(keys, build_dir)
+        if snapshot is not None:
+            idf = clone(snapshot)
+        keep = 0
+        if next_job is not None:
+            keep = shared_depth(keys, self.keys(next_job))
+        for i in range(depth, len(self.stages)):
+            stage = self.stages[i]
+            idf = stage.run(idf, context)
+            self.runs += 1
+            if stage.outputs and self.files is not None:
+                self.store_outputs(stage, keys[i], build_dir)
+            if i + 1 == keep and self.can_snapshot(i):
+                self.snapshots[keys[i]] = clone(idf)
+        self.reused += depth
+        logging.debug("Reused {} of {} stages".format(depth, len(self.stages)))
+        return idf
+
+    def resume(self, keys, build_dir):
+        """Find the deepest snapshot for a job and link in its stage files.
+
+        Returns
+        -------
+        tuple
+            The number of stages the snapshot covers, and the snapshot, or
+            (0, None) if there is none.
+
+        """
+        for depth in range(len(keys), 0, -1):
+            snapshot = self.snapshots.get(keys[depth - 1])
+            if snapshot is not None and self.link_outputs(
+                    keys[:depth], build_dir):
+                return depth, snapshot
+        return 0, None
+
+    def can_snapshot(self, i):
+        return self.files is not None or not any(
+            stage.outputs for stage in self.stages[:i + 1])
+
+    def store_outputs(self, stage, key, build_dir):
+        files = {}
+        for name in stage.outputs:
+            path = os.path.join(build_dir, name)
+            if os.path.isfile(path):
+                files[name] = path
+        self.files.put(key, files)
+
+    def link_outputs(self, keys, build_dir):
+        """Link the files written by the stages up to a snapshot.
+
+        Returns
+        -------
+        bool
+            False if the files are no longer in the cache.
+
+        """
+        for stage, key in zip(self.stages, keys):
+            if not stage.outputs:
+                continue
+            entry = self.files.get(key)
+            if entry is None:
+                return False
+            try:
+                for name in os.listdir(entry):
+                    link_or_copy(os.path.join(entry, name),
+                                 os.path.join(build_dir, name))
+            except (IOError, OSError):  # evicted by another process
+                return False
+        return True
+
+    def stats(self):
+        """Numbers of stages run and reused from snapshots.
+        """
+        return {'runs': self.runs, 'reused': self.reused,
+                'snapshots': len(self.snapshots)}
+
+
+def order_stages(stages, priority=None):
+    """Sort stages so that each comes after the stages it requires.
+
+    Parameters
+    ----------
+    stages : list of Stage
+        The stages.
+    priority : callable, optional
+        Called with a stage's name. Of the stages which are ready to run, the
+        one with the lowest priority is taken first, with ties in the order
+        given.
+
+    Returns
+    -------
+    list of Stage
+
+    Raises
+    ------
+    ValueError
+        If a stage requires an unknown stage, or the requirements are cyclic.
+
+    """
+    names = set(stage.name for stage in stages)
+    for stage in stages:
+        unknown = set(stage.requires) - names
+        if unknown:
+            raise ValueError('Stage {} requires unknown stages {}'.format(
+                stage.name, sorted(unknown)))
+    ordered = []
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining
+                 if set(stage.requires) <= done]
+        if not ready:
+            raise ValueError('Cyclic stage requirements: {}'.format(
+                [stage.name for stage in remaining]))
+        if priority is not None:
+            ready.sort(key=lambda stage: priority(stage.name))
+        stage = ready[0]
+        ordered.append(stage)
+        done.add(stage.name)
+        remaining.remove(stage)
+    return ordered
+
+
+def shared_depth(keys, other_keys):
+    """Number of leading stages with the same state in two jobs.
+    """
+    depth = 0
+    for key, other in zip(keys, other_keys):
+        if key != other:
+            break
+        depth += 1
+    return depth
@@ -20,28 +20,53 @@ from __future__ import unicode_literals
 
 from collections import defaultdict, OrderedDict
 import datetime
+import glob
+import hashlib
+import io
 import itertools
 import json
 import logging
 import os
 import platform
 
-from dateutil.rrule import rrule, DAILY
-from six import StringIO
-import sqlalchemy
 from sqlalchemy.exc import DBAPIError
 
-from geomeppy import IDF
+from manager.src.caching import LRUCache
+from manager.src.caching import file_key
+from manager.src.caching import stable_hash
 from manager.src.config import config
+from manager.src.epw import column as epw_column
+from manager.src.models import models
+from manager.src.ncm import NCMIndex
+from manager.src.ncm import NCM_SNAPSHOT
+from manager.src.ncm import NCM_TABLES
+from manager.src.ncm import get_engine
+from manager.src.ncm import ncm_indexes
+from manager.src.ncm import ncm_sources
 import numpy as np
 import pandas as pd
 
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 SCHEDULES_DIR = os.path.join(THIS_DIR, '../data/schedules')
+COMPILED_SCHEDULES = os.path.join(THIS_DIR, '../data/cached/schedules.npy')
 
 
 DEFAULT_YEAR = 2015
+DAYS_IN_YEAR = (datetime.date(DEFAULT_YEAR + 1, 1, 1) -
+                datetime.date(DEFAULT_YEAR, 1, 1)).days
+HOURS_PER_DAY = 24
+HOURS_IN_YEAR = DAYS_IN_YEAR * HOURS_PER_DAY
+# weekday (Monday == 0) of each day and each hour of DEFAULT_YEAR
+WEEKDAYS = (np.arange(DAYS_IN_YEAR) +
+            datetime.date(DEFAULT_YEAR, 1, 1).weekday()) % 7
+HOUR_WEEKDAYS = np.repeat(WEEKDAYS, HOURS_PER_DAY)
+FRIDAY, SATURDAY, SUNDAY = 4, 5, 6
+# values are written to schedule CSVs with this format, a chunk of rows at a
+# time
+CSV_FORMAT = '%.6g'
+CSV_CHUNK_ROWS = 1024
+BATCH_MIXES = 8  # activity mixes held by a ScheduleBatch at once
 pd.options.mode.chained_assignment = None
 
 
@@ -170,60 +195,496 @@ def activities_proportions(total_area):
 
 
 def make_schedules(zones, schedule_types, activities):
+    """Make area weighted schedules for each zone.
+    
+    Every zone has the same activity mix so each schedule type is only
+    weighted once, and the resulting series is shared between the zones.
+    
+    Parameters
+    ----------
+    zones : list
+        Zone objects from the IDF.
+    schedule_types : list of str
+        Types of schedule required, e.g. 'Heat'.
+    activities : pd.DataFrame
+        Activity codes and their proportions of the floor area.
+    
+    Returns
+    -------
+    dict
+        ScheduleSet objects keyed by zone name then schedule type.
+    
+    """
+    weighted = weighted_schedules(schedule_types, activities)
     all_schedules = {}
     for zone in zones:
-        all_schedules[zone.Name] = {}
-        for st in schedule_types:
-            schedules = []
-            areas = []
-            for _i, row in activities.iterrows():
-                activity = row['activity_code']
-                area = row['area']
-                f = os.path.join(SCHEDULES_DIR, '%s_%s.imf' % (activity, st))
-                with open(f, 'rb') as schedule_file:
-                    schedules.append(Schedule(schedule_file.read()))
-                    areas.append(area)
-            
-            all_schedules[zone.Name][st] = area_weight_schedules(
-                schedules, areas)
+        all_schedules[zone.Name] = {st: weighted[st] for st in schedule_types}
         
     return all_schedules
 
 
+def weighted_schedules(schedule_types, activities):
+    """Area weight the activity schedules of each type in one pass.
+    
+    Parameters
+    ----------
+    schedule_types : list of str
+        Types of schedule required, e.g. 'Heat'.
+    activities : pd.DataFrame
+        Activity codes and their proportions of the floor area.
+    
+    Returns
+    -------
+    dict
+        A ScheduleSet for each schedule type.
+    
+    """
+    library = schedule_library()
+    codes = list(activities['activity_code'])
+    matrix = np.array([[library.hourly(code, st) for code in codes]
+                       for st in schedule_types])
+    weighted = weight_schedules(matrix, activities['area'].values)
+    return {st: ScheduleSet.from_hourly(hourly)
+            for st, hourly in zip(schedule_types, weighted)}
+
+
+class ScheduleSet(object):
+    """
+    An 8760-hour schedule held as its distinct day profiles, and the index of
+    the profile used on each day of the year.
+    
+    NCM schedules only have a handful of different days, so this is much
+    smaller than the hourly values, and transforms of whole days such as
+    stretching only need to be applied to the distinct profiles. The hourly
+    values are expanded when first needed.
+    
+    Parameters
+    ----------
+    profiles : array-like
+        Distinct day profiles, shaped (profiles x 24).
+    day_index : array-like
+        Index into profiles for each day of the year.
+    
+    """
+    __slots__ = ('profiles', 'day_index', '_hourly')
+
+    def __init__(self, profiles, day_index):
+        self.profiles = np.asarray(profiles, dtype=np.float64)
+        self.day_index = np.asarray(day_index, dtype=np.uint16)
+        self._hourly = None
+
+    @classmethod
+    def from_hourly(cls, hourly):
+        """Find the distinct days in hourly values.
+        
+        Parameters
+        ----------
+        hourly : array-like
+            Hourly values, in whole days of 24 hours.
+        
+        Returns
+        -------
+        ScheduleSet
+        
+        """
+        days = np.reshape(np.asarray(hourly, dtype=np.float64),
+                          (-1, HOURS_PER_DAY))
+        profiles, day_index = np.unique(days, axis=0, return_inverse=True)
+        return cls(profiles, day_index.ravel())
+
+    @property
+    def hourly(self):
+        """The hourly values, as a read-only array.
+        """
+        if self._hourly is None:
+            self._hourly = self.profiles[self.day_index].ravel()
+            self._hourly.flags.writeable = False
+        return self._hourly
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.hourly, dtype=dtype)
+
+    def __len__(self):
+        return len(self.day_index) * HOURS_PER_DAY
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        return self.hourly.tolist()
+
+    def stretch(self, coef, centre):
+        """Stretch each distinct day profile, as for stretch.
+        
+        Returns
+        -------
+        ScheduleSet
+        
+        """
+        if coef == 0:
+            return self
+        return ScheduleSet(stretch_days(self.profiles, coef, centre),
+                           self.day_index)
+
+    def week_periods(self, first_weekday=WEEKDAYS[0]):
+        """Split the year into periods in which each weekday keeps one profile.
+        
+        Each period can be written as a week schedule, so a schedule which
+        only has a few periods can be written as Schedule:Year, Week and Day
+        objects rather than as hourly values.
+        
+        Parameters
+        ----------
+        first_weekday : int, optional
+            Weekday of the first day, where Monday is 0 (default: the first
+            weekday of DEFAULT_YEAR).
+        
+        Returns
+        -------
+        list of tuple
+            (first day, last day, profile index for each weekday from Monday)
+            for each period, with days counted from 0.
+        
+        """
+        weekdays = (np.arange(len(self.day_index)) + first_weekday) % 7
+        periods = []
+        start = 0
+        week = [None] * 7
+        for day, (profile, weekday) in enumerate(
+                zip(self.day_index.tolist(), weekdays.tolist())):
+            if week[weekday] not in (None, profile):
+                periods.append((start, day - 1, week))
+                start, week = day, [None] * 7
+            week[weekday] = profile
+        periods.append((start, len(self.day_index) - 1, week))
+        # weekdays which are not in a short period can use any profile
+        return [(first, last, tuple(p if p is not None else
+                                    next(q for q in week if q is not None)
+                                    for p in week))
+                for first, last, week in periods]
+
+
+def stretch_schedules(schedules, coefs, centre, out=None):
+    """Stretch schedules by each of a vector of coefficients in one pass.
+    
+    Parameters
+    ----------
+    schedules : list of ScheduleSet
+        Schedules to stretch.
+    coefs : array-like
+        Non-zero coefficients to stretch by.
+    centre : int
+        Hour of the day to use as a centre point.
+    out : np.ndarray, optional
+        Array to write into, e.g. a memory-mapped file.
+    
+    Returns
+    -------
+    np.ndarray
+        Hourly values shaped (coefficients x schedules x hours).
+    
+    """
+    coefs = np.asarray(coefs, dtype=np.float64)
+    if out is None:
+        out = np.empty((len(coefs), len(schedules), HOURS_IN_YEAR))
+    for i, schedule in enumerate(schedules):
+        profiles = stretch_days(schedule.profiles, coefs, centre)
+        out[:, i] = profiles[:, schedule.day_index].reshape(len(coefs), -1)
+    return out
+
+
+class ScheduleBatch(object):
+    """
+    Stretched, area weighted schedules for every job in a campaign.
+    
+    The stretch coefficient is the only input to the schedules which changes
+    between jobs, so the schedules for all the jobs are computed together the
+    first time a job needs them. Jobs with the same coefficient share a row,
+    so only one row is computed for each distinct coefficient.
+    
+    Parameters
+    ----------
+    coefs : array-like
+        Stretch coefficient of each job.
+    centre : int, optional
+        Hour of the day to stretch around (default: 12).
+    path : str, optional
+        File in which to hold the schedules as memory-mapped arrays, for
+        campaigns with too many jobs to hold in memory. Each activity mix is
+        written to its own file next to path, and a batch pickled to another
+        process reads the files rather than computing them again.
+    mixes : int, optional
+        Number of activity mixes to hold at once (default: BATCH_MIXES).
+    
+    """
+
+    def __init__(self, coefs, centre=12, path=None, mixes=BATCH_MIXES):
+        self.coefs = np.unique(np.asarray(coefs, dtype=np.float64))
+        self.rows = {coef: row for row, coef in enumerate(self.coefs.tolist())}
+        self.centre = centre
+        self.path = path
+        self.mixes = LRUCache(mixes)
+        self.version = None
+        if path:
+            self.version = stable_hash(self.coefs.tolist(), centre,
+                                       schedule_sources_digest())[:16]
+            self.remove_stale()
+
+    def schedules(self, zones, schedule_types, activities, coef):
+        """Stretched schedules for a job, as make_schedules then stretch.
+        
+        Parameters
+        ----------
+        zones : list
+            Zone objects from the IDF.
+        schedule_types : list of str
+            Types of schedule required, e.g. 'Heat'.
+        activities : pd.DataFrame
+            Activity codes and their proportions of the floor area.
+        coef : float
+            The job's stretch coefficient, which must be one of coefs.
+        
+        Returns
+        -------
+        dict
+            Hourly schedules keyed by zone name then schedule type. The
+            schedules are views of the batch, shared between the zones.
+        
+        """
+        hourly = self.stretch(schedule_types, activities)[self.rows[coef]]
+        weighted = dict(zip(schedule_types, hourly))
+        return {zone.Name: {st: weighted[st] for st in schedule_types}
+                for zone in zones}
+
+    def stretch(self, schedule_types, activities):
+        """Schedules for every distinct coefficient, computed once for each
+        activity mix.
+        
+        Returns
+        -------
+        np.ndarray
+            Hourly values shaped (coefficients x schedule types x hours),
+            with a row for each coefficient in rows.
+        
+        """
+        key = stable_hash(list(schedule_types),
+                          list(activities['activity_code']),
+                          activities['area'].tolist())
+        hourly = self.mixes.get(key)
+        if hourly is None:
+            path = self.mix_path(key)
+            if path and os.path.isfile(path):
+                hourly = np.load(path, mmap_mode='r')
+            else:
+                weighted = weighted_schedules(schedule_types, activities)
+                hourly = self.stretch_mix(path, [weighted[st]
+                                                for st in schedule_types])
+            self.mixes[key] = hourly
+        return hourly
+
+    def mix_path(self, key):
+        """The file holding the schedules for an activity mix, if any.
+        """
+        if not self.path:
+            return None
+        root, ext = os.path.splitext(self.path)
+        return '{}.{}.{}{}'.format(root, self.version, key[:16], ext)
+
+    def stretch_mix(self, path, schedules):
+        """Stretch schedules into the file at path and map them from it.
+        
+        If there is no path, or the file cannot be written, the stretched
+        schedules are held in memory instead.
+        
+        """
+        shape = (len(self.coefs), len(schedules), HOURS_IN_YEAR)
+        if path:
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            try:
+                out = np.lib.format.open_memmap(
+                    tmp, mode='w+', dtype=np.float64, shape=shape)
+                stretch_schedules(schedules, self.coefs, self.centre, out)
+                out.flush()
+                del out
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp, path)
+                return np.load(path, mmap_mode='r')
+            except (IOError, OSError):
+                logging.debug("Could not save schedule batch {}".format(path))
+        return stretch_schedules(schedules, self.coefs, self.centre)
+
+    def remove_stale(self):
+        """Remove files written by batches with other coefficients or data.
+        """
+        root, ext = os.path.splitext(self.path)
+        for stale in glob.glob('{}.*{}'.format(root, ext)):
+            if not os.path.basename(stale).startswith(
+                    '{}.{}.'.format(os.path.basename(root), self.version)):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.path:
+            # mapped from the files when next needed
+            state['mixes'] = LRUCache(self.mixes.maxsize)
+        return state
+
+
+def schedule_digest(hourly):
+    """Identify a schedule by its content.
+    
+    Parameters
+    ----------
+    hourly : list, np.ndarray or ScheduleSet
+        Hourly schedule values.
+    
+    Returns
+    -------
+    str
+        A hex digest which is the same for schedules with equal values.
+    
+    """
+    hourly = np.ascontiguousarray(hourly, dtype=np.float64)
+    return hashlib.sha1(hourly.tobytes()).hexdigest()
+
+
+def write_schedule_csv(path, columns, fmt=CSV_FORMAT,
+                       chunk_rows=CSV_CHUNK_ROWS):
+    """Write hourly schedules as the columns of a CSV file.
+    
+    Rows are formatted and written a chunk at a time, so memory use is
+    bounded by the chunk size rather than the number of rows. Schedules
+    repeat the same few days, so each distinct row in a chunk is only
+    formatted once.
+    
+    Parameters
+    ----------
+    path : str
+        Path to the CSV file. An existing file is replaced rather than
+        overwritten, in case it is a hardlink to a cached file.
+    columns : OrderedDict
+        Hourly schedules of equal length keyed by column header.
+    fmt : str, optional
+        printf-style format for each value (default: CSV_FORMAT).
+    chunk_rows : int, optional
+        Number of rows to format and write at a time.
+    
+    """
+    values = [np.asarray(hourly, dtype=np.float64)
+              for hourly in columns.values()]
+    rows = len(values[0]) if values else 0
+    row_format = ','.join([fmt] * len(values)) + '\n'
+    if os.path.exists(path):
+        os.remove(path)
+    with open(path, 'wb') as csv:
+        csv.write((','.join(columns) + '\n').encode('ascii'))
+        for start in range(0, rows, chunk_rows):
+            chunk = np.column_stack(
+                [hourly[start:start + chunk_rows] for hourly in values])
+            lines = {}
+            text = []
+            for row in chunk:
+                key = row.tobytes()
+                if key not in lines:
+                    lines[key] = row_format % tuple(row.tolist())
+                text.append(lines[key])
+            csv.write(''.join(text).encode('ascii'))
+
+
 def make_rates(zones, rate_types, activities):
+    """Make area weighted rates for each zone.
+    
+    Parameters
+    ----------
+    zones : list
+        Zone objects from the IDF.
+    rate_types : list of str
+        Types of rate required, e.g. 'Metab'.
+    activities : pd.DataFrame
+        Activity codes and their proportions of the floor area.
+    
+    Returns
+    -------
+    dict
+        Rates keyed by zone name then rate type.
+    
+    """
+    library = schedule_library()
+    codes = list(activities['activity_code'])
+    rates = np.array([[library.rate(code, rt) for code in codes]
+                      for rt in rate_types])
+    weighted = weight_rates(rates, activities['area'].values)
     all_rates = {}
     for zone in zones:
-        all_rates[zone.Name] = {}
-        for rt in rate_types:
-            rates = []
-            areas = []
-            for _i, row in activities.iterrows():
-                activity = row['activity_code']
-                area = row['area']
-                # need to get the rates for each activity from somewhere
-                f = os.path.join(SCHEDULES_DIR, '%s_%s.imf' % (activity, rt))
-                with open(f, 'rb') as rate_file:
-                    rates.append(float(rate_file.read()) * area)
-                    areas.append(area)
-                areas.append(area)
-            all_rates[zone.Name][rt] = sum(rates) / sum(areas)
+        all_rates[zone.Name] = {rt: float(rate)
+                                for rt, rate in zip(rate_types, weighted)}
         
     return all_rates
 
 
+def weight_schedules(matrix, areas, total_area=None):
+    """Area weight stacked activity schedules in a single matrix product.
+    
+    Parameters
+    ----------
+    matrix : np.ndarray
+        Activity schedules shaped (activities x hours), or (types x activities
+        x hours) to weight many schedule types at once.
+    areas : array-like
+        Activity areas shaped (activities,), or (zones x activities) to weight
+        several activity mixes at once.
+    total_area : float, optional
+        Area to divide by. The default is the sum of the activity areas.
+    
+    Returns
+    -------
+    np.ndarray
+        Weighted schedules shaped (hours,), (types x hours), (zones x hours)
+        or (types x zones x hours).
+    
+    """
+    areas = np.asarray(areas, dtype=np.float64)
+    if total_area is None:
+        total_area = areas.sum(axis=-1, keepdims=True)
+    weights = areas / total_area
+    return np.matmul(weights, np.asarray(matrix, dtype=np.float64))
+
+
+def weight_rates(rates, areas, total_area=None):
+    """Area weight activity rates.
+    
+    Parameters
+    ----------
+    rates : array-like
+        Activity rates shaped (activities,) or (types x activities).
+    areas : array-like
+        Activity areas shaped (activities,).
+    total_area : float, optional
+        Area to divide by. The default is the sum of the activity areas.
+    
+    Returns
+    -------
+    np.ndarray
+        Weighted rates shaped () or (types,).
+    
+    """
+    rates = np.asarray(rates, dtype=np.float64)[..., np.newaxis]
+    return weight_schedules(rates, areas, total_area)[..., 0]
+
+
 def area_weighted_rate(activities, rate):
     """Create an area-weighted composite rate from activity type rates.
     """
     sb = ScheduleBuilder()    
-    rates = []
-    for _i, row in activities.iterrows():
-        code = row[0]
-        area = row[1]
-        rate_value = sb.generate_rate(code, rate)
-        scaled_rate = rate_value * area
-        rates.append(scaled_rate)
-    averaged_rate = sum(rates) / activities['final_line_area'].sum()
-    return averaged_rate
+    rates = [sb.generate_rate(code, rate) for code in activities.iloc[:, 0]]
+    averaged_rate = weight_rates(
+        rates, activities.iloc[:, 1].values,
+        activities['final_line_area'].sum())
+    return float(averaged_rate)
 
 
 def all_zone_schedules(schedule_types, activities, zone_name, days_per_week, 
@@ -255,24 +716,129 @@ def all_zone_schedules(schedule_types, activities, zone_name, days_per_week,
         Schedules generated.
 
     """
-    zone_schedules = OrderedDict()
+    workdays = HourlyTransform()
+    if days_per_week >= 6:
+        workdays += SATURDAY_AS_WORKDAY
+    if days_per_week == 7:
+        workdays += SUNDAY_AS_WORKDAY
+    closed = close_final_weeks(weeks_closed)
+
+    generated = OrderedDict()
     for st in schedule_types:
         hourly = area_weighted_schedule(
             activities, st, occupancy_hours_scalar)
         if not hourly:
             continue
-        if days_per_week >= 6:
-            hourly = set_saturday_as_workday(hourly)
-        if days_per_week == 7:
-            hourly = set_sunday_as_workday(hourly)
+        generated[st] = hourly
+    if not generated:
+        return OrderedDict()
+    # apply the weekday transforms to all schedule types in one pass
+    hourly_schedules = workdays(list(generated.values()))
+
+    zone_schedules = OrderedDict()
+    for st, hourly in zip(generated, hourly_schedules):
         if st == 'Occ':
-            hourly = set_closed_weeks(hourly, weeks_closed)
-        
-        zone_schedules['{0}_{1}'.format(zone_name, st)] = {'hourly': hourly}
+            hourly = closed(hourly)
+        zone_schedules['{0}_{1}'.format(zone_name, st)] = {
+            'hourly': hourly.tolist()}
             
     return zone_schedules
 
 
+class HourlyTransform(object):
+    """
+    Rearrangement of the hours of 8760-hour schedules, where each hour takes
+    its value from another hour or is set to zero.
+    
+    Transforms are composed with ``+``, applying the left hand transform
+    first. However many are composed, the result is applied to a stack of
+    schedules in a single pass.
+    
+    Parameters
+    ----------
+    source : np.ndarray, optional
+        The hour from which each hour takes its value (default: itself).
+    zeroed : np.ndarray, optional
+        Boolean mask of the hours to set to zero (default: none).
+    
+    """
+
+    def __init__(self, source=None, zeroed=None):
+        if source is None:
+            source = np.arange(HOURS_IN_YEAR)
+        if zeroed is None:
+            zeroed = np.zeros(HOURS_IN_YEAR, dtype=bool)
+        self.source = source
+        self.zeroed = zeroed
+
+    def __add__(self, other):
+        return HourlyTransform(self.source[other.source],
+                               self.zeroed[other.source] | other.zeroed)
+
+    def __call__(self, hourly):
+        """Apply the transform.
+        
+        Parameters
+        ----------
+        hourly : array-like
+            A schedule of 8760 hourly values, or a stack of schedules.
+        
+        Returns
+        -------
+        np.ndarray
+        
+        """
+        hourly = np.asarray(hourly, dtype=np.float64)[..., self.source]
+        hourly[..., self.zeroed] = 0
+        return hourly
+
+
+def copy_weekday(target, source):
+    """Transform to copy each day's values to the following target weekday.
+    
+    Parameters
+    ----------
+    target : int
+        Weekday to replace, where Monday is 0.
+    source : int
+        Weekday to copy from.
+    
+    Returns
+    -------
+    HourlyTransform
+    
+    """
+    offset = (target - source) % 7 * HOURS_PER_DAY
+    hours = np.flatnonzero(HOUR_WEEKDAYS == target)
+    hours = hours[hours >= offset]  # skip days with no source day before them
+    transform = HourlyTransform()
+    transform.source[hours] = hours - offset
+    return transform
+
+
+def close_final_weeks(weeks_closed):
+    """Transform to set the final n weeks of the year to zero.
+    
+    Parameters
+    ----------
+    weeks_closed : int
+        Number of weeks closed.
+    
+    Returns
+    -------
+    HourlyTransform
+    
+    """
+    transform = HourlyTransform()
+    if weeks_closed > 0:
+        transform.zeroed[-weeks_closed * 7 * HOURS_PER_DAY:] = True
+    return transform
+
+
+SATURDAY_AS_WORKDAY = copy_weekday(SATURDAY, FRIDAY)
+SUNDAY_AS_WORKDAY = copy_weekday(SUNDAY, FRIDAY)
+
+
 def set_closed_weeks(hourly, weeks_closed):
     """Set the final n weeks occupancy to zero.
     
@@ -288,11 +854,7 @@ def set_closed_weeks(hourly, weeks_closed):
     list
     
     """
-    if weeks_closed > 0:
-        num_hours_closed = weeks_closed * 24 * 7    
-        hourly[-num_hours_closed:] = num_hours_closed * [0]
-    
-    return hourly
+    return close_final_weeks(weeks_closed)(hourly).tolist()
 
 
 def set_saturday_as_workday(hourly):
@@ -307,13 +869,7 @@ def set_saturday_as_workday(hourly):
     list
 
     """
-    df = pd.DataFrame(hourly, columns=['value'])
-    df.index = pd.date_range(
-        '2015-01-01','2016-01-01',
-        freq='H')[:8760]
-    df.loc[df.index.weekday==5] = df.shift(-24)
-    
-    return list(df['value'])
+    return SATURDAY_AS_WORKDAY(hourly).tolist()
 
 
 def set_sunday_as_workday(hourly):
@@ -329,13 +885,7 @@ def set_sunday_as_workday(hourly):
     list
     
     """
-    df = pd.DataFrame(hourly, columns=['value'])
-    df.index = pd.date_range(
-        '2015-01-01','2016-01-01',
-        freq='H')[:8760]
-    df.loc[df.index.weekday==6] = df.shift(-24)
-    
-    return list(df['value'])
+    return SUNDAY_AS_WORKDAY(hourly).tolist()
 
 
 def area_weight_schedules(schedules, areas):
@@ -344,7 +894,8 @@ def area_weight_schedules(schedules, areas):
     Parameters
     ----------
     schedules : list
-        A list of schedules in hourly list format.
+        A list of schedules, either as Schedule objects or as 8760-hour
+        arrays.
     areas : list
         A list of areas corresponding to each schedule.
     
@@ -353,13 +904,11 @@ def area_weight_schedules(schedules, areas):
     list
     
     """
-    total_area = sum(areas)
-    summed_schedule = [0] * len(schedules[0].hourly_schedule)
-    for schedule, area in zip(schedules, areas):
-        schedule = [i * area for i in schedule.hourly_schedule]
-        summed_schedule = [a + b for a, b in zip(summed_schedule, schedule)]
-    area_weighted = [i / total_area for i in summed_schedule]
-    return area_weighted
+    hourly_schedules = np.array(
+        [getattr(schedule, 'hourly_array', schedule) for schedule in schedules],
+        dtype=np.float64)
+    area_weighted = weight_schedules(hourly_schedules, areas)
+    return area_weighted.tolist()
 
 
 def all_zone_rates(rate_types, activities, zone):
@@ -409,20 +958,70 @@ class ScheduleBuilder(object):
         conn_string = "mysql://root:@localhost:3306"
         tablepattern = '{self.DB_NAME}.{table}'
 
+    if config.has_option('ScheduleDB', 'snapshot'):
+        snapshot = config.get('ScheduleDB', 'snapshot')
+    else:
+        snapshot = NCM_SNAPSHOT
+
     dir = os.path.join(THIS_DIR, 'schedules')
         
-    def __init__(self):
-        self.engine = sqlalchemy.create_engine(self.conn_string, echo=False)
+    def set_dir(self, working_dir):
+        self.dir = working_dir
+
+    @property
+    def engine(self):
+        """The shared engine, which only connects when the NCM data is needed.
+        """
+        return get_engine(self.conn_string)
+
+    @property
+    def ncm(self):
+        """The NCM tables, read once per process for each source.
+        
+        A snapshot written by `python -m manager.src.ncm` is used if there is
+        one, otherwise the tables are read from the database. Which of them
+        to use is found once per process, and again only after reload.
+
+        """
+        source = self.ncm_source()
+        if source not in ncm_indexes:
+            if source == self.conn_string:
+                ncm_indexes[source] = self.read_database()
+            else:
+                ncm_indexes[source] = NCMIndex.from_snapshot(source)
+        return ncm_indexes[source]
+
+    def ncm_source(self):
+        """The snapshot if there is one, else the database connection string.
+        """
+        key = (self.snapshot, self.conn_string)
+        if key not in ncm_sources:
+            if self.snapshot and os.path.isfile(self.snapshot):
+                ncm_sources[key] = os.path.abspath(self.snapshot)
+            else:
+                ncm_sources[key] = self.conn_string
+        return ncm_sources[key]
+
+    def reload(self):
+        """Find the NCM source and read the tables again when next used, e.g.
+        after a snapshot has been written.
+        """
+        source = ncm_sources.pop((self.snapshot, self.conn_string), None)
+        ncm_indexes.pop(source, None)
+
+    def read_database(self):
+        """Read the NCM tables from the database.
+        """
+        tablenames = {table: self.tablepattern.format(self=self, table=table)
+                      for table in NCM_TABLES}
         try:
-            self.engine.connect()
+            return NCMIndex.from_engine(self.engine, tablenames)
         except DBAPIError:
             raise Exception('Building schedules requires the NCM database. \
 It can be downloaded from http://www.ncm.bre.co.uk/download.jsp. \
 If you already have the database, then check SERVER, DB_NAME and \
-DRIVER parameters for the schedules.ScheduleBuilder object')
-        
-    def set_dir(self, working_dir):
-        self.dir = working_dir
+DRIVER parameters for the schedules.ScheduleBuilder object, or \
+export a snapshot with `python -m manager.src.ncm`')
     
     def generate_schedules(self, activity_codes, schedules):
         """
@@ -461,7 +1060,8 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
             The requested schedule in IDF format.
             
         """
-        code = map_code_to_NCM_activity(code)
+        activities = activity_map()
+        activity_code, code = code, activities[code]
         imf = '%s_%s.imf' % (code['given_code'], schedule)
         imf_path = os.path.join(self.dir, imf)
         try:
@@ -469,7 +1069,7 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
                 schedule_str = schedule_file.read()
         except IOError:
             try:
-                building_type, zone = code['schedule_code'].split('-')
+                building_type, zone = activities.schedule_zones[activity_code]
             except ValueError:
                 # logger.error(code['schedule_code'])
                 raise
@@ -519,7 +1119,8 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
             The requested rate schedule in IDF format.
             
         """
-        code = map_code_to_NCM_activity(code)
+        activities = activity_map()
+        activity_code, code = code, activities[code]
         imf = '%s_%s.imf' % (code['given_code'], rate)
         imf_path = os.path.join(self.dir, imf)
         try:
@@ -527,7 +1128,7 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
                 rate_value = rate_file.read()
         except IOError:
             try:
-                building_type, zone = code['rate_code'].split('-')
+                building_type, zone = activities.rate_zones[activity_code]
             except ValueError:
                 # logger.error(code['rate_code'])
                 raise
@@ -610,13 +1211,10 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
     def get_annual_id(self, building_type, zone, schedule):
         """Get the ID number of an annual schedule.
         """
-        annual_id = self.select(
-            'annual_schedules',
-            where="NAME='{building_type}_{zone}_{schedule}'".format(**locals())
-        )['ID']
+        name = "{building_type}_{zone}_{schedule}".format(**locals())
         try:
-            return int(annual_id)
-        except TypeError:
+            return int(self.ncm.row('annual_schedules', name=name)['ID'])
+        except KeyError:
             raise KeyError('Annual ID not found')
         
     def get_annual_weekly_schedule(self, annual_id):
@@ -625,21 +1223,15 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
         schedule should be applied.
 
         """
-        annual_weekly_schedule = self.select(
-            'annual_weekly_schedules',
-            where="ANNUAL_SCHEDULE='{annual_id}'".format(**locals())
-        )
-        return annual_weekly_schedule
+        return self.ncm.annual_weekly_schedule(annual_id)
     
     def make_schedule_year(self, aws):
         """Build the Schedule:Year object from the annual weekly schedule.
         """
         # create the header part of the schedule
         obj_type = "Schedule:Year"
-        name = self.select(
-            'annual_schedules',
-            where="ID='%s'" % aws['ANNUAL_SCHEDULE'].iloc[0]
-        ).iloc[0]['NAME']
+        name = self.ncm.row(
+            'annual_schedules', aws['ANNUAL_SCHEDULE'].iloc[0])['NAME']
         type_limits = ""  # not currently used
         header = "{obj_type},\n\t{name},\n\t{type_limits}".format(**locals())
 
@@ -648,10 +1240,8 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
         dates = []
         for i in range(len(aws)):
             row = aws.iloc[i]
-            week_name = self.select(
-                'weekly_schedules',
-                where="ID='%s'" % aws.iloc[i]['WEEKLY_SCHEDULE']
-            ).iloc[0]['NAME']
+            week_name = self.ncm.row(
+                'weekly_schedules', row['WEEKLY_SCHEDULE'])['NAME']
             start_date = "%s,%s" % (row['START_MONTH'], row['START_DAY'])
             end_date = "%s,%s" % (row['END_MONTH'], row['END_DAY'])
             dates += ["{week_name}, {start_date}, {end_date}".format(**locals())]
@@ -708,9 +1298,8 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
                  
         """
         obj_type = "Schedule:Week:Daily"
-        sch = self.select('weekly_schedules',
-            where="ID='%s'" % w_id)
-        name = sch['NAME'].iloc[0]
+        sch = self.ncm.row('weekly_schedules', w_id)
+        name = sch['NAME']
         week_sch = [sch['SUNDAY'], sch['MONDAY'], sch['TUESDAY'], sch['WEDNESDAY'],
                     sch['THURSDAY'], sch['FRIDAY'], sch['SATURDAY'],
                     sch['HOLIDAY'],
@@ -722,12 +1311,7 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
         return "{obj_type},\n\t{name},\n\t{week_sch};".format(**locals())
 
     def get_day_name(self, day):
-        name = self.select(
-            'daily_schedules',
-            fields='NAME',
-            where="ID='%s'" % int(day)
-        ).iloc[0].iloc[0]
-        return name
+        return self.ncm.row('daily_schedules', int(day))['NAME']
 
     def get_daily_ids(self, weekly_ids):
         """Returns the set of daily schedule IDs referenced by a set of weekly IDs.
@@ -747,10 +1331,8 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
                 'FRIDAY', 'SATURDAY', 'SUNDAY', 'HOLIDAY']
         daily_ids = []
         for w_id in weekly_ids:
-            sch = self.select('weekly_schedules',
-                fields=",".join(days),
-                where="ID='%s'" % w_id)
-            daily_ids += list(sch.iloc[0].astype(int))
+            sch = self.ncm.row('weekly_schedules', w_id)
+            daily_ids += list(sch[days].astype(int))
         return list(set(daily_ids))
 
     def get_daily_schedule(self, daily_id):
@@ -765,10 +1347,7 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
         str
     
         """
-        schedule = self.select(
-            'daily_schedules',
-            where="ID='{daily_id}'".format(**locals())
-        )
+        schedule = self.ncm.row('daily_schedules', daily_id)
         schedule_obj = self.make_schedule_day_list(schedule)
         return schedule_obj
     
@@ -784,22 +1363,18 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
         str
     
         """
-        schedule = self.select(
-            'daily_schedules',
-            where="ID='{daily_id}'".format(**locals())
-        )
+        schedule = self.ncm.row('daily_schedules', daily_id)
         off_vals = {'Cool': '100',
                      'Heat': '-100'}
-        name = schedule['NAME'][0]
+        name = schedule['NAME']
         s_type = name.split('_')[-2]
-        time_cols = [col for col in schedule if
+        time_cols = [col for col in schedule.index if
                      col.startswith('h') and
                      col != 'holiday']
-        values = list(schedule[time_cols].iloc[0].astype(str))
+        values = list(schedule[time_cols].astype(str))
         values = [v if v != 'None' else off_vals[s_type] for v in values]
         
-        fhandle = StringIO("")
-        idf = IDF(fhandle)
+        idf = models.new()
         sch = idf.newidfobject(
             'SCHEDULE:DAY:INTERVAL',
             Name=name,
@@ -825,22 +1400,28 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
     
     def make_schedule_day_list(self, schedule):
         """Build a Schedule:Day:List object from a daily schedule.
+        
+        Parameters
+        ----------
+        schedule : pd.Series
+            A row from the NCM daily_schedules table.
+        
         """
         off_vals = {'Cool': '100',
                      'Heat': '-100'}
         obj_type = "Schedule:Day:List"
-        name = schedule['NAME'][0]
+        name = schedule['NAME']
         s_type = name.split('_')[-2]
         fill = 'yes'
         mins = 60
-        time_cols = [col for col in schedule if
+        time_cols = [col for col in schedule.index if
                      col.startswith('h') and
                      col != 'holiday']
         
         
         header = "{obj_type},\n\t{name},\n\t{s_type},\n\t{fill}".format(
             **locals())
-        values = list(schedule[time_cols].iloc[0].astype(float))
+        values = list(schedule[time_cols].astype(float))
         values = self.scale_values(values)
         values = [v if v != 'nan' else off_vals[s_type] for v in values]
 
@@ -886,24 +1467,81 @@ DRIVER parameters for the schedules.ScheduleBuilder object')
     
         """
         rate_col = map_rate_to_NCM_column(rate)
-        rate_value = self.select(
-            'activity',
-            where="NAME='{building_type}_{zone}'".format(**locals())
-        )
-        rate_value = rate_value[rate_col]
-        rate_value = rate_value.iloc[0]
-        rate_value = float(rate_value)
+        rate_value = self.ncm.row(
+            'activity', name="{building_type}_{zone}".format(**locals()))
+        rate_value = float(rate_value[rate_col])
 
         return rate_value
 
 
+class ActivityMap(object):
+    """
+    Mapping from the activity codes in the given data to NCM activities.
+
+    The building type and zone of each NCM schedule and rate code are split
+    out once when the map is read.
+
+    Parameters
+    ----------
+    items : list of dict
+        The contents of mapToNCM.json, one single-item dict per activity code.
+
+    """
+
+    def __init__(self, items):
+        self.codes = {}
+        self.schedule_zones = {}
+        self.rate_zones = {}
+        for item in items:
+            for activity_code, mapped in item.items():
+                self.codes[activity_code] = mapped
+                self.schedule_zones[activity_code] = split_ncm_code(
+                    mapped.get('schedule_code'))
+                self.rate_zones[activity_code] = split_ncm_code(
+                    mapped.get('rate_code'))
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as data:
+            return cls(json.loads(data.read().decode('utf-8')))
+
+    def __getitem__(self, activity_code):
+        return self.codes[activity_code]
+
+    def lookup(self, activity_codes):
+        """Map many activity codes at once.
+        """
+        return [self.codes[code] for code in activity_codes]
+
+
+def split_ncm_code(ncm_code):
+    """Split an NCM code such as 'D1_Edu-ClassRm' into (building type, zone).
+    """
+    if ncm_code is None:
+        return None
+    return tuple(ncm_code.split('-'))
+
+
+ACTIVITY_MAP = os.path.join(SCHEDULES_DIR, 'mapToNCM.json')
+
+activity_maps = {}
+
+
+def activity_map(path=ACTIVITY_MAP):
+    """The ActivityMap for a file, read again only when the file changes.
+    """
+    key = file_key(path)
+    if activity_maps.get(key[0], (None,))[0] != key:
+        activity_maps[key[0]] = key, ActivityMap.read(path)
+    return activity_maps[key[0]][1]
+
+
 def map_code_to_NCM_activity(activity_code):
     """
     This function is needed to map from an activity code in the given format to
     ones that can be found in the NCM database.
     
-    For now we have a deterministic mapping stored in a dict, but this should
-    eventually be expanded/completed and moved into a json file.
+    The mapping is stored in mapToNCM.json.
     
     Parameters
     ----------
@@ -912,16 +1550,17 @@ def map_code_to_NCM_activity(activity_code):
     
     Returns
     -------
-    tuple of str
-        (Building type, zone type).
+    dict
+        The given code and the NCM schedule and rate codes.
         
     """
-    with open(os.path.join(SCHEDULES_DIR, 'mapToNCM.json'), 'rb') as data:
-        activity_map = {item.keys()[0]: item for item in json.loads(data.read())}
-    
-    mapped_activity = activity_map[activity_code][activity_code]
+    return activity_map()[activity_code]
 
-    return mapped_activity
+
+def map_codes_to_NCM_activities(activity_codes):
+    """Map a list of activity codes with a single lookup of the mapping.
+    """
+    return activity_map().lookup(activity_codes)
 
 def map_rate_to_NCM_column(rate):
     """
@@ -947,17 +1586,7 @@ def get_external_temps(epw):
         Hourly (8760 hours) outdoor temperature.
     
     """
-    epw_headers = [
-        'year', 'month', 'day', 'hour', 'minute', 'datasource', 'drybulb',
-        'dewpoint', 'relhum', 'atmos_pressure', 'exthorrad', 'extdirrad',
-        'horirsky', 'glohorrad', 'dirnorrad', 'difhorrad', 'glohorillum',
-        'dirnorillum', 'difhorillum', 'zenlum', 'winddir', 'windspd',
-        'totskycvr', 'opaqskycvr', 'visibility', 'ceiling_hgt',
-        'presweathobs', 'presweathcodes', 'precip_wtr',
-        'aerosol_opt_depth', 'snowdepth', 'days_last_snow', 'Albedo', 
-        'liq_precip_depth', 'liq_precip_rate']
-    data = pd.read_csv(epw, skiprows=8, header=None, names=epw_headers)
-    external_temps = list(data['drybulb'])
+    external_temps = epw_column(epw, 'drybulb').tolist()
 
     return external_temps
 
@@ -967,32 +1596,222 @@ def area_weighted_schedule(activities, st, occupancy_hours_scalar):
     """
     sb = ScheduleBuilder()
     sb.occupancy_hours_scalar = occupancy_hours_scalar
-    hourly_schedules = []
-    for _i, row in activities.iterrows():
-        code = row[0]
-        area = row[1]
-        if not code:
-            return
-        schedule_str = sb.generate_schedule(code, st)
-        s = Schedule(schedule_str)
-        # convert to numpy array for faster processing and simpler operations
-        np_schedule = np.array(s.hourly_schedule)
-        if st.lower() == 'heat':
-            # replace -100 values with 0
-            np_schedule[np_schedule < 0] = 0
-        scaled_schedule = np_schedule * area
-        hourly_schedules.append(scaled_schedule)
-    
-    hourly_schedules = np.array(hourly_schedules)
-    averaged_schedule = (
-        np.sum(hourly_schedules, axis=0) / activities['final_line_area'].sum())
+    codes = activities.iloc[:, 0]
+    if not all(codes):
+        return
+    hourly_schedules = np.array(
+        [Schedule(sb.generate_schedule(code, st)).hourly_array
+         for code in codes])
+    if st.lower() == 'heat':
+        # replace -100 values with 0
+        hourly_schedules[hourly_schedules < 0] = 0
+    averaged_schedule = weight_schedules(
+        hourly_schedules, activities.iloc[:, 1].values,
+        activities['final_line_area'].sum())
     # convert back to list as np arrays can't be serialised to JSON    
-    averaged_schedule = list(averaged_schedule)
+    averaged_schedule = averaged_schedule.tolist()
     return averaged_schedule
 
 
+class ScheduleLibrary(object):
+    """
+    Process-wide store of the schedules and rates in the IMF schedule
+    directory.
+    
+    Parsed files are kept in an LRU cache keyed by (path, mtime, size) so each
+    file is only read once per process, and edited files are picked up. The
+    whole library can also be saved in a compiled form which later runs
+    memory-map instead of parsing the IMF text.
+    
+    Parameters
+    ----------
+    schedules_dir : str, optional
+        Directory containing the IMF files.
+    compiled : str, optional
+        Path to a compiled library, which is loaded if it exists.
+    maxsize : int, optional
+        Number of parsed files to keep in memory.
+    
+    """
+    compiled_dtype = np.dtype([
+        ('name', 'S64'),
+        ('mtime', np.float64),
+        ('size', np.int64),
+        ('rate', np.float64),
+        ('hourly', np.float64, (HOURS_IN_YEAR,)),
+        ])
+
+    def __init__(self, schedules_dir=SCHEDULES_DIR, compiled=COMPILED_SCHEDULES,
+                 maxsize=256):
+        self.dir = schedules_dir
+        self.cache = LRUCache(maxsize)
+        self.table = None
+        self.rows = {}
+        if compiled and os.path.isfile(compiled):
+            self.load(compiled)
+
+    def path(self, activity, kind):
+        """Path to the IMF file for an activity and schedule or rate type.
+        """
+        return os.path.join(self.dir, '%s_%s.imf' % (activity, kind))
+
+    def read(self, path):
+        """Parse an IMF file, or fetch it from the cache.
+        
+        Returns
+        -------
+        Schedule or float
+            A Schedule for schedule files, or the value in a rate file.
+        
+        """
+        key = file_key(path)
+        parsed = self.cache.get(key)
+        if parsed is None:
+            with io.open(path, encoding='utf-8') as imf:
+                imf_str = imf.read()
+            if 'Schedule:Year' in imf_str:
+                parsed = Schedule(imf_str)
+                parsed.compile()
+            else:
+                parsed = float(imf_str)
+            self.cache[key] = parsed
+        return parsed
+
+    def compiled_row(self, path):
+        """Find an up-to-date row in the compiled library for an IMF file.
+        
+        Returns
+        -------
+        int or None
+            The row number, or None if the file is not in the compiled
+            library or has changed since it was compiled.
+        
+        """
+        row = self.rows.get(os.path.basename(path))
+        if row is None:
+            return None
+        try:
+            _path, mtime, size = file_key(path)
+        except OSError:
+            return row  # only the compiled library is available
+        if (self.table['mtime'][row], self.table['size'][row]) != (mtime, size):
+            return None
+        return row
+
+    def schedule(self, activity, st):
+        """Parsed Schedule for an activity and schedule type, e.g. 'Heat'.
+        """
+        return self.read(self.path(activity, st))
+
+    def hourly(self, activity, st):
+        """8760-hour schedule for an activity and schedule type.
+        
+        Returns
+        -------
+        np.ndarray
+            A new float64 array which is safe to edit in place.
+        
+        """
+        path = self.path(activity, st)
+        row = self.compiled_row(path)
+        if row is not None:
+            return np.array(self.table['hourly'][row])
+        return self.read(path).hourly_array
+
+    def rate(self, activity, rt):
+        """Rate value for an activity and rate type, e.g. 'Metab'.
+        """
+        path = self.path(activity, rt)
+        row = self.compiled_row(path)
+        if row is not None:
+            return float(self.table['rate'][row])
+        return self.read(path)
+
+    def save(self, path=COMPILED_SCHEDULES):
+        """Compile every IMF file in the library to a single .npy file.
+        
+        Each row holds the file name, its mtime and size when compiled, and
+        either the 8760-hour schedule or the rate value.
+        
+        Parameters
+        ----------
+        path : str, optional
+            Path to save the compiled library to.
+        
+        """
+        imfs = sorted(glob.glob(os.path.join(self.dir, '*.imf')))
+        table = np.zeros(len(imfs), dtype=self.compiled_dtype)
+        for row, imf in zip(table, imfs):
+            parsed = self.read(imf)
+            _path, row['mtime'], row['size'] = file_key(imf)
+            row['name'] = os.path.basename(imf).encode('utf-8')
+            if isinstance(parsed, Schedule):
+                row['rate'] = np.nan
+                row['hourly'] = parsed.hourly_array
+            else:
+                row['rate'] = parsed
+                row['hourly'] = np.nan
+        np.save(path, table)
+
+    def load(self, path=COMPILED_SCHEDULES):
+        """Memory-map a compiled library.
+        
+        Parameters
+        ----------
+        path : str, optional
+            Path to a library saved by ``save``.
+        
+        """
+        self.table = np.load(path, mmap_mode='r')
+        self.rows = {name.decode('utf-8'): row
+                     for row, name in enumerate(self.table['name'])}
+
+
+_schedule_library = None
+
+
+def schedule_library():
+    """The process-wide ScheduleLibrary, created on first use.
+    """
+    global _schedule_library
+    if _schedule_library is None:
+        _schedule_library = ScheduleLibrary()
+    return _schedule_library
+
+
+def schedule_sources_digest(schedules_dir=None):
+    """Identify the current version of the data which schedules are made from.
+    
+    This covers the IMF schedule library and mapToNCM.json in the schedules
+    directory, the compiled library and the NCM snapshot, and the activity
+    areas used by activities_proportions.
+    
+    Parameters
+    ----------
+    schedules_dir : str, optional
+        Directory containing the IMF files (default: SCHEDULES_DIR).
+    
+    Returns
+    -------
+    str
+        A hex digest which changes when any of the data is edited.
+    
+    """
+    if schedules_dir is None:
+        schedules_dir = SCHEDULES_DIR
+    paths = sorted(glob.glob(os.path.join(schedules_dir, '*')))
+    paths += [path for path in [COMPILED_SCHEDULES, ScheduleBuilder.snapshot]
+              if path and os.path.isfile(path)]
+    versions = [[os.path.basename(path)] + list(file_key(path)[1:])
+                for path in paths]
+    return stable_hash(versions, zones)
+
+
 class Schedule(object):
 
+    day_list = ['Monday','Tuesday','Wednesday','Thursday','Friday',
+                'Saturday','Sunday'
+                ]
     
     def __init__(self, schedule_str):
         """Read EnergyPlus schedules and convert to 8760 hours of hourly values.
@@ -1019,7 +1838,63 @@ class Schedule(object):
                      if obj[0] == 'Schedule:Week:Daily'}
         self.days = {obj[1]: Day(obj) for obj in objects
                      if obj[0] == 'Schedule:Day:List'}
-    
+        self._compiled = None
+
+    def compile(self):
+        """Compile the schedule into a day-of-year index and day profiles.
+        
+        The result is cached so the Schedule:Year periods are only walked
+        once per schedule.
+        
+        Returns
+        -------
+        tuple of np.ndarray
+            A day-of-year index of DAYS_IN_YEAR rows into a (unique days x 24)
+            float64 array of Schedule:Day:List values. Days which are not
+            covered by any Schedule:Year period are indexed as -1.
+        
+        """
+        if self._compiled is not None:
+            return self._compiled
+        day_names = sorted(self.days)
+        rows = {name: i for i, name in enumerate(day_names)}
+        day_profiles = np.array(
+            [self.days[name].hourly_values for name in day_names],
+            dtype=np.float64).reshape(len(day_names), HOURS_PER_DAY)
+        # map each weekday (Monday == 0) to its day profile row, per week
+        weeks = {name: np.array([rows[week.days[d]] for d in self.day_list],
+                                dtype=np.int16)
+                 for name, week in self.weeks.items()}
+        first_day = datetime.date(DEFAULT_YEAR, 1, 1).toordinal()
+        day_index = np.full(DAYS_IN_YEAR, -1, dtype=np.int16)
+        for y in self.years:
+            # later periods overwrite earlier ones, as in the day-by-day walk
+            for p in self.years[y].periods:
+                a = self.years[y].periods[p]['start'].toordinal() - first_day
+                b = self.years[y].periods[p]['end'].toordinal() - first_day + 1
+                week = weeks[p.split('#')[0]]
+                day_index[a:b] = week[WEEKDAYS[a:b]]
+        self._compiled = day_index, day_profiles
+        # index -1 picks up the trailing row of NaNs for undefined days
+        self._day_table = np.vstack(
+            (day_profiles, np.full((1, HOURS_PER_DAY), np.nan)))
+        return self._compiled
+
+    @property
+    def hourly_array(self):
+        """8760-hour hourly schedule as a float64 array.
+        
+        Hours not covered by any Schedule:Year period are set to NaN. A new
+        array is returned on each call so it can safely be edited in place.
+        
+        Returns
+        -------
+        np.ndarray
+        
+        """
+        day_index, _day_profiles = self.compile()
+        return self._day_table[day_index].ravel()
+
     @property
     def hourly_schedule(self):
         """8760-hour hourly schedule or schedules.
@@ -1027,27 +1902,13 @@ class Schedule(object):
         Returns
         -------
         list
+            Hours not covered by any Schedule:Year period are flagged 'n/a'.
             
         """
-        day_list = ['Monday','Tuesday','Wednesday','Thursday','Friday',
-                    'Saturday','Sunday'
-                    ]
-        year_of_hours = ['n/a'] * 8760  # initialise with a flag value of n/a
-        for y in self.years:
-            # for each period
-            for p in self.years[y].periods:
-                a = self.years[y].periods[p]['start']
-                b = self.years[y].periods[p]['end']
-                # step through the period one day at a time
-                for dt in rrule(DAILY, dtstart=a, until=b):
-                    day_of_year = dt.timetuple().tm_yday
-                    # look up the day type
-                    days = self.weeks[p.split('#')[0]].days
-                    d = day_list[dt.weekday()]
-                    # store the value for each hour in the period
-                    for i, h_val in enumerate(self.days[days[d]].hourly_values):
-                        hour_num = (day_of_year - 1) * 24 + i
-                        year_of_hours[hour_num] = float(h_val)
+        hourly = self.hourly_array
+        year_of_hours = hourly.tolist()
+        for i in np.flatnonzero(np.isnan(hourly)):
+            year_of_hours[i] = 'n/a'
         return year_of_hours
         
         
@@ -1058,8 +1919,9 @@ class Year(object):
         self.schedule_type = inputs[0]
         self.name = inputs[1]
         self.type_limits = inputs[2]
-        # parse the field sets into periods 
-        self.periods = defaultdict(dict)
+        # parse the field sets into periods, keeping their order since later
+        # periods take precedence over earlier ones
+        self.periods = OrderedDict()
         field_sets = list(chunks(inputs[3:], 5))
         for i, fs in enumerate(field_sets):
             start_date = datetime.date(DEFAULT_YEAR, int(fs[1]), int(fs[2]))
@@ -1106,7 +1968,7 @@ def stretch(xs, coef, centre):
     Parameters
     ----------
     xs : list
-        Input values.
+        Input values, in whole days of 24 hours.
     coef : float
         Coefficient to scale by.
     centre : int
@@ -1119,31 +1981,78 @@ def stretch(xs, coef, centre):
     """
     if coef == 0:
         return xs
-    grain = 100
-    stretched_xs = []
-    days = chunks(xs, 24)
-    for xs in days:
-        stretched_array = np.repeat(xs, grain * coef)
-        
-        if coef < 1:
-            # pad start and end
-            total_pad_len = grain * len(xs) - len(stretched_array)
-            centre_pos = float(centre) / len(xs)
-            start_pad_len = centre_pos * total_pad_len
-            end_pad_len = (1 - centre_pos) * total_pad_len
-            start_pad = [stretched_array[0]] * int(start_pad_len)
-            end_pad = [stretched_array[-1]] * int(end_pad_len)
-            stretched_array = np.array(start_pad + list(stretched_array) + end_pad)
-        else:
-            pivot_point = (len(xs) - centre) * grain * coef
-            first = int(pivot_point - (len(xs) * grain) / 2)
-            last = first + len(xs) * grain
-            stretched_array = stretched_array[first:last]
-        
-        stretched_xs.extend(
-            [round(chunk.mean(), 2) 
-             for chunk in chunks(stretched_array, grain)])
-    return stretched_xs
+    days = np.reshape(np.asarray(xs, dtype=np.float64), (-1, HOURS_PER_DAY))
+    return stretch_days(days, coef, centre).ravel().tolist()
+
+
+def stretch_days(days, coef, centre):
+    """Scale each day of a schedule by a coefficient around an hour of the day.
+    
+    Each day is treated as a step function which is stretched (or squeezed)
+    about the centre hour, with the first and last values of the day carried
+    on beyond its ends. The result for each hour is the mean of the stretched
+    function over that hour, found exactly from the cumulative integral of the
+    day so any coefficient can be used.
+    
+    Parameters
+    ----------
+    days : np.ndarray
+        Days of hourly values, shaped (days x 24).
+    coef : float or np.ndarray
+        Coefficient to scale by, or a vector of non-zero coefficients to
+        stretch the days by each of them at once.
+    centre : int
+        Hour of the day to use as a centre point.
+    
+    Returns
+    -------
+    np.ndarray
+        The stretched days, rounded to two decimal places, shaped like days
+        or (coefficients x days x 24).
+    
+    """
+    days = np.asarray(days, dtype=np.float64)
+    coef = np.asarray(coef, dtype=np.float64)
+    hours = days.shape[-1]
+    # the hour boundaries of the result, mapped back onto the original day
+    edges = centre + (np.arange(hours + 1) - centre) / coef[..., np.newaxis]
+    integral = day_integral(days, edges)
+    stretched = np.round(np.diff(integral, axis=-1) * coef[..., np.newaxis], 2)
+    if coef.ndim:
+        stretched = np.moveaxis(stretched, days.ndim - 1, 0)
+    return stretched
+
+
+def day_integral(days, t):
+    """Integral of each day's step function from the start of the day to t.
+    
+    The first and last values of the day are extended before and after the
+    day.
+    
+    Parameters
+    ----------
+    days : np.ndarray
+        Days of hourly values, shaped (days x 24).
+    t : np.ndarray
+        Times in hours at which to evaluate the integral, of any shape.
+    
+    Returns
+    -------
+    np.ndarray
+        Shaped (days x t.shape).
+    
+    """
+    t = np.asarray(t, dtype=np.float64)
+    hours = days.shape[-1]
+    cumulative = np.zeros(days.shape[:-1] + (hours + 1,))
+    np.cumsum(days, axis=-1, out=cumulative[..., 1:])
+    within = np.clip(t, 0, hours)
+    hour = np.minimum(within.astype(np.int64), hours - 1)
+    integral = cumulative[..., hour] + days[..., hour] * (within - hour)
+    extend = (Ellipsis,) + (np.newaxis,) * (t.ndim - 1)
+    integral += days[..., :1][extend] * np.minimum(t, 0)
+    integral += days[..., -1:][extend] * np.maximum(t - hours, 0)
+    return integral
 
 
 def chunks(iterable, n):
@@ -1154,3 +2063,9 @@ def chunks(iterable, n):
     """
     for i in xrange(0, len(iterable), n):
         yield iterable[i:i + n]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ScheduleLibrary(compiled=None).save()
+    logging.info("Compiled schedule library saved to %s" % COMPILED_SCHEDULES)
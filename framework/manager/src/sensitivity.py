@@ -31,6 +31,8 @@ from SALib.util import read_param_file
 
 import numpy as np
 
+from manager.src.sites import sites
+
 logging.basicConfig(level=logging.INFO)
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -38,7 +40,6 @@ THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 J_per_kWh = 3600000
 
 param_file = os.path.join(THIS_DIR, os.pardir, 'data/parameters.txt')
-sites_file = os.path.join(THIS_DIR, os.pardir, 'data/schools.json')
 problem = read_param_file(param_file)
 
 
@@ -48,9 +49,7 @@ def sensitivity_analysis(
     """
     names, runs, empty_results = samples(**kwargs)
     jobs = enumerate(zip(names, (float(n) for n in run)) for run in runs)
-    with open(sites_file, 'r') as f:
-        schools = json.load(f)
-    school = schools.popitem()
+    school = next(sites.items())  # (name, site) for the first site
 
     logging.debug("Initialising empty results")
     elec_results = deepcopy(empty_results)
@@ -0,0 +1,184 @@
+"""
+sites.py
+~~~~~~~~
+Access to the sites in schools.json by name.
+
+The JSON file is read once into a SQLite index of the sites, keyed by name,
+which is rebuilt whenever the JSON file changes. After that a single site is
+loaded by parsing only its own entry, and recently used sites are held in
+memory.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import sqlite3
+
+from manager.src.caching import LRUCache
+from manager.src.caching import file_key
+
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+SITES_FILE = os.path.join(THIS_DIR, os.pardir, 'data/schools.json')
+SITES_INDEX = os.path.join(THIS_DIR, os.pardir, 'data/cached/sites.sqlite')
+
+
+class SiteStore(object):
+    """
+    Sites keyed by name, loaded from an index as they are needed.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file with a site for each name (default: SITES_FILE).
+    index : str, optional
+        SQLite file for the index (default: SITES_INDEX).
+    maxsize : int, optional
+        Number of sites to hold in memory (default: 256).
+
+    """
+
+    def __init__(self, path=SITES_FILE, index=SITES_INDEX, maxsize=256):
+        self.path = path
+        self.index = index
+        self.sites = LRUCache(maxsize)
+        self._con = None
+        self._pid = None
+        self._source = None
+
+    def __getitem__(self, name):
+        """A site, which is shared with other callers and must not be edited.
+
+        Raises
+        ------
+        KeyError
+            If there is no site with the name.
+
+        """
+        site = self.sites.get(name)
+        if site is None:
+            row = self.connection().execute(
+                'SELECT data FROM sites WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                raise KeyError(name)
+            site = json.loads(row[0])
+            self.sites[name] = site
+        return site
+
+    def __contains__(self, name):
+        row = self.connection().execute(
+            'SELECT 1 FROM sites WHERE name = ?', (name,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.connection().execute(
+            'SELECT COUNT(*) FROM sites').fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def names(self):
+        """Names of all the sites, in order.
+        """
+        rows = self.connection().execute(
+            'SELECT name FROM sites ORDER BY name')
+        return [name for name, in rows]
+
+    def items(self):
+        """Iterate over (name, site) for all the sites, in order of name.
+
+        Sites are read from the index a row at a time, and are not added to
+        the in-memory cache, so a campaign over every site does not evict the
+        sites being used by jobs.
+
+        """
+        rows = self.connection().execute(
+            'SELECT name, data FROM sites ORDER BY name')
+        for name, data in rows:
+            yield name, json.loads(data)
+
+    def connection(self):
+        """Connect to the index, building it first if it is out of date.
+
+        Each process opens its own connection, and connects again if the
+        JSON file changes.
+
+        """
+        source = source_key(self.path) if os.path.isfile(self.path) else None
+        if (self._con is None or self._pid != os.getpid() or
+                source != self._source):
+            if self.stale():
+                self.build()
+            self._con = sqlite3.connect(self.index)
+            self._pid = os.getpid()
+            self._source = source
+            self.sites.clear()
+        return self._con
+
+    def stale(self):
+        """Whether the index needs building from the JSON file.
+        """
+        if not os.path.isfile(self.index):
+            return True
+        if not os.path.isfile(self.path):
+            return False  # use the index we have
+        con = sqlite3.connect(self.index)
+        try:
+            row = con.execute("SELECT value FROM meta WHERE key = 'source'"
+                              ).fetchone()
+        except sqlite3.DatabaseError:
+            return True
+        finally:
+            con.close()
+        return row is None or json.loads(row[0]) != source_key(self.path)
+
+    def build(self):
+        """Index the sites in the JSON file.
+        """
+        with io.open(self.path, encoding='utf-8') as f:
+            sites = json.load(f)
+        directory = os.path.dirname(self.index)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = '{}.{}.tmp'.format(self.index, os.getpid())
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        con = sqlite3.connect(tmp)
+        try:
+            con.execute(
+                'CREATE TABLE sites (name TEXT PRIMARY KEY, data TEXT)')
+            con.execute(
+                'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            con.executemany(
+                'INSERT INTO sites VALUES (?, ?)',
+                ((name, json.dumps(dict(site, name=name)))
+                 for name, site in sites.items()))
+            con.execute("INSERT INTO meta VALUES ('source', ?)",
+                        (json.dumps(source_key(self.path)),))
+            con.commit()
+        finally:
+            con.close()
+        if os.path.exists(self.index):
+            os.remove(self.index)
+        os.rename(tmp, self.index)
+
+
+def source_key(path):
+    """Modification time and size of the JSON file, as stored in the index.
+    """
+    _path, mtime, size = file_key(path)
+    return [mtime, size]
+
+
+sites = SiteStore()
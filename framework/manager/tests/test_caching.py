@@ -0,0 +1,54 @@
+# Copyright (c) 2017 Jamie Bull
+# =======================================================================
+#  Distributed under the MIT License.
+#  (See accompanying file LICENSE or copy at
+#  http://opensource.org/licenses/MIT)
+# =======================================================================
+"""pytest for caching.py"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+
+from manager.src.caching import DiskCache
+from manager.src.caching import LRUCache
+from manager.src.caching import stable_hash
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3  # evicts 'b', the least recently used
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_stable_hash():
+    assert (stable_hash({'a': 1, 'b': [1.5, 'x']}) ==
+            stable_hash({'b': [1.5, 'x'], 'a': 1}))
+    assert stable_hash(100.0, ['Zone1'], 1.1) != stable_hash(100.0, ['Zone1'], 1.2)
+
+
+def test_disk_cache(tmpdir):
+    source = tmpdir.join('source.csv')
+    source.write('x' * 100)
+    cache = DiskCache(str(tmpdir.join('cache')), maxsize=250)
+    assert cache.get('a') is None
+    cache.put('a', {'data.csv': str(source)}, {'meta.json': '[]'})
+    entry = cache.get('a')
+    assert open(os.path.join(entry, 'data.csv')).read() == 'x' * 100
+    assert open(os.path.join(entry, 'meta.json')).read() == '[]'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    os.utime(entry, (0, 0))  # make 'a' the least recently used
+    cache.put('b', {'data.csv': str(source)})
+    cache.put('c', {'data.csv': str(source)})
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+    assert cache.get('c') is not None
@@ -0,0 +1,48 @@
+# Copyright (c) 2017 Jamie Bull
+# =======================================================================
+#  Distributed under the MIT License.
+#  (See accompanying file LICENSE or copy at
+#  http://opensource.org/licenses/MIT)
+# =======================================================================
+"""pytest for epw.py"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import glob
+import os
+
+from manager.src import epw
+import numpy as np
+
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+EPW = os.path.join(
+    THIS_DIR, os.pardir, 'data/weather/islington/cntr_Islington_TRY.epw')
+
+
+def test_read_epw(tmpdir):
+    path = str(tmpdir.join('weather.epw'))
+    with open(EPW, 'rb') as source, open(path, 'wb') as f:
+        f.write(source.read())
+    data = epw.read_epw(path)
+    assert len(data) == 8760
+    assert data['drybulb'][0] == -1.6
+    assert data['relhum'][0] == 60
+    assert data['month'][-1] == 12
+    assert not data.flags.writeable
+    assert len(glob.glob(path + '.*.npy')) == 1
+
+    epw.weather_files.clear()
+    cached = epw.read_epw(path)
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached['drybulb'], data['drybulb'])
+    assert epw.read_epw(path) is cached
+    assert np.shares_memory(epw.column(path, 'drybulb'), cached)
+
+
+def test_first_weekday():
+    assert epw.first_weekday(EPW) == 6  # Sunday
+    assert epw.first_weekday(None) is None
@@ -0,0 +1,93 @@
+# Copyright (c) 2017 Jamie Bull
+# =======================================================================
+#  Distributed under the MIT License.
+#  (See accompanying file LICENSE or copy at
+#  http://opensource.org/licenses/MIT)
+# =======================================================================
+"""pytest for geometry.py"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from itertools import combinations
+import random
+
+from manager.src.geometry import SpatialIndex
+from manager.src.geometry import bounding_box
+from manager.src.geometry import box_distance
+from manager.src.geometry import boxes_overlap
+from manager.src.geometry import cull_shading
+from manager.src.geometry import overlapping_groups
+from manager.src.geometry import parse_wkt
+import pytest
+
+
+def test_parse_wkt():
+    square = [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0)]
+    assert parse_wkt('[(0, 0), (10, 0), (10, 10), (0, 10)]') == square
+    assert parse_wkt('[[0, 0], [10, 0], [10, 10], [0, 10]]') == square
+    assert parse_wkt(
+        'POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0), (2 2, 3 2, 3 3, 2 2))'
+        ) == square
+    assert parse_wkt(
+        '[Vector3D(0, 0, 0), Vector3D(1e1, 0, 0), Vector3D(10, 10.0, 0)]'
+        ) == [(0.0, 0.0, 0.0), (10.0, 0.0, 0.0), (10.0, 10.0, 0.0)]
+    assert parse_wkt('[(-1.5, .5), (2, 0), (2, 3)]')[0] == (-1.5, 0.5)
+    for text in ['__import__("os").getcwd()', '[(0, 0), (1, 1)]',
+                 '[(0, 0), (1, x), (1, 2)]', '[(0, 0, 0, 0), (1, 1), (1, 2)]',
+                 'POLYGON ((0 0, 1 1, 0 0))', '']:
+        with pytest.raises(ValueError):
+            parse_wkt(text)
+
+
+def test_bounding_box():
+    assert bounding_box([(1, 5), (3, -2), (0, 4)]) == (0, -2, 3, 5)
+    assert boxes_overlap((0, 0, 1, 1), (1, 0, 2, 1))  # touching
+    assert not boxes_overlap((0, 0, 1, 1), (1.1, 0, 2, 1))
+    assert boxes_overlap((0, 0, 1, 1), (1.1, 0, 2, 1), tolerance=0.2)
+    assert box_distance((0, 0, 1, 1), (0.5, 0.5, 2, 2)) == 0
+    assert box_distance((0, 0, 1, 1), (4, 5, 6, 6)) == 5
+
+
+def test_spatial_index():
+    rng = random.Random(0)
+    boxes = []
+    for _i in range(200):
+        x, y = rng.uniform(-100, 100), rng.uniform(-100, 100)
+        boxes.append((x, y, x + rng.uniform(0, 15), y + rng.uniform(0, 15)))
+    index = SpatialIndex(10)
+    for i, box in enumerate(boxes):
+        assert index.insert(box) == i
+    assert len(index) == len(boxes)
+    for tolerance in [0, 5]:
+        expected = [(i, j) for (i, box), (j, other)
+                    in combinations(enumerate(boxes), 2)
+                    if boxes_overlap(box, other, tolerance)]
+        assert index.pairs(tolerance) == expected
+    assert index.query((1000, 1000, 1001, 1001)) == []
+    with pytest.raises(ValueError):
+        SpatialIndex(0)
+
+
+def test_overlapping_groups():
+    boxes = [(0, 0, 10, 8), (30, 0, 40, 8), (10, 0, 20, 8),
+             (20.005, 0, 30, 8), (100, 100, 110, 110), (-5, -5, -1, -1)]
+    assert overlapping_groups(boxes) == [[0, 1, 2, 3], [4], [5]]
+    assert overlapping_groups(boxes, tolerance=5) == [[0, 1, 2, 3, 5], [4]]
+    assert overlapping_groups([]) == []
+
+
+def test_cull_shading():
+    buildings = [(0, 0, 10, 0), (10, 0, 10, 8), (0, 0, 10, 8)]
+    shading = [((0, 12, 10, 12), 9),  # across the road
+               ((40, 0, 40, 8), 9),  # 30 m away
+               ((0, 60, 10, 60), 30),  # 52 m away, but tall
+               ((0, 60, 10, 60), 1),  # 52 m away and low
+               ((10, 0, 10, 8), 3)]  # against a wall
+    assert cull_shading(buildings, shading, 100) == []
+    assert cull_shading(buildings, shading, 20) == [1, 2, 3]
+    assert cull_shading(buildings, shading, 0) == [0, 1, 2, 3]
+    assert cull_shading(buildings, shading, 100, horizon_angle=20) == [1, 3]
+    assert cull_shading([], shading, 100) == [0, 1, 2, 3, 4]
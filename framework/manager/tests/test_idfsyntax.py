@@ -0,0 +1,301 @@
+# Copyright (c) 2017 Jamie Bull
+# =======================================================================
+#  Distributed under the MIT License.
+#  (See accompanying file LICENSE or copy at
+#  http://opensource.org/licenses/MIT)
+# =======================================================================
+"""pytest for idfsyntax.py"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import datetime
+import json
+import os
+import shutil
+
+import numpy as np
+
+from manager.src import idfsyntax
+from manager.src import schedules
+from manager.src.caching import DiskCache
+from manager.src.config import config
+from manager.src import epw
+from manager.src.epw import WEEKDAY_NAMES
+from manager.src.models import GeometryCache
+from manager.src.models import models
+from manager.src.pipeline import StagedBuilder
+from manager.src.schedules import DEFAULT_YEAR
+from manager.src.schedules import activities_proportions
+from manager.src.schedules import make_schedules
+from manager.src.sites import SiteStore
+import pytest
+
+
+BLOCK = {'name': 'Main', 'height': '6', 'num_storeys': '2',
+         'wkt': '[(0, 0), (20, 0), (20, 10), (0, 10)]'}
+SHADING_BLOCKS = [{'name': 'Near', 'height': '9',
+                   'wkt': '[(0, 15), (20, 15), (20, 20), (0, 20)]'},
+                  {'name': 'Far', 'height': '9',
+                   'wkt': '[(0, 200), (20, 200), (20, 205), (0, 205)]'}]
+JOB = {'geometry': 'School', 'weather_file': 0.2, 'equip_wpm2': 6,
+       'occupancy': 0.1, 'schedules': 0.1, 'light_wpm2': 10,
+       'boiler_efficiency': 0.8, 'detailed_hvac': 0.2, 'infiltration': 0.5,
+       'ventilation': 10, 'window2wall': 0.4, 'window_u_value': 2.5,
+       'window_shgc': 0.5, 'exterior_surface_convection': 1,
+       'interior_surface_convection': 1, 'timesteps_per_hour': 1,
+       'daylighting': 0.2, 'wall_u_value': 0.5, 'floor_u_value': 0.5,
+       'roof_u_value': 0.5, 'density': 700, 'shading_blocks_distance': 50}
+
+
+class Zone(object):
+    def __init__(self, name):
+        self.Name = name
+
+
+@pytest.fixture
+def site(tmpdir, monkeypatch):
+    """A school with one block, and caches in a temporary directory."""
+    path = tmpdir.join('schools.json')
+    path.write(json.dumps({'School': {'blocks': [BLOCK],
+                                      'shading_blocks': SHADING_BLOCKS}}))
+    monkeypatch.setattr(idfsyntax, 'sites', SiteStore(
+        str(path), str(tmpdir.join('sites.sqlite'))))
+    monkeypatch.setattr(idfsyntax, 'geometry_cache', GeometryCache(
+        str(tmpdir.join('geometry'))))
+    monkeypatch.setattr(idfsyntax, 'schedule_cache', DiskCache(
+        str(tmpdir.join('schedules'))))
+    monkeypatch.setattr(idfsyntax, 'job_builder', StagedBuilder(
+        idfsyntax.STAGES, files=DiskCache(str(tmpdir.join('stages')))))
+    return tmpdir
+
+
+def test_prepare_idf_job_keys(site):
+    job = dict(JOB, unique_id='job1')
+    build_dir = idfsyntax.prepare_idf(job, build_dir=str(site.mkdir('job1')))
+    # only the unique_id and geometry are popped, and nothing is added
+    assert sorted(job) == sorted(set(JOB) - {'geometry'})
+    report = idfsyntax.shading_report(build_dir)
+    assert report['shading_surfaces_removed'] == 4  # the far block
+    assert report['shading_surfaces'] == 8
+
+
+def test_schedules_key(tmpdir, monkeypatch):
+    library = str(tmpdir.join('schedules'))
+    shutil.copytree(schedules.SCHEDULES_DIR, library)
+    monkeypatch.setattr(schedules, 'SCHEDULES_DIR', library)
+    cache = DiskCache(str(tmpdir.join('cache')))
+    csv = tmpdir.join('schedules.csv')
+    csv.write('Heat\n1\n')
+    key = idfsyntax.schedules_key(1000, ['Zone1'], 1.1, ['Heat'])
+    cache.put(key, {'schedules.csv': str(csv)})
+    assert idfsyntax.schedules_key(1000, ['Zone1'], 1.1, ['Heat']) == key
+    assert cache.get(key) is not None
+
+    path = os.path.join(library, 'Teaching_Heat.imf')
+    with open(path, 'ab') as f:
+        f.write(b'\n')
+    os.utime(path, (0, 0))  # make sure the change is seen
+    edited = idfsyntax.schedules_key(1000, ['Zone1'], 1.1, ['Heat'])
+    assert edited != key
+    assert cache.get(edited) is None
+
+
+def annual_idf(start_day='Monday', begin_month=1):
+    idf = models.new()
+    idf.newidfobject('RUNPERIOD', Name='Annual', Begin_Month=begin_month,
+                     Begin_Day_of_Month=1, End_Month=12, End_Day_of_Month=31,
+                     Day_of_Week_for_Start_Day=start_day)
+    return idf
+
+
+def zone_schedules():
+    """Stretched NCM schedules for two zones."""
+    zones = [Zone('Zone1'), Zone('Zone2')]
+    schedules = make_schedules(zones, ['Heat', 'Occ', 'Light'],
+                               activities_proportions(1000))
+    return {zone: {st: schedule.stretch(1.1, 12)
+                   for st, schedule in schedules[zone].items()}
+            for zone in schedules}
+
+
+def compact_hourly(idf, name, first_weekday):
+    """Hourly values of a Schedule:Year made of week and day schedules."""
+    fields = idf.getobject('SCHEDULE:YEAR', name).obj[3:]
+    values = []
+    for i in range(0, len(fields), 5):
+        week_name, start_month, start_day, end_month, end_day = fields[i:i + 5]
+        week = idf.getobject('SCHEDULE:WEEK:DAILY', week_name)
+        day = datetime.date(DEFAULT_YEAR, int(start_month), int(start_day))
+        end = datetime.date(DEFAULT_YEAR, int(end_month), int(end_day))
+        while day <= end:
+            weekday = (first_weekday + day.timetuple().tm_yday - 1) % 7
+            day_name = week['%s_ScheduleDay_Name' % WEEKDAY_NAMES[weekday]]
+            profile = idf.getobject('SCHEDULE:DAY:HOURLY', day_name)
+            values.extend(float(profile['Hour_%i' % hour])
+                          for hour in range(1, 25))
+            day += datetime.timedelta(days=1)
+    return np.array(values)
+
+
+def file_hourly(idf, name, build_dir):
+    """Hourly values of a Schedule:File column in the schedules CSV."""
+    schedule = idf.getobject('SCHEDULE:FILE', name)
+    columns = np.loadtxt(os.path.join(build_dir, schedule.File_Name),
+                         delimiter=',', skiprows=1, ndmin=2)
+    return columns[:, int(schedule.Column_Number) - 1]
+
+
+def test_compact_schedules(tmpdir):
+    schedules = zone_schedules()
+    file_idf = annual_idf()
+    idfsyntax.write_schedules(file_idf, schedules, 'school', mode='file',
+                              build_dir=str(tmpdir))
+    compact_idf = annual_idf()
+    compact_dir = tmpdir.mkdir('compact')
+    idfsyntax.write_schedules(compact_idf, schedules, 'school',
+                              mode='compact', build_dir=str(compact_dir))
+    assert not compact_idf.idfobjects['SCHEDULE:FILE']
+    assert not compact_dir.listdir()  # every schedule is compact
+    first_weekday = idfsyntax.run_period_first_weekday(compact_idf)
+    for zone in schedules:
+        for st in schedules[zone]:
+            name = '%s_%s' % (zone, st)
+            expected = file_hourly(file_idf, name, str(tmpdir))
+            compact = compact_hourly(compact_idf, name, first_weekday)
+            assert np.allclose(compact, expected, rtol=1e-5)
+            assert np.allclose(compact, schedules[zone][st].hourly)
+    # zones with the same schedules share the week and day schedules
+    assert len(compact_idf.idfobjects['SCHEDULE:YEAR']) == 6
+    assert len(set(week.Name for week in
+                   compact_idf.idfobjects['SCHEDULE:WEEK:DAILY'])) == len(
+                       compact_idf.idfobjects['SCHEDULE:WEEK:DAILY'])
+
+
+def test_schedule_mode(tmpdir, monkeypatch):
+    schedules = zone_schedules()
+    monkeypatch.setattr(idfsyntax, 'SCHEDULE_MODE', 'compact')
+    idf = annual_idf()
+    idfsyntax.write_schedules(idf, schedules, 'school',
+                              build_dir=str(tmpdir))
+    assert idf.idfobjects['SCHEDULE:YEAR']
+    assert not idf.idfobjects['SCHEDULE:FILE']
+
+    config.add_section('Schedules')
+    try:
+        config.set('Schedules', 'mode', 'file')
+        assert idfsyntax.schedule_mode() == 'file'
+        idf = annual_idf()
+        idfsyntax.write_schedules(idf, schedules, 'school',
+                                  build_dir=str(tmpdir))
+        assert not idf.idfobjects['SCHEDULE:YEAR']
+        assert idf.idfobjects['SCHEDULE:FILE']
+    finally:
+        config.remove_section('Schedules')
+    with pytest.raises(ValueError):
+        idfsyntax.write_schedules(annual_idf(), schedules, 'school',
+                                  mode='nonesuch')
+
+
+def test_run_period_first_weekday():
+    # 1 March 2015 as a Monday puts 1 January on a Friday
+    assert idfsyntax.run_period_first_weekday(
+        annual_idf('Monday', begin_month=3)) == 4
+    assert idfsyntax.run_period_first_weekday(annual_idf('Thursday')) == 3
+    idf = annual_idf('UseWeatherFile')
+    idf.epw = epw.__file__  # not a weather file
+    assert idfsyntax.run_period_first_weekday(idf) is None
+    idf = annual_idf()
+    idf.newidfobject('RUNPERIOD', Name='Another')
+    assert idfsyntax.run_period_first_weekday(idf) is None
+
+    # the compact schedules follow the weekdays of the run period
+    hourly = np.tile(np.repeat(np.arange(7.0), 24), 53)[:8760]
+    for start_day in ['Monday', 'Thursday']:
+        idf = annual_idf(start_day)
+        first_weekday = idfsyntax.run_period_first_weekday(idf)
+        weeks = idfsyntax.write_compact_weeks(idf, 'Days', hourly,
+                                              first_weekday)
+        idfsyntax.write_schedule_year(idf, 'Days', weeks)
+        assert np.array_equal(compact_hourly(idf, 'Days', first_weekday),
+                              hourly)
+
+
+def legacy_columns(all_zone_schedules):
+    """The columns as write_schedules_file used to write them, one for each
+    zone and schedule type.
+    """
+    return OrderedDict(('%s_%s' % (zone, st), all_zone_schedules[zone][st])
+                       for zone in all_zone_schedules
+                       for st in all_zone_schedules[zone])
+
+
+def test_schedule_columns():
+    hours = np.arange(8760.0)
+    heat = np.where(hours % 24 < 12, 21.0, 16.0)
+    occ = (hours % 24 > 8) * 1.0
+    all_zone_schedules = OrderedDict([
+        ('Zone1', OrderedDict([('Heat', heat), ('Occ', occ)])),
+        ('Zone2', OrderedDict([('Heat', heat.copy()), ('Occ', occ * 0.5)])),
+        ('Zone3', OrderedDict([('Heat', heat + 1), ('Occ', occ.tolist()),
+                               ('Light', occ.copy())])),
+        ])
+    columns, column_numbers = idfsyntax.schedule_columns(all_zone_schedules)
+    headers = list(columns)
+    assert headers == ['Heat', 'Occ', 'Occ_2', 'Heat_2']
+    legacy = legacy_columns(all_zone_schedules)
+    for zone in all_zone_schedules:
+        assert sorted(column_numbers[zone]) == sorted(all_zone_schedules[zone])
+        for st in all_zone_schedules[zone]:
+            column = columns[headers[column_numbers[zone][st] - 1]]
+            assert np.array_equal(column, legacy['%s_%s' % (zone, st)])
+    # equal schedules share a column, whatever their zone or type
+    assert column_numbers['Zone2']['Heat'] == column_numbers['Zone1']['Heat']
+    assert column_numbers['Zone3']['Light'] == column_numbers['Zone1']['Occ']
+    assert len(columns) < len(legacy)
+
+
+def test_compact_schedules_planned(site, monkeypatch):
+    monkeypatch.setattr(idfsyntax, 'SCHEDULE_MODE', 'compact')
+    # a fixed schedules value puts the schedules stage early in the plan
+    jobs = [dict(JOB, unique_id='job%i' % i, weather_file=weather_file,
+                 equip_wpm2=equip_wpm2)
+            for i, (weather_file, equip_wpm2) in enumerate(
+                [(0.2, 6), (0.8, 6), (0.2, 8), (0.8, 8)])]
+    jobs = idfsyntax.plan_jobs(jobs)
+    names = [stage.name for stage in idfsyntax.job_builder.stages]
+    assert names.index('schedules') > names.index('weather')
+    assert names.index('schedules') > names.index('required_objects')
+    for i, job in enumerate(jobs):
+        next_job = jobs[i + 1] if i + 1 < len(jobs) else None
+        build_dir = site.mkdir(job['unique_id'])
+        idfsyntax.prepare_idf(job, build_dir=str(build_dir),
+                              next_job=next_job)
+        idf = models.base(str(build_dir.join('in.idf')))
+        assert idf.idfobjects['SCHEDULE:YEAR']
+        assert not idf.idfobjects['SCHEDULE:FILE']
+        assert not build_dir.join('school_schedules.csv').exists()
+
+
+def test_auto_schedules_planned(site, monkeypatch, caplog):
+    monkeypatch.setattr(idfsyntax, 'SCHEDULE_MODE', 'auto')
+    jobs = idfsyntax.plan_jobs([dict(JOB, unique_id='job0')])
+    build_dir = site.mkdir('job0')
+    idfsyntax.prepare_idf(jobs[0], build_dir=str(build_dir))
+    idf = models.base(str(build_dir.join('in.idf')))
+    assert idf.idfobjects['SCHEDULE:YEAR']
+    assert 'not known' not in caplog.text
+
+    # without a run period the weekdays are not known
+    idf = models.new()
+    idfsyntax.write_schedules(idf, zone_schedules(), 'school',
+                              build_dir=str(site))
+    assert not idf.idfobjects['SCHEDULE:YEAR']
+    assert idf.idfobjects['SCHEDULE:FILE']
+    assert 'weekdays of the run period are not known' in caplog.text
+    with pytest.raises(ValueError):
+        idfsyntax.write_schedules(models.new(), zone_schedules(), 'school',
+                                  mode='compact', build_dir=str(site))
@@ -0,0 +1,118 @@
+# Copyright (c) 2017 Jamie Bull
+# =======================================================================
+#  Distributed under the MIT License.
+#  (See accompanying file LICENSE or copy at
+#  http://opensource.org/licenses/MIT)
+# =======================================================================
+"""pytest for models.py"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+
+from manager.src.models import GeometryCache
+from manager.src.models import ModelFactory
+from manager.src.models import clone
+from manager.src.models import models
+import pytest
+
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+TEMPLATE = os.path.join(THIS_DIR, os.pardir, 'data/template.idf')
+DDY = os.path.join(
+    THIS_DIR, os.pardir, 'data/weather/islington/cntr_Islington_TRY.ddy')
+
+
+def test_clone():
+    factory = ModelFactory()
+    base = factory.base(TEMPLATE)
+    base.epw = 'weather.epw'
+    idf = clone(base)
+    assert idf.idfstr() == base.idfstr()
+    assert idf.epw == 'weather.epw'
+
+    idf.newidfobject('ZONE', Name='New zone')
+    building = idf.idfobjects['BUILDING'][0]
+    building.Name = 'Edited'
+    assert base.idfobjects['BUILDING'][0].Name != 'Edited'
+    assert idf.model.dt['BUILDING'][0][1] == 'Edited'
+    assert len(idf.idfobjects['ZONE']) == len(base.idfobjects['ZONE']) + 1
+    assert building.theidf is idf
+
+
+def test_model_factory(tmpdir):
+    factory = ModelFactory()
+    path = str(tmpdir.join('base.idf'))
+    factory.base(TEMPLATE).saveas(path)
+    assert factory.base(path) is factory.base(path)
+    assert factory.load(path) is not factory.base(path)
+    assert factory.models.misses == 2
+
+    edited = factory.load(path)
+    edited.newidfobject('ZONE', Name='New zone')
+    edited.saveas(path)
+    os.utime(path, (0, 0))  # make sure the change is seen
+    assert len(factory.base(path).idfobjects['ZONE']) == 1 + len(
+        factory.base(TEMPLATE).idfobjects['ZONE'])
+
+    design_days = factory.base(DDY).idfobjects['SIZINGPERIOD:DESIGNDAY']
+    assert len(design_days) > 0
+
+    with pytest.raises(IOError):
+        factory.base(str(tmpdir.join('missing.idf')))
+
+
+def test_geometry_cache(tmpdir):
+    built = []
+
+    def build():
+        built.append(True)
+        return models.load(TEMPLATE)
+
+    cache = GeometryCache(str(tmpdir))
+    idf = cache.get('key', build)
+    assert idf.idfstr() == models.base(TEMPLATE).idfstr()
+    idf.newidfobject('ZONE', Name='New zone')
+    assert cache.get('key', build).idfstr() == models.base(TEMPLATE).idfstr()
+    assert len(built) == 1
+
+    cache = GeometryCache(str(tmpdir))  # a new process
+    loaded = cache.get('key', build)
+    assert loaded.idfstr() == models.base(TEMPLATE).idfstr()
+    loaded.newidfobject('ZONE', Name='New zone')
+    assert len(loaded.model.dt['ZONE']) == len(loaded.idfobjects['ZONE'])
+    assert len(built) == 1
+    assert not cache.prebuild('key', build)
+    stats = cache.stats()
+    assert (stats['hits'], stats['disk_hits'], stats['misses']) == (0, 1, 0)
+    assert stats['load_time'] > 0
+
+    with open(cache.path('corrupt'), 'wb') as f:
+        f.write(b'not a pickle')
+    assert cache.get('corrupt', build)
+    assert len(built) == 2
+
+
+def test_design_days():
+    factory = ModelFactory()
+    selected = factory.design_days(DDY, ['Htg 99%', 'Clg 1%'])
+    assert [obj.Name for obj in selected] == [
+        'London Weather Cent Ann Htg 99% Condns DB',
+        'London Weather Cent Ann Clg 1% Condns DB=>MWB']
+    assert factory.design_days(DDY, ['Htg 99%', 'Clg 1%']) is selected
+    assert factory.models.misses == 1
+
+    selected = factory.design_days(DDY, ['Htg 99.6%', 'Clg .4%'])
+    assert 'Clg .4%' in selected[1].Name
+    assert factory.models.misses == 1  # not parsed again
+
+    idf = factory.new()
+    for design_day in selected:
+        idf.copyidfobject(design_day)
+    assert len(idf.idfobjects['SIZINGPERIOD:DESIGNDAY']) == 2
+
+    with pytest.raises(ValueError):
+        factory.design_days(DDY, ['Htg 50%'])
@@ -0,0 +1,119 @@
+# Copyright (c) 2017 Jamie Bull
+# =======================================================================
+#  Distributed under the MIT License.
+#  (See accompanying file LICENSE or copy at
+#  http://opensource.org/licenses/MIT)
+# =======================================================================
+"""pytest for ncm.py"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from manager.src.ncm import NCMIndex
+from manager.src.ncm import engines
+from manager.src.ncm import get_engine
+from manager.src.ncm import ncm_indexes
+from manager.src.schedules import ScheduleBuilder
+
+
+def ncm_tables():
+    days = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY',
+            'SATURDAY', 'SUNDAY', 'HOLIDAY']
+    weekly = pd.DataFrame(
+        {'ID': [10, 11],
+         'NAME': ['D1_Edu_ClassRm_Occ_WK1', 'D1_Edu_ClassRm_Occ_Wk2']})
+    for day in days:
+        weekly[day] = [100 if day in ('SATURDAY', 'SUNDAY') else 101, 100]
+    daily = pd.DataFrame(
+        {'ID': [100, 101],
+         'NAME': ['D1_Edu_ClassRm_Occ_Hol', 'D1_Edu_ClassRm_Occ_Wkdy']})
+    for h in range(1, 25):
+        daily['h%02i' % h] = [0.0, 1.0 if 9 <= h <= 17 else 0.0]
+    return {
+        'annual_schedules': pd.DataFrame(
+            {'ID': [1, 2], 'NAME': ['D1_Edu_ClassRm_Occ', 'D1_Edu_ClassRm_Heat']}),
+        'annual_weekly_schedules': pd.DataFrame(
+            {'ID': [1, 2, 3, 4],
+             'ANNUAL_SCHEDULE': [1, 2, 1, 1],
+             'WEEKLY_SCHEDULE': [10, 10, 11, 10],
+             'END_MONTH': ['Mar', 'Dec', 'Aug', 'Dec'],
+             'END_DAY': [31, 31, 31, 31]}),
+        'weekly_schedules': weekly,
+        'daily_schedules': daily,
+        'activity': pd.DataFrame(
+            {'ID': [1], 'NAME': ['D1_Edu_ClassRm'], 'METABOLIC_RATE': [140.0]}),
+        }
+
+
+def test_row_by_id_and_name():
+    ncm = NCMIndex(ncm_tables())
+    assert ncm.row('annual_schedules', name='D1_Edu_ClassRm_Heat')['ID'] == 2
+    assert ncm.row('weekly_schedules', 11)['NAME'] == 'D1_Edu_ClassRm_Occ_Wk2'
+    # IDs match however they are formatted
+    assert ncm.row('daily_schedules', '101')['h09'] == 1.0
+    assert ncm.row('daily_schedules', 101.0)['h08'] == 0.0
+    with pytest.raises(KeyError):
+        ncm.row('activity', name='nonesuch')
+
+
+def test_annual_weekly_schedule():
+    ncm = NCMIndex(ncm_tables())
+    aws = ncm.annual_weekly_schedule(1)
+    assert list(aws['ID']) == [1, 3, 4]
+    assert list(aws.index) == [0, 1, 2]
+    assert ncm.annual_weekly_schedule(99).empty
+
+
+def test_get_engine_is_shared():
+    conn_string = 'sqlite://'
+    engine = get_engine(conn_string)
+    assert get_engine(conn_string) is engine
+    assert engines[conn_string] is engine
+
+
+def test_snapshot_round_trip(tmpdir):
+    path = str(tmpdir.join('ncm.sqlite'))
+    NCMIndex(ncm_tables()).to_snapshot(path)
+    ncm = NCMIndex.from_snapshot(path)
+    assert ncm.row('daily_schedules', row_id=101)['NAME'] == 'D1_Edu_ClassRm_Occ_Wkdy'
+    assert ncm.row('weekly_schedules', name='D1_Edu_ClassRm_Occ_WK1')['ID'] == 10
+    con = sqlite3.connect(path)
+    indexes = [r[0] for r in con.execute(
+        "SELECT name FROM sqlite_master WHERE type='index'")]
+    con.close()
+    assert 'ix_daily_schedules_ID' in indexes
+    assert 'ix_daily_schedules_NAME' in indexes
+
+
+def test_schedule_builder_ncm(tmpdir, monkeypatch):
+    path = str(tmpdir.join('ncm.sqlite'))
+    builder = ScheduleBuilder()
+    builder.snapshot = path
+    assert builder.ncm_source() == builder.conn_string  # not written yet
+    NCMIndex(ncm_tables()).to_snapshot(path)
+    builder.reload()
+    ncm = builder.ncm
+    assert ncm_indexes[os.path.abspath(path)] is ncm
+    # the source is not looked up again, even by another builder
+    monkeypatch.setattr(os.path, 'isfile', lambda path: 1 / 0)
+    other = ScheduleBuilder()
+    other.snapshot = path
+    assert builder.ncm is ncm
+    assert other.ncm is ncm
+    monkeypatch.undo()
+
+    tables = ncm_tables()
+    tables['activity']['METABOLIC_RATE'] = [150.0]
+    NCMIndex(tables).to_snapshot(path)
+    assert builder.ncm is ncm
+    builder.reload()
+    assert builder.ncm.row('activity', 1)['METABOLIC_RATE'] == 150.0
+    builder.reload()
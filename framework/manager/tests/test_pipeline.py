@@ -0,0 +1,122 @@
+# Copyright (c) 2017 Jamie Bull
+# =======================================================================
+#  Distributed under the MIT License.
+#  (See accompanying file LICENSE or copy at
+#  http://opensource.org/licenses/MIT)
+# =======================================================================
+"""pytest for pipeline.py"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import random
+
+from manager.src.caching import DiskCache
+from manager.src.models import models
+from manager.src.pipeline import Stage
+from manager.src.pipeline import StagedBuilder
+from manager.src.pipeline import order_stages
+from manager.src.pipeline import shared_depth
+import pytest
+
+
+def set_building(idf, job):
+    idf.newidfobject('BUILDING', Name=job['name'])
+
+
+def set_timestep(idf, job):
+    idf.newidfobject('TIMESTEP', Number_of_Timesteps_per_Hour=job['steps'])
+
+
+def write_notes(idf, job, build_dir):
+    with io.open(os.path.join(build_dir, 'notes.txt'), 'w') as f:
+        f.write(job['name'])
+
+
+def stages():
+    return [
+        Stage('timestep', set_timestep, ['steps'], requires=['building']),
+        Stage('building', set_building, ['name']),
+        Stage('notes', write_notes, ['name'], args=['job', 'build_dir'],
+              outputs=['notes.txt']),
+        ]
+
+
+def test_order_stages():
+    ordered = order_stages(stages())
+    assert [stage.name for stage in ordered] == [
+        'building', 'timestep', 'notes']
+    ordered = order_stages(stages(), lambda name: name != 'notes')
+    assert [stage.name for stage in ordered] == [
+        'notes', 'building', 'timestep']
+    with pytest.raises(ValueError):
+        order_stages([Stage('a', None, requires=['b']),
+                      Stage('b', None, requires=['a'])])
+
+
+def test_staged_builder(tmpdir):
+    builder = StagedBuilder(stages(), DiskCache(str(tmpdir.join('files'))))
+    jobs = [{'name': 'A', 'steps': 4}, {'name': 'B', 'steps': 8},
+            {'name': 'A', 'steps': 6}]
+    jobs = builder.plan(jobs)
+    assert [stage.name for stage in builder.stages] == [
+        'building', 'notes', 'timestep']
+    assert [job['name'] for job in jobs] == ['A', 'A', 'B'] or [
+        job['name'] for job in jobs] == ['B', 'A', 'A']
+
+    built = []
+    for i, job in enumerate(jobs):
+        build_dir = tmpdir.mkdir(str(i))
+        context = {'job': job, 'build_dir': str(build_dir)}
+        next_job = jobs[i + 1] if i + 1 < len(jobs) else None
+        idf = builder.build(models.new(), context, next_job)
+        assert build_dir.join('notes.txt').read() == job['name']
+        built.append(idf.idfstr())
+    assert builder.stats()['reused'] == 2  # building and notes for A, 6
+
+    fresh = StagedBuilder(stages())
+    for job, idfstr in zip(jobs, built):
+        build_dir = str(tmpdir.mkdir('fresh{name}{steps}'.format(**job)))
+        idf = fresh.build(models.new(), {'job': job, 'build_dir': build_dir})
+        assert idf.idfstr() == idfstr
+    assert fresh.stats()['reused'] == 0
+
+
+def saltelli(n, names, rng):
+    """Jobs as in a Saltelli sample of continuous parameters: two base
+    matrices A and B, and for each parameter A with that column from B.
+    """
+    a = [{name: rng.uniform(0, 1) for name in names} for _i in range(n)]
+    b = [{name: rng.uniform(0, 1) for name in names} for _i in range(n)]
+    jobs = a + b
+    for name in names:
+        jobs += [dict(row_a, **{name: row_b[name]})
+                 for row_a, row_b in zip(a, b)]
+    return jobs
+
+
+def test_plan_saltelli():
+    rng = random.Random(0)
+    names = ['p%i' % i for i in range(4)]
+    builder = StagedBuilder([Stage(name, None, [name]) for name in names])
+    jobs = saltelli(20, names, rng)
+    rng.shuffle(jobs)
+    planned = builder.plan(jobs)
+    assert sorted(map(repr, planned)) == sorted(map(repr, jobs))
+    keys = [builder.keys(job) for job in planned]
+    # jobs sharing the state after a stage are built one after another
+    for depth in range(1, len(names) + 1):
+        runs = [k[:depth] for i, k in enumerate(keys)
+                if i == 0 or k[:depth] != keys[i - 1][:depth]]
+        assert len(runs) == len(set(map(tuple, runs)))
+    shared = sum(shared_depth(k, other) for k, other in zip(keys, keys[1:]))
+    # with A, AB_p3, AB_p2 and AB_p1 in turn, each shares one stage fewer
+    # with the one before (3 + 2 + 1), and AB_p0 shares p0 with B
+    assert shared == 20 * (3 + 2 + 1 + 1)
+    unplanned = [builder.keys(job) for job in jobs]
+    assert shared > sum(shared_depth(k, other)
+                        for k, other in zip(unplanned, unplanned[1:]))
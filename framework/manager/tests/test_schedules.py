@@ -11,13 +11,37 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+import json
+import os
+import pickle
+
 from geomeppy.utilities import almostequal
+from manager.benchmarks import legacy
+from manager.benchmarks.bench_schedules import load_imf_schedules
+from manager.src.caching import link_or_copy
+from manager.src.schedules import SATURDAY_AS_WORKDAY
+from manager.src.schedules import SUNDAY_AS_WORKDAY
 from manager.src.schedules import Schedule
+from manager.src.schedules import ScheduleLibrary
+from manager.src.schedules import ScheduleBatch
+from manager.src.schedules import ScheduleSet
 from manager.src.schedules import activities_proportions
+from manager.src.schedules import activity_map
 from manager.src.schedules import all_zone_rates
 from manager.src.schedules import all_zone_schedules
 from manager.src.schedules import area_weight_schedules
+from manager.src.schedules import close_final_weeks
 from manager.src.schedules import make_schedules
+from manager.src.schedules import set_closed_weeks
+from manager.src.schedules import set_saturday_as_workday
+from manager.src.schedules import set_sunday_as_workday
+from manager.src.schedules import stretch
+from manager.src.schedules import stretch_days
+from manager.src.schedules import weight_rates
+from manager.src.schedules import weight_schedules
+from manager.src.schedules import write_schedule_csv
+import numpy as np
 import pandas as pd
 
 
@@ -103,3 +127,228 @@ def test_combine_schedule():
     sch1 = Schedule(sch1_str)
     sch2 = Schedule(sch2_str)
     sch3 = area_weight_schedules([sch1, sch2], [100, 100])
+
+
+def test_hourly_schedule_matches_day_by_day_walk():
+    for sch_str in [sch1_str, sch2_str]:
+        sch = Schedule(sch_str)
+        assert sch.hourly_schedule == legacy.hourly_schedule(sch)
+
+
+def test_hourly_schedule_imf_files():
+    for name, sch in load_imf_schedules().items():
+        expected = legacy.hourly_schedule(sch)
+        assert sch.hourly_schedule == expected, name
+        assert sch.hourly_array.dtype == np.float64
+
+
+def test_hourly_schedule_undefined_days():
+    sch = Schedule(sch2_str.replace('12,23, 12,31', '12,23, 12,30'))
+    result = sch.hourly_schedule
+    assert result == legacy.hourly_schedule(sch)
+    assert result[-24:] == ['n/a'] * 24
+    assert np.isnan(sch.hourly_array[-24:]).all()
+
+
+def test_schedule_library_compiled(tmpdir):
+    library = ScheduleLibrary(compiled=None)
+    compiled = str(tmpdir.join('schedules.npy'))
+    library.save(compiled)
+    mapped = ScheduleLibrary(compiled=compiled)
+    assert mapped.rows
+    for activity in ['Office', 'Teaching', 'Circulation']:
+        for st in ['Heat', 'Occ']:
+            expected = library.schedule(activity, st).hourly_array
+            assert np.array_equal(mapped.hourly(activity, st), expected)
+        assert mapped.rate(activity, 'Metab') == library.rate(activity, 'Metab')
+
+
+def test_weight_schedules_batched():
+    sch1 = Schedule(sch1_str).hourly_array
+    sch2 = Schedule(sch2_str).hourly_array
+    areas = [100, 300]
+    expected = (sch1 * 100 + sch2 * 300) / 400
+    single = weight_schedules(np.array([sch1, sch2]), areas)
+    assert np.allclose(single, expected)
+    # many schedule types and activity mixes in one call
+    matrix = np.array([[sch1, sch2], [sch2, sch1]])
+    batched = weight_schedules(matrix, [areas, [1, 1]])
+    assert batched.shape == (2, 2, 8760)
+    assert np.allclose(batched[0, 0], expected)
+    assert np.allclose(batched[1, 1], (sch1 + sch2) / 2)
+
+
+def test_weight_rates():
+    assert weight_rates([100, 200], [1, 3]) == 175
+    assert np.allclose(weight_rates([[100, 200], [1, 2]], [1, 1]), [150, 1.5])
+
+
+def test_stretch_matches_repeat_and_average():
+    hourly = Schedule(sch2_str).hourly_schedule
+    # coefficients where grain * coef is a whole number of samples
+    for coef in [0.8, 0.9, 1, 1.1, 1.2]:
+        result = stretch(hourly, coef, 12)
+        assert result == legacy.stretch(hourly, coef, 12)
+
+
+def test_stretch_fractional_coefficient():
+    hourly = Schedule(sch1_str).hourly_schedule
+    # 100 * 1.125 samples per hour would be truncated, 8 * 1.125 would not
+    result = stretch(hourly, 1.125, 12)
+    assert result == legacy.stretch(hourly, 1.125, 12, grain=8)
+    assert result != legacy.stretch(hourly, 1.125, 12)
+
+
+def test_stretch_days():
+    days = np.array([[1.0] * 24, [0.0] * 6 + [1.0] * 12 + [0.0] * 6])
+    assert np.array_equal(stretch_days(days, 1.5, 12)[0], days[0])
+    stretched = stretch_days(days, 0.5, 12)
+    assert stretched[1].tolist() == [0.0] * 9 + [1.0] * 6 + [0.0] * 9
+    stretched = stretch_days(days, 1.5, 12)
+    assert stretched[1].tolist() == [0.0] * 3 + [1.0] * 18 + [0.0] * 3
+
+
+def test_weekday_transforms():
+    hourly = np.arange(8760, dtype=np.float64)
+    # 2015-01-02 is a Friday, so Saturday and Sunday copy hours 24 to 48
+    saturday = set_saturday_as_workday(hourly)
+    assert saturday[48:72] == list(range(24, 48))
+    assert saturday[72:96] == list(range(72, 96))
+    sunday = set_sunday_as_workday(hourly)
+    assert sunday[48:72] == list(range(48, 72))
+    assert sunday[72:96] == list(range(24, 48))
+    closed = set_closed_weeks(list(hourly), 2)
+    assert closed[-336:] == [0] * 336
+    assert closed[:-336] == list(hourly[:-336])
+
+
+def test_transform_pipeline():
+    hourly = np.arange(8760, dtype=np.float64)
+    pipeline = (
+        SATURDAY_AS_WORKDAY + SUNDAY_AS_WORKDAY + close_final_weeks(1))
+    stacked = pipeline(np.array([hourly, hourly * 2]))
+    assert stacked.shape == (2, 8760)
+    expected = set_closed_weeks(
+        set_sunday_as_workday(set_saturday_as_workday(hourly)), 1)
+    assert stacked[0].tolist() == expected
+    assert np.array_equal(stacked[1], stacked[0] * 2)
+
+
+def test_activity_map(tmpdir):
+    path = tmpdir.join('mapToNCM.json')
+    path.write(json.dumps([
+        {'Teaching': {'given_code': 'Teaching',
+                      'schedule_code': 'D1_Edu-ClassRm',
+                      'rate_code': 'C2_Schools-Teaching'}}]))
+    activities = activity_map(str(path))
+    assert activity_map(str(path)) is activities
+    assert activities['Teaching']['schedule_code'] == 'D1_Edu-ClassRm'
+    assert activities.schedule_zones['Teaching'] == ('D1_Edu', 'ClassRm')
+    assert activities.rate_zones['Teaching'] == ('C2_Schools', 'Teaching')
+    assert activities.lookup(['Teaching', 'Teaching'])[1]['given_code'] == 'Teaching'
+
+    path.write(json.dumps([
+        {'Office': {'given_code': 'Office',
+                    'schedule_code': 'C2_Edu-Office',
+                    'rate_code': 'C2_Schools-Office'}}]))
+    stat = os.stat(str(path))
+    os.utime(str(path), (stat.st_atime, stat.st_mtime + 10))
+    activities = activity_map(str(path))
+    assert 'Office' in activities.codes
+    assert 'Teaching' not in activities.codes
+
+
+def test_schedule_set():
+    hourly = np.nan_to_num(Schedule(sch1_str).hourly_array)
+    schedule = ScheduleSet.from_hourly(hourly)
+    assert schedule.profiles.shape == (2, 24)
+    assert schedule.day_index.dtype == np.uint16
+    assert len(schedule) == 8760
+    assert np.array_equal(schedule.hourly, hourly)
+    assert list(schedule) == hourly.tolist()
+    stretched = schedule.stretch(1.3, 12)
+    assert stretched.profiles.shape == (2, 24)
+    assert stretched.tolist() == stretch(hourly.tolist(), 1.3, 12)
+
+
+def test_week_periods():
+    week = np.repeat([1., 0.5], [5 * 24, 2 * 24])
+    term = np.tile(week, 8)
+    holiday = np.zeros(365 * 24 - len(term))
+    schedule = ScheduleSet.from_hourly(np.concatenate([term, holiday]))
+    periods = schedule.week_periods(first_weekday=0)
+    assert periods == [(0, 55, (2, 2, 2, 2, 2, 1, 1)),
+                       (56, 364, (0, 0, 0, 0, 0, 0, 0))]
+    days = [profiles[day % 7]
+            for first, last, profiles in periods
+            for day in range(first, last + 1)]
+    assert np.array_equal(schedule.profiles[days].ravel(), schedule.hourly)
+
+
+def test_write_schedule_csv(tmpdir):
+    hourly = np.nan_to_num(Schedule(sch1_str).hourly_array)
+    columns = OrderedDict([('Cool', hourly), ('Occ', (hourly / 3).tolist())])
+    path = str(tmpdir.join('schedules.csv'))
+    cached = str(tmpdir.join('cached.csv'))
+    with open(cached, 'w') as f:
+        f.write('cached')
+    link_or_copy(cached, path)
+    write_schedule_csv(path, columns, chunk_rows=100)
+    with open(cached) as f:
+        assert f.read() == 'cached'  # a linked file is left alone
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'Cool,Occ'
+    assert len(lines) == 8761
+    values = np.array([line.split(',') for line in lines[1:]], dtype=float)
+    assert np.array_equal(values[:, 0], hourly)
+    assert np.allclose(values[:, 1], hourly / 3, rtol=1e-5)
+
+
+def test_stretch_days_batch():
+    days = np.random.RandomState(0).rand(3, 24)
+    coefs = np.array([0.8, 1.0, 1.15])
+    stretched = stretch_days(days, coefs, 12)
+    assert stretched.shape == (3, 3, 24)
+    for coef, expected in zip(coefs, stretched):
+        assert np.array_equal(stretch_days(days, coef, 12), expected)
+
+
+def test_schedule_batch(tmpdir):
+    class Zone(object):
+        def __init__(self, name):
+            self.Name = name
+    zones = [Zone('Zone1'), Zone('Zone2')]
+    schedule_types = ['Heat', 'Occ']
+    activities = activities_proportions(1000)
+    other = activities_proportions(10000)
+    coefs = [0.9, 1.1, 0.9]
+    path = str(tmpdir.join('batch.npy'))
+    tmpdir.join('batch.stale.npy').write('')
+    batch = ScheduleBatch(coefs, path=path, mixes=1)
+    assert not tmpdir.join('batch.stale.npy').exists()
+    schedules = batch.schedules(zones, schedule_types, activities, 1.1)
+    hourly = batch.stretch(schedule_types, activities)
+    assert hourly.shape == (2, 2, 8760)  # a row for each distinct coef
+    assert isinstance(hourly, np.memmap)
+    expected = make_schedules(zones, schedule_types, activities)
+    for st in schedule_types:
+        assert np.array_equal(schedules['Zone2'][st],
+                              expected['Zone2'][st].stretch(1.1, 12).hourly)
+    assert batch.rows == {0.9: 0, 1.1: 1}
+
+    # each activity mix has its own file, so alternating mixes reads them
+    other_hourly = np.array(batch.stretch(schedule_types, other))
+    assert len(tmpdir.listdir(lambda p: p.ext == '.npy')) == 2
+    assert np.array_equal(batch.stretch(schedule_types, activities), hourly)
+    assert np.array_equal(batch.stretch(schedule_types, other), other_hourly)
+    assert batch.mixes.misses == 4 and len(batch.mixes) == 1
+
+    worker = pickle.loads(pickle.dumps(batch))  # as sent to a worker process
+    assert len(worker.mixes) == 0
+    assert isinstance(worker.stretch(schedule_types, activities), np.memmap)
+    assert np.array_equal(worker.stretch(schedule_types, activities), hourly)
+
+    in_memory = ScheduleBatch(coefs)
+    assert np.array_equal(in_memory.stretch(schedule_types, other),
+                          other_hourly)
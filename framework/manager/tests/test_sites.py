@@ -0,0 +1,63 @@
+# Copyright (c) 2017 Jamie Bull
+# =======================================================================
+#  Distributed under the MIT License.
+#  (See accompanying file LICENSE or copy at
+#  http://opensource.org/licenses/MIT)
+# =======================================================================
+"""pytest for sites.py"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+
+from manager.src.sites import SiteStore
+import pytest
+
+
+SCHOOLS = {
+    'School B': {'blocks': [{'name': 'b1', 'height': '6'}],
+                 'shading_blocks': []},
+    'School A': {'blocks': [{'name': 'a1', 'height': '3'}],
+                 'shading_blocks': [{'name': 's1', 'height': '9'}]},
+    }
+
+
+def write_schools(path, schools):
+    with open(path, 'w') as f:
+        json.dump(schools, f)
+
+
+def test_site_store(tmpdir):
+    path = str(tmpdir.join('schools.json'))
+    index = str(tmpdir.join('cached', 'sites.sqlite'))
+    write_schools(path, SCHOOLS)
+    store = SiteStore(path, index)
+    school = store['School A']
+    assert school['name'] == 'School A'
+    assert school['shading_blocks'][0]['name'] == 's1'
+    assert store['School A'] is school
+    assert os.path.isfile(index)
+    assert 'School B' in store
+    assert 'School C' not in store
+    assert store.get('School C') is None
+    with pytest.raises(KeyError):
+        store['School C']
+    assert len(store) == 2
+    assert list(store) == ['School A', 'School B']
+    assert [name for name, _site in store.items()] == ['School A', 'School B']
+
+    # the index is used without the JSON file
+    os.remove(path)
+    assert SiteStore(path, index)['School B']['blocks'][0]['name'] == 'b1'
+
+    # and rebuilt when the JSON file changes
+    schools = dict(SCHOOLS, **{'School C': {'blocks': [],
+                                            'shading_blocks': []}})
+    write_schools(path, schools)
+    os.utime(path, (0, 0))
+    assert store['School C']['blocks'] == []
+    assert len(store) == 3